@@ -1,9 +1,34 @@
 import json
 import os
+import threading
 from pathlib import Path
 
-# 页的大小 min page size=173 所有btree中的页全部不存放数据的极端情况,页面大小配置不能超过 32KB
-PAGE_SIZE = 200
+# 新建 container 默认的页大小, 每个 container 的页大小记录在自己的 page 0 中
+PAGE_SIZE = 8 * 1024
+# 页大小的范围, 最小值只用于测试时构造很深的 btree
+MIN_PAGE_SIZE = 256
+MAX_PAGE_SIZE = 64 * 1024
+# 所有 container 共享的页面缓冲池的大小 128MB
+BUFFER_POOL_SIZE = 128 * 1024 * 1024
+# 叶子节点、分支节点、溢出页各自一次预留的连续页数，按字节分配，需要是 8 的倍数，0 表示不使用 extent
+EXTENT_PAGES = 16
+# 顺序读取页面时一次预读的页数，0 表示不预读
+READ_AHEAD_PAGES = 8
+# container 使用 mmap 读取页面，适合读多写少的场景
+CONTAINER_MMAP = False
+# 后台 page cleaner 线程: 每轮间隔(秒) 和 每轮最多写回的脏页数量, 写回速度约为 每轮页数 / 间隔
+# 需要同时开启 OPEN_BINLOG，没有日志时不启动
+PAGE_CLEANER_ENABLED = True
+PAGE_CLEANER_INTERVAL = 0.1
+PAGE_CLEANER_PAGES_PER_ROUND = 64
+# btree bulk_load 对没有排序的输入进行外部排序时，每个排序段在内存中的行数
+BULK_LOAD_SORT_RUN_ROWS = 100000
+# btree 删除之后节点已用空间低于页大小的这个比例时，和兄弟节点合并或者重新分配，0 表示只在节点只剩一行时处理
+# 需要小于 0.5，否则重新分配之后的两个节点可能仍然低于阈值，之后每次删除都会触发调整
+BTREE_MERGE_FILL_FACTOR = 0.25
+# 新建 btree 默认的右边界 split 比例: 在最右侧的节点末尾插入导致 split 时，左侧节点保留的行的百分比
+# key 递增插入时左侧节点之后不会再有插入，50 表示总是从中间 split，100 表示新的行单独放到一个新的节点
+BTREE_APPEND_SPLIT_PERCENT = 90
 # btree信息存放的页
 BTREE_INFO_PAGE_NUM = 1
 # 存放所有container的目录
@@ -35,8 +60,11 @@ def container_size(container_name: str) -> int:
     path = Path(CONTAINER_PATH) / container_name
     return os.path.getsize(path)
 
+# page cleaner 线程也会修改 meta 数据
+_meta_lock = threading.RLock()
+
 def write_meta_data(data):
-    with open(META_PATH, "w", encoding="utf-8") as f:
+    with _meta_lock, open(META_PATH, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
 
 def read_meta_data():
@@ -64,10 +92,33 @@ _meta_data = read_meta_data()
 
 
 def add_container(container:str):
-    if container not in _meta_data["container_name_to_id"]:
-        container_id = len(_meta_data["container_name_to_id"])
-        _meta_data["container_name_to_id"][container] = container_id
-        _meta_data["container_id_to_name"][container_id] = container
+    with _meta_lock:
+        if container not in _meta_data["container_name_to_id"]:
+            container_id = len(_meta_data["container_name_to_id"])
+            _meta_data["container_name_to_id"][container] = container_id
+            _meta_data["container_id_to_name"][container_id] = container
+            write_meta_data(_meta_data)
+
+def replace_container(src_container: str, dst_container: str):
+    """
+    使用 src_container 的文件替换 dst_container 的文件，并移除 src_container 的记录
+    """
+    os.replace(Path(CONTAINER_PATH) / src_container, Path(CONTAINER_PATH) / dst_container)
+    with _meta_lock:
+        container_id = _meta_data["container_name_to_id"].pop(src_container)
+        _meta_data["container_id_to_name"].pop(container_id, None)
+        _meta_data["container_id_to_name"].pop(str(container_id), None)
+        write_meta_data(_meta_data)
+
+def get_check_point() -> int:
+    return _meta_data["redo_log"]["check_point"]
+
+def set_check_point(check_point: int):
+    """
+    记录 checkpoint，恢复时从这个日志位置开始重放
+    """
+    with _meta_lock:
+        _meta_data["redo_log"]["check_point"] = check_point
         write_meta_data(_meta_data)
 
 def get_container_id(container_name:str):
@@ -0,0 +1,157 @@
+import threading
+from typing import Dict, List, Hashable
+
+import config
+from store.cacheable import CacheablePage
+
+
+class BufferPool:
+    """
+    容量有限的页面缓冲池, 使用 CLOCK 算法淘汰页面
+    每个页面有一个访问标识, 时钟指针扫描到页面时, 如果访问标识为 True 就清除它(给页面第二次机会), 否则淘汰该页面
+    pin_count > 0 的页面不会被淘汰, 在读取或创建其他页面之后还要继续修改的页面需要先 pin,
+    否则页面可能已经被淘汰, 之后的修改写到了不在缓冲池中的副本上
+    所有页面都不能淘汰时, 缓冲池允许暂时超过容量
+    """
+
+    def __init__(self, capacity: int | None = None):
+        """
+        :param capacity: 缓冲池容量(字节), 默认 config.BUFFER_POOL_SIZE
+        """
+        self._lock = threading.Lock()
+        self.capacity = capacity or config.BUFFER_POOL_SIZE
+        # 已经使用的字节数
+        self.used = 0
+        self.pages: Dict[Hashable, CacheablePage] = {}
+        self.referenced: Dict[Hashable, bool] = {}
+        # 时钟环中存放页面的 key, None 表示空闲的位置
+        self.clock: List[Hashable | None] = []
+        self.frame_index: Dict[Hashable, int] = {}
+        self.free_frames: List[int] = []
+        self.hand = 0
+
+    def __contains__(self, key: Hashable):
+        return key in self.pages
+
+    def get(self, key: Hashable) -> CacheablePage | None:
+        with self._lock:
+            page = self.pages.get(key)
+            if page is not None:
+                self.referenced[key] = True
+            return page
+
+    def put(self, key: Hashable, page: CacheablePage, referenced: bool = True):
+        """
+        放入页面, 已经存在相同 key 的页面时直接替换
+        :param key:
+        :param page:
+        :param referenced: 预读的页面还没有被访问, 不设置访问标识, 没有用到时优先淘汰
+        :return:
+        """
+        with self._lock:
+            old_page = self.pages.get(key)
+            if old_page is not None:
+                self.used += page.page_size - old_page.page_size
+            else:
+                while self.used + page.page_size > self.capacity:
+                    if not self._evict():
+                        break
+                if self.free_frames:
+                    frame = self.free_frames.pop()
+                    self.clock[frame] = key
+                else:
+                    frame = len(self.clock)
+                    self.clock.append(key)
+                self.frame_index[key] = frame
+                self.used += page.page_size
+            self.pages[key] = page
+            self.referenced[key] = referenced
+
+    def resize(self, capacity: int):
+        """
+        修改缓冲池容量, 超过容量时淘汰页面
+        :param capacity: 缓冲池容量(字节)
+        :return:
+        """
+        with self._lock:
+            self.capacity = capacity
+            while self.used > self.capacity:
+                if not self._evict():
+                    break
+
+    def remove(self, key: Hashable):
+        """
+        移除页面, 不会写回脏页
+        :param key:
+        :return:
+        """
+        with self._lock:
+            if key in self.pages:
+                self._remove(key)
+
+    def items(self):
+        with self._lock:
+            return list(self.pages.items())
+
+    def dirty_pages(self) -> List[CacheablePage]:
+        """
+        返回缓冲池中的脏页，以及已经开始修改但还没有标记为脏的页面
+        :return:
+        """
+        with self._lock:
+            return [page for page in self.pages.values() if page.dirty or page.rec_lsn is not None]
+
+    def pin_dirty_pages(self) -> List[CacheablePage]:
+        """
+        返回并 pin 缓冲池中的脏页, 在缓冲池锁内 pin, 返回之后页面不会被淘汰, 调用方使用完之后需要 unpin
+        :return:
+        """
+        with self._lock:
+            pages = [page for page in self.pages.values() if page.dirty]
+            for page in pages:
+                page.pin()
+            return pages
+
+    def _remove(self, key: Hashable):
+        page = self.pages.pop(key)
+        del self.referenced[key]
+        frame = self.frame_index.pop(key)
+        self.clock[frame] = None
+        self.free_frames.append(frame)
+        self.used -= page.page_size
+
+    def _evict(self) -> bool:
+        """
+        淘汰一个页面, 脏页先写回文件
+        :return: 是否淘汰了页面
+        """
+        # 第一圈清除访问标识, 第二圈一定可以找到可淘汰的页面
+        for _ in range(2 * len(self.clock)):
+            frame = self.hand
+            self.hand = (self.hand + 1) % len(self.clock)
+            key = self.clock[frame]
+            if key is None:
+                continue
+            page = self.pages[key]
+            if page.pin_count > 0:
+                continue
+            if self.referenced[key]:
+                self.referenced[key] = False
+                continue
+            self.write_back(page)
+            self._remove(key)
+            return True
+        return False
+
+    @staticmethod
+    def write_back(page: CacheablePage):
+        """
+        写回脏页, 写入页面之前会先刷新 binlog, 保证页面 lsn 之前的日志已经持久化
+        同一个 container 可能被打开多次, 写回后刷新文件缓冲区，其他文件对象才能读到
+        :param page:
+        :return:
+        """
+        if not page.dirty:
+            return
+        page.write_page_cache()
+        page.container.flush_page_cache()
@@ -1,4 +1,7 @@
 
+import contextlib
+import threading
+
 """
 页面类型
 """
@@ -6,18 +9,83 @@ OVER_FLOW_PAGE = 1
 NORMAL_PAGE = 0
 MANAGEMENT_PAGE = 2
 
+"""
+连续分配页面的 extent 类型，同一类型的页面从同一个 extent 中分配
+"""
+EXTENT_LEAF = 'leaf'
+EXTENT_BRANCH = 'branch'
+EXTENT_OVER_FLOW = 'over_flow'
+
 class CacheablePage:
     """
     缓存页的统一父类
     """
-    def __init__(self, page_num: int, page_data: bytearray):
+    def __init__(self, page_num: int, page_data: bytearray | memoryview):
         self.page_num = page_num
         self.page_data = page_data
+        # 页的大小由所属 container 决定
+        self.page_size = len(page_data)
         self.container = None
         self.container_id = None
         self.dirty = False
         self.lsn = 0
         self.page_type = 0
+        # 页面内容的版本号，每次通过 log_struct 修改页面都会增加，用于判断基于页面内容的缓存是否失效
+        self.version = 0
+        # 正在使用页面的数量，大于0时页面不会被缓冲池淘汰
+        self.pin_count = 0
+        # 页面第一次变脏时的日志位置(recovery lsn)，干净的页面为 None，page cleaner 按它的顺序写回脏页并计算 checkpoint
+        self.rec_lsn = None
+        # 页面锁，保证后台线程复制页面时不会读到修改了一半的页面
+        self.latch = threading.Lock()
+
+    def pin(self):
+        self.pin_count += 1
+
+    def unpin(self):
+        self.pin_count -= 1
+
+    @contextlib.contextmanager
+    def pinned(self):
+        """
+        with 语句内 pin 页面，期间读取或者创建其他页面时这个页面不会被淘汰
+        :return:
+        """
+        self.pin()
+        try:
+            yield self
+        finally:
+            self.unpin()
+
+    def materialize(self):
+        """
+        mmap 模式下页面内容是只读的 memoryview，第一次修改之前复制为 bytearray
+        :return:
+        """
+        if not isinstance(self.page_data, bytearray):
+            self.page_data = bytearray(self.page_data)
+
+    def take_snapshot(self, lsn: int) -> bytes:
+        """
+        在页面锁内设置 lsn 并复制页面内容，同时把页面标记为干净，之后的修改会重新把页面变脏
+        :param lsn: 写入页面的日志位置
+        :return: 需要写入文件的页面内容
+        """
+        with self.latch:
+            self.mark_clean(lsn)
+            return bytes(self.page_data)
+
+    def mark_clean(self, lsn: int):
+        """
+        设置 lsn 并把页面标记为干净，调用方需要持有页面锁，并在释放锁之前写出页面内容
+        :param lsn: 写入页面的日志位置
+        :return:
+        """
+        self.materialize()
+        self.set_lsn(lsn)
+        self.dirty = False
+        self.rec_lsn = None
+
     def sync(self):
         pass
 
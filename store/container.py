@@ -1,14 +1,22 @@
+import mmap
 import os
 import threading
 
 import config
 import struct
 from store import log_struct
-from typing import Dict
+from typing import Dict, List
 from store.cacheable import *
 from store.log.binlog import binlog
 from store.page import  CommonPage
 from store.pagedatacache import page_data_cache
+from store.pagecleaner import page_cleaner
+
+
+# container 格式标识，用于识别记录了页大小的 container，页面格式不兼容时修改
+CONTAINER_MAGIC = 0x43544E54
+# 一次 pwritev 最多写入的页数，不超过系统 IOV_MAX 的限制
+PWRITEV_MAX_PAGES = 1024
 
 
 class ManagementPage(CacheablePage):
@@ -16,22 +24,53 @@ class ManagementPage(CacheablePage):
     页面类型: page_type  1
     空闲页面数量  free 4
     下一个管理页面位置: next_management 4
+    页的大小: page_size 4  page 0 中记录的是整个 container 的页大小
+    格式标识: magic 4
     日志记录号 8
     """
     def __init__(self,page_num:int,page_data:bytearray):
         super().__init__(page_num, page_data)
 
-        self.page_type,self.free,self.next_management,self.lsn = log_struct.unpack_from(ManagementPage.header_fmt(),page_data,0)
+        self.page_type,self.free,self.next_management,_,self.magic,self.lsn = log_struct.unpack_from(ManagementPage.header_fmt(),page_data,0)
+        # 位图中这个字节之前的位都已经设置，查找空闲位时从这里开始
+        self.free_byte_hint = 0
 
     @staticmethod
     def header_fmt():
-        return '<biiL'
+        return '<biiiiL'
+
+    @staticmethod
+    def read_page_size(header: bytes) -> int:
+        """
+        从 page 0 的头部读取 container 的页大小, 未初始化的 container 返回 0
+        :param header: page 0 头部的内容
+        :return:
+        """
+        if len(header) < ManagementPage.header_size():
+            return 0
+        page_type, _, _, page_size, magic, _ = struct.unpack_from(ManagementPage.header_fmt(), header, 0)
+        if page_type == 0:
+            return 0
+        if page_type != MANAGEMENT_PAGE or not ManagementPage.has_magic(header):
+            raise Exception('container 格式不兼容，没有记录页大小。旧格式的 btree 可以使用 BTree.migrate_btree 迁移, '
+                            '其他的 container 需要重新创建')
+        return page_size
+
+    @staticmethod
+    def has_magic(header: bytes) -> bool:
+        """
+        page 0 的头部是否有当前格式的标识
+        :param header: page 0 头部的内容
+        :return:
+        """
+        return struct.unpack_from(ManagementPage.header_fmt(), header, 0)[4] == CONTAINER_MAGIC
 
     def init(self):
         #未初始化的管理页面，进行初始化
         if self.page_type == 0:
             self.page_type = MANAGEMENT_PAGE
-            self.free = ManagementPage.capacity()
+            self.free = self.capacity()
+            self.magic = CONTAINER_MAGIC
             self.write_header()  # 初始元数据
 
     def lsn_offset(self) -> int:
@@ -44,7 +83,8 @@ class ManagementPage(CacheablePage):
 
     def write_header(self):
         self.dirty = True
-        log_struct.pack_into(ManagementPage.header_fmt(),self,0, self.page_type, self.free, self.next_management,self.lsn)
+        log_struct.pack_into(ManagementPage.header_fmt(),self,0, self.page_type, self.free, self.next_management,
+                             self.page_size, self.magic, self.lsn)
 
     def set_bit(self, bit_pos):
         self.dirty = True
@@ -53,7 +93,7 @@ class ManagementPage(CacheablePage):
         """设置位图中指定位为1"""
         byte_offset = ManagementPage.header_size() + (bit_pos // 8)
         bit_offset = bit_pos % 8
-        if byte_offset < config.PAGE_SIZE:
+        if byte_offset < self.page_size:
             log_struct.set_page_single_byte(self,byte_offset, self.page_data[byte_offset] | (1 << bit_offset))
 
     def clear_bit(self, bit_pos):
@@ -61,19 +101,65 @@ class ManagementPage(CacheablePage):
         self.free+=1
         self.sync()
         """将位图中指定位设置为0"""
+        self.free_byte_hint = min(self.free_byte_hint, bit_pos // 8)
         byte_offset =  ManagementPage.header_size() + (bit_pos // 8)
         bit_offset = bit_pos % 8
-        if byte_offset <  config.PAGE_SIZE:
+        if byte_offset <  self.page_size:
             log_struct.set_page_single_byte(self,byte_offset,self.page_data[byte_offset] & ~(1 << bit_offset))
 
     def is_bit_set(self, bit_pos):
         """检查位图中指定位是否为1"""
         byte_offset = ManagementPage.header_size() + (bit_pos // 8)
         bit_offset = bit_pos % 8
-        if byte_offset >= config.PAGE_SIZE:
+        if byte_offset >= self.page_size:
             return False
         return (self.page_data[byte_offset] & (1 << bit_offset)) != 0
 
+    def find_free_bit(self) -> int:
+        """
+        查找位图中第一个为0的位，每次比较8个字节，跳过全部为1的字
+        :return: 位的位置，没有空闲位时返回 -1
+        """
+        if not self.is_free():
+            return -1
+        start = ManagementPage.header_size()
+        end = self.page_size
+        pos = start + self.free_byte_hint
+        while pos < end:
+            chunk_end = min(pos + 8, end)
+            word = int.from_bytes(self.page_data[pos:chunk_end], 'little')
+            full = (1 << (8 * (chunk_end - pos))) - 1
+            if word != full:
+                self.free_byte_hint = pos - start
+                # (word + 1) & ~word 只保留最低的0位
+                return (pos - start) * 8 + ((word + 1) & ~word).bit_length() - 1
+            pos = chunk_end
+        self.free_byte_hint = end - start
+        return -1
+
+    def find_free_run(self, byte_count: int) -> int:
+        """
+        查找连续 byte_count 个为0的字节
+        :param byte_count:
+        :return: 第一个位的位置，没有时返回 -1
+        """
+        if self.free < byte_count * 8:
+            return -1
+        start = ManagementPage.header_size()
+        data = self.page_data if isinstance(self.page_data, bytearray) else bytes(self.page_data)
+        pos = data.find(bytes(byte_count), start + self.free_byte_hint)
+        if pos == -1:
+            return -1
+        return (pos - start) * 8
+
+    def set_bits(self, bit_pos: int, byte_count: int):
+        """
+        设置从 bit_pos 开始的 byte_count 个字节的位，bit_pos 需要按字节对齐
+        """
+        self.free -= byte_count * 8
+        self.sync()
+        log_struct.set_page_data(self, ManagementPage.header_size() + bit_pos // 8, b'\xff' * byte_count)
+
     def sync(self):
         self.write_header()
 
@@ -84,32 +170,51 @@ class ManagementPage(CacheablePage):
     def header_size()->int:
         return struct.calcsize(ManagementPage.header_fmt())
 
-    @staticmethod
-    def capacity():
+    def capacity(self):
         """获取管理页面的管理容量（位）"""
-        return (config.PAGE_SIZE  - ManagementPage.header_size()) * 8
+        return (self.page_size  - ManagementPage.header_size()) * 8
 
 
 class PageManager:
-    """页面管理系统"""
+    """页面管理系统
+    内存中记录管理页面链表中每个管理页面的空闲页数量，以及第一个可能有空闲页的管理页面(游标)，
+    分配页面时从游标开始查找，不需要每次从第一个管理页面开始遍历
+    """
     def __init__(self,container):
         self.container = container
-        self.first_page = container.get_or_create_manage_page(0)
+        first_page = container.get_or_create_manage_page(0)
+        # 每个管理页面管理的页数，不持有 page 0 的页面对象，mmap 模式下页面对象会引用文件映射
+        self.management_capacity = first_page.capacity()
+        # 已经加载的管理页面页号，按照链表顺序
+        self.management_pages: List[int] = [0]
+        # 管理页面页号 -> 在 management_pages 中的位置
+        self.management_index: Dict[int, int] = {0: 0}
+        # 每个管理页面的空闲页数量
+        self.free_counts: List[int] = [first_page.free]
+        # 这个位置之前的管理页面都没有空闲页
+        self.cursor = 0
+        # 这个位置之前的管理页面都没有能分配 extent 的连续空闲页
+        self.extent_cursor = 0
 
     @staticmethod
     def next_management_page_num(management_page:ManagementPage)->int:
         """
             计算下一个 管理页码的 真实物理页号
         """
-        return (ManagementPage.capacity() +1 ) + management_page.page_num
+        return (management_page.capacity() +1 ) + management_page.page_num
 
     def free_page(self,page_num:int):
-        pos = page_num % (ManagementPage.capacity() +1 )
+        pos = page_num % (self.management_capacity + 1)
         if pos == 0:
             raise Exception('管理页面不允许释放')
         management_page = page_num - pos
         page = self.container.get_or_create_manage_page(management_page)
         page.clear_bit(pos-1)
+        index = self.management_index.get(management_page)
+        if index is not None:
+            self.free_counts[index] = page.free
+            self.cursor = min(self.cursor, index)
+            self.extent_cursor = min(self.extent_cursor, index)
 
     def alloc_page(self):
         management_page,pos = self._allocate_page()
@@ -120,37 +225,133 @@ class PageManager:
         """分配新页面
         返回 管理页面的 页号 和 偏移量， 真实的 物理页号需要再进行一次计算
         """
-        current = self.first_page
         while True:
-            if current.is_free():
-                # 在当前管理页面寻找空闲位
-                for pos in range(ManagementPage.capacity()):
-                    if not current.is_bit_set(pos):
-                        current.set_bit(pos)
-                        return current.page_num,pos
-            if current.next_management == 0:
-                #计算新管理页码的物理页号
-                new_mg_page_num = PageManager.next_management_page_num(current)
-                current.next_management =  new_mg_page_num
-                current.write_header()
-            else:
-                new_mg_page_num = current.next_management
-            # 需要创建新管理页面
-            new_mgmt = self.container.get_or_create_manage_page(new_mg_page_num)
-            current = new_mgmt
+            if self.cursor == len(self.management_pages):
+                self._load_next_management_page()
+            if self.free_counts[self.cursor] > 0:
+                current = self.container.get_or_create_manage_page(self.management_pages[self.cursor])
+                pos = current.find_free_bit()
+                if pos != -1 and pos < current.capacity():
+                    current.set_bit(pos)
+                    self.free_counts[self.cursor] = current.free
+                    return current.page_num,pos
+                self.free_counts[self.cursor] = 0
+            self.cursor += 1
+
+    def is_allocated(self, page_num: int) -> bool:
+        """
+        页面是否已经分配，管理页面返回 False
+        """
+        pos = page_num % (self.management_capacity + 1)
+        if pos == 0:
+            return False
+        page = self.container.get_or_create_manage_page(page_num - pos)
+        return page.is_bit_set(pos - 1)
+
+    def allocated_count(self) -> int:
+        """
+        所有管理页面中已经分配的页面数量，不包括管理页面，预留给 extent 的页面也算作已经分配
+        """
+        count = 0
+        page_num = 0
+        while True:
+            page = self.container.get_or_create_manage_page(page_num)
+            count += page.capacity() - page.free
+            if page.next_management == 0:
+                return count
+            page_num = page.next_management
+
+    def allocated_pages(self) -> List[int]:
+        """
+        所有已经分配的页面的物理页号，不包括管理页面
+        """
+        result = []
+        page_num = 0
+        while True:
+            page = self.container.get_or_create_manage_page(page_num)
+            start = ManagementPage.header_size()
+            for byte_i in range(page.page_size - start):
+                byte = page.page_data[start + byte_i]
+                # 跳过没有分配任何页面的字节
+                if byte == 0:
+                    continue
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        result.append(page_num + byte_i * 8 + bit + 1)
+            if page.next_management == 0:
+                return result
+            page_num = page.next_management
+
+    def alloc_extent(self, page_count: int) -> List[int]:
+        """
+        分配一段连续的页面，按字节分配，页数向上取整到 8 的倍数
+        :param page_count:
+        :return: 物理页号
+        """
+        byte_count = (page_count + 7) // 8
+        index = max(self.cursor, self.extent_cursor)
+        self.extent_cursor = index
+        while True:
+            if index == len(self.management_pages):
+                self._load_next_management_page()
+            if self.free_counts[index] >= byte_count * 8:
+                current = self.container.get_or_create_manage_page(self.management_pages[index])
+                pos = current.find_free_run(byte_count)
+                if pos != -1:
+                    current.set_bits(pos, byte_count)
+                    self.free_counts[index] = current.free
+                    return [current.page_num + pos + 1 + i for i in range(byte_count * 8)]
+            index += 1
+            self.extent_cursor = index
+
+    def _load_next_management_page(self):
+        """
+        加载链表中的下一个管理页面，没有时创建新管理页面
+        :return:
+        """
+        current = self.container.get_or_create_manage_page(self.management_pages[-1])
+        if current.next_management == 0:
+            #计算新管理页码的物理页号
+            new_mg_page_num = PageManager.next_management_page_num(current)
+            current.next_management =  new_mg_page_num
+            current.write_header()
+        else:
+            new_mg_page_num = current.next_management
+        # 需要创建新管理页面
+        new_mgmt = self.container.get_or_create_manage_page(new_mg_page_num)
+        self.management_index[new_mg_page_num] = len(self.management_pages)
+        self.management_pages.append(new_mg_page_num)
+        self.free_counts.append(new_mgmt.free)
 
 
 class Container:
-    def __init__(self, container_name: str | None = None, log:bool = True):
+    def __init__(self, container_name: str | None = None, log:bool = True, page_size: int | None = None):
         self._lock = threading.Lock()
+        # 文件读写锁，page cleaner 线程和前台线程都会读写文件
+        self._file_lock = threading.RLock()
+        # 是否有写入文件但还没有 fsync 的页面
+        self.unsynced = False
         self.container_name = container_name
         self.file = config.create_container_if_need(container_name)
-        self.cache:Dict[int,CacheablePage]={}
+        # 页的大小, 已经存在的 container 使用 page 0 中记录的页大小
+        self.page_size = self.init_page_size(page_size)
         #container的唯一标识符
         self.container_id = config.get_container_id(container_name)
         #统一配置是否记录container页面变更
         self.log = log
         self.page_manager = None
+        # 每种 extent 预留但还没有使用的页号
+        self.extents: Dict[str, List[int]] = {}
+        # 上一次没有命中缓存的页号，以及连续顺序读取没有命中的次数，用于检测顺序读取
+        self._last_miss = -1
+        self._sequential_misses = 0
+        # mmap 模式下读取页面直接使用文件映射的只读 memoryview，页面第一次修改时才复制
+        self.use_mmap = config.CONTAINER_MMAP
+        self._mmap = None
+        # 扩大映射时仍然被页面引用的旧映射，不再被引用后关闭
+        self._old_mmaps = []
+        # mmap 模式下缓存文件大小，避免每次读取页面都查询文件大小
+        self.file_size = self.file.seek(0, os.SEEK_END)
 
     def init(self):
         """
@@ -159,33 +360,108 @@ class Container:
         """
         self.page_manager = PageManager(self)
 
+    def init_page_size(self, page_size: int | None) -> int:
+        """
+        新建的 container 使用指定的页大小(默认 config.PAGE_SIZE)，已经存在的 container 读取 page 0 中记录的页大小
+        :param page_size:
+        :return:
+        """
+        self.file.seek(0)
+        stored_page_size = ManagementPage.read_page_size(self.file.read(ManagementPage.header_size()))
+        if stored_page_size != 0:
+            if page_size and page_size != stored_page_size:
+                raise Exception(f'container {self.container_name} 的页大小是 {stored_page_size}，不是 {page_size}')
+            return stored_page_size
+        if not page_size:
+            page_size = config.PAGE_SIZE
+        if page_size < config.MIN_PAGE_SIZE or page_size > config.MAX_PAGE_SIZE:
+            raise Exception(f'页大小需要在 {config.MIN_PAGE_SIZE} 和 {config.MAX_PAGE_SIZE} 之间')
+        return page_size
+
     def get_size(self):
-        return config.container_size(self.container_name)
+        if self.use_mmap:
+            return self.file_size
+        # 通过文件对象获取大小，包含还在缓冲区中没有写入文件的数据
+        return self.file.seek(0, os.SEEK_END)
 
     def seek_page(self, page_number: int):
-        offset = page_number * config.PAGE_SIZE
+        offset = page_number * self.page_size
         self.file.seek(offset)
 
     def seek_offset(self, offset: int):
         self.file.seek(offset)
 
     def read_page(self, page_number: int, page_data: bytearray):
-        cur_eof = self.get_size()
-        read_end =(page_number + 1) * config.PAGE_SIZE
-        #读取的页是新的页
-        if cur_eof < read_end:
-            self.pad_file(read_end)
-        self.seek_page(page_number)
-        page_data.extend(self.file.read(config.PAGE_SIZE))
+        with self._file_lock:
+            cur_eof = self.get_size()
+            read_end =(page_number + 1) * self.page_size
+            #读取的页是新的页
+            if cur_eof < read_end:
+                self.pad_file(read_end)
+            self.seek_page(page_number)
+            page_data.extend(self.file.read(self.page_size))
+
+    def load_page_data(self, page_number: int) -> bytearray | memoryview:
+        """
+        读取页面内容，mmap 模式下返回文件映射的只读 memoryview，不发生系统调用和复制
+        :param page_number:
+        :return:
+        """
+        if not self.use_mmap:
+            page_data = bytearray()
+            self.read_page(page_number, page_data)
+            return page_data
+        with self._file_lock:
+            read_end = (page_number + 1) * self.page_size
+            # 读取的页是新的页
+            if self.file_size < read_end:
+                self.pad_file(read_end)
+            if self._mmap is None or len(self._mmap) < read_end:
+                self.remap()
+            return memoryview(self._mmap)[read_end - self.page_size:read_end]
+
+    def remap(self):
+        """
+        按照当前文件大小重新映射文件，旧映射可能还有页面在使用，不能立即关闭
+        :return:
+        """
+        if self._mmap is not None:
+            self._old_mmaps.append(self._mmap)
+        self._mmap = mmap.mmap(self.file.fileno(), self.file_size, access=mmap.ACCESS_READ)
+        self._old_mmaps = [m for m in self._old_mmaps if not Container.close_mmap(m)]
+
+    @staticmethod
+    def close_mmap(m: mmap.mmap) -> bool:
+        """
+        关闭映射，还有 memoryview 引用映射时返回 False
+        """
+        try:
+            m.close()
+            return True
+        except BufferError:
+            return False
 
     def pad_file(self, offset: int):
         cur_eof = self.get_size()
+        if cur_eof >= offset:
+            return
+        if hasattr(os, 'posix_fallocate'):
+            # 文件对象缓冲区中的数据需要先写入文件，再预分配文件尾部，新的部分都是 0
+            self.file.flush()
+            os.posix_fallocate(self.file.fileno(), cur_eof, offset - cur_eof)
+            self.file_size = offset
+            return
+        if self.use_mmap:
+            # 映射读取的是文件内容，扩展文件大小即可，新的部分都是 0
+            os.ftruncate(self.file.fileno(), offset)
+            self.file_size = offset
+            return
         self.file.seek(cur_eof)
-        zero_data = bytearray(config.PAGE_SIZE)
+        zero_data = bytearray(self.page_size)
         while cur_eof < offset:
             diff = offset - cur_eof
-            if diff > config.PAGE_SIZE:
-                diff = config.PAGE_SIZE
+            if diff > self.page_size:
+                diff = self.page_size
             self.file.write(zero_data[:diff])
             cur_eof = cur_eof + diff
 
@@ -197,13 +473,40 @@ class Container:
         """
         self.page_manager.free_page(page_num)
 
+    def free_over_flow_page(self, page_num: int):
+        """
+        释放 over flow 页面，页面头部重置为普通页面:
+        其他页面中可能还记录着这个页号作为追加写入的 over flow 页面，页面重新分配之前它们不能继续写入
+        :param page_num:
+        :return:
+        """
+        self.get_page(page_num).init_page_header(is_over_flow=False)
+        self.free_page(page_num)
 
-    def write_page(self, page_number: int, page_data: bytearray):
-        offset = page_number * config.PAGE_SIZE
-        self.seek_offset(offset)
-        if  self.get_size() < offset:
-            self.pad_file(offset)
-        self.file.write(page_data)
+    def is_over_flow_page(self, page_num: int) -> bool:
+        """
+        page_num 是否是已经分配的 over flow 页面
+        :param page_num:
+        :return:
+        """
+        return self.page_manager.is_allocated(page_num) and self.get_page(page_num).page_type == OVER_FLOW_PAGE
+
+
+    def write_page(self, page_number: int, page_data: bytearray | bytes):
+        with self._file_lock:
+            offset = page_number * self.page_size
+            if self.use_mmap:
+                # 不经过文件对象的缓冲区，写入后映射立即可见
+                os.pwrite(self.file.fileno(), page_data, offset)
+                self.file_size = max(self.file_size, offset + len(page_data))
+                self.unsynced = True
+                return
+            # get_size 会移动文件位置，需要在 seek 之前调用
+            if  self.get_size() < offset:
+                self.pad_file(offset)
+            self.seek_offset(offset)
+            self.file.write(page_data)
+            self.unsynced = True
 
     def add_page(self):
         pass
@@ -213,92 +516,286 @@ class Container:
 
     def get_or_create_manage_page(self,page_num:int):
         with self._lock:
-            if page_num in self.cache:
-                return self.cache[page_num]
-            page_data = bytearray()
-            self.read_page(page_num, page_data)
+            page = page_data_cache.get(self.container_id, page_num)
+            if page is not None:
+                return page
+            page_data = self.load_page_data(page_num)
             page = ManagementPage(page_num,page_data)
             page.set_container(self)
             page.init()
-            self.cache[page_num] = page
+            page_data_cache.set(self.container_id, page_num, page)
             return page
 
     def get_page(self,page_num:int):
+        with self._lock:
+            page = page_data_cache.get(self.container_id, page_num)
+            if page is not None:
+                return page
+            page = self.create_page(page_num, self.load_page_data(page_num))
+            page_data_cache.set(self.container_id, page_num, page)
+            read_ahead = self.read_ahead_pages(page_num)
+        # 预读需要访问管理页面，在 _lock 之外执行，预读的页面不能淘汰刚读取的页面
+        if read_ahead:
+            with page.pinned():
+                self.prefetch(read_ahead)
+        return page
+
+    def create_page(self, page_num: int, page_data: bytearray | memoryview):
         from store.page import CommonPage
+        page_type = log_struct.unpack_from('<b',page_data,0)[0]
+        if page_type == MANAGEMENT_PAGE:
+                page = ManagementPage(page_num,page_data)
+        else:
+                page = CommonPage(page_num, page_data)
+        page.set_container(self)
+        page.init()
+        return page
+
+    def read_ahead_pages(self, page_num: int) -> List[int]:
+        """
+        连续两次没有命中的页号是相邻的，认为是顺序读取(叶子节点链表、溢出页链表)，返回需要预读的页号
+        :param page_num: 没有命中缓存的页号
+        :return:
+        """
+        if page_num == self._last_miss + 1:
+            self._sequential_misses += 1
+        else:
+            self._sequential_misses = 0
+        self._last_miss = page_num
+        # mmap 模式由操作系统预读
+        if self.use_mmap or config.READ_AHEAD_PAGES <= 0 or self._sequential_misses == 0:
+            return []
+        # 预读的页面之后的第一个页面没有命中时，仍然是顺序读取
+        self._last_miss = page_num + config.READ_AHEAD_PAGES
+        return list(range(page_num + 1, page_num + 1 + config.READ_AHEAD_PAGES))
+
+    def prefetch(self, page_nums: List[int]):
+        """
+        预读页面放入缓存，页号连续的页面合并为一次读取，跳过已经在缓存中、没有分配以及超出文件大小的页面
+        B+tree 扫描时可以直接调用，提示接下来要访问的页面
+        :param page_nums:
+        :return:
+        """
+        if self.use_mmap:
+            return
+        with self._file_lock:
+            file_pages = self.get_size() // self.page_size
+        page_nums = [page_num for page_num in sorted(set(page_nums))
+                     if page_num < file_pages and self.page_manager.is_allocated(page_num)]
         with self._lock:
-            if page_num in self.cache:
-                return self.cache[page_num]
-            page_data = bytearray()
-            self.read_page(page_num, page_data)
-            page_type = log_struct.unpack_from('<b',page_data,0)[0]
-            if page_type == MANAGEMENT_PAGE:
-                    page = ManagementPage(page_num,page_data)
+            page_nums = [page_num for page_num in page_nums if not page_data_cache.contains(self.container_id, page_num)]
+            start = 0
+            for i in range(1, len(page_nums) + 1):
+                if i == len(page_nums) or page_nums[i] != page_nums[i - 1] + 1:
+                    page_datas = self.read_pages(page_nums[start], i - start)
+                    for page_num, page_data in zip(page_nums[start:i], page_datas):
+                        page_data_cache.set(self.container_id, page_num, self.create_page(page_num, page_data), False)
+                    start = i
+
+    def read_pages(self, page_num: int, count: int) -> List[bytearray]:
+        """
+        一次读取多个连续的页面，页面需要在文件范围内
+        :param page_num: 第一个页号
+        :param count:
+        :return:
+        """
+        page_datas = [bytearray(self.page_size) for _ in range(count)]
+        with self._file_lock:
+            if hasattr(os, 'preadv'):
+                # 文件对象缓冲区中的数据需要先写入文件
+                self.file.flush()
+                os.preadv(self.file.fileno(), page_datas, page_num * self.page_size)
             else:
-                    page = CommonPage(page_num, page_data)
-            page.set_container(self)
-            page.init()
-            self.cache[page_num] = page
-            return page
+                self.seek_page(page_num)
+                for page_data in page_datas:
+                    self.file.readinto(page_data)
+        return page_datas
 
-    def new_common_page(self,is_over_flow:bool = False):
+    def alloc_page_num(self, extent: str | None = None) -> int:
+        """
+        分配页号，指定 extent 类型时从该类型预留的连续页面中分配，用完后再预留 config.EXTENT_PAGES 个页面
+        :param extent: EXTENT_LEAF EXTENT_BRANCH EXTENT_OVER_FLOW
+        :return:
+        """
+        if extent is None or config.EXTENT_PAGES <= 0:
+            return self.page_manager.alloc_page()
+        page_nums = self.extents.get(extent)
+        if not page_nums:
+            page_nums = self.page_manager.alloc_extent(config.EXTENT_PAGES)
+            with self._file_lock:
+                self.pad_file((page_nums[-1] + 1) * self.page_size)
+            page_nums.reverse()
+            self.extents[extent] = page_nums
+        return page_nums.pop()
+
+    def new_common_page(self,is_over_flow:bool = False, extent: str | None = None):
         from store.page import CommonPage
-        page_data = bytearray(config.PAGE_SIZE)
-        page_num = self.page_manager.alloc_page()
+        page_data = bytearray(self.page_size)
+        page_num = self.alloc_page_num(extent)
         page = CommonPage(page_num,page_data)
         page.set_container(self)
         if is_over_flow:
             page.init_page_header(is_over_flow=True)
         else:
             page.init_page_header(is_over_flow=False)
-        self.cache[page_num] = page
+        page_data_cache.set(self.container_id, page_num, page)
         return page
 
 
 
     def close(self):
-        self.file.close()
+        """
+        关闭文件之前写回由当前 container 对象加载的脏页，并将这些页面移出全局缓存，它们持有的文件对象即将失效
+        关闭前执行 fsync，page cleaner 记录 checkpoint 时不再需要处理已经关闭的 container
+        :return:
+        """
+        page_cleaner.unregister(self)
+        # 释放预留但没有使用的页面
+        for page_nums in self.extents.values():
+            for page_num in page_nums:
+                self.free_page(page_num)
+        self.extents = {}
+        pages = [page for page in page_data_cache.container_pages(self.container_id) if page.container is self]
+        self.write_pages([page for page in pages if page.dirty])
+        for page in pages:
+            page_data_cache.delete(self.container_id, page.page_num)
+        # mmap 模式下页面引用文件映射，关闭映射之前释放这里的引用
+        pages = page = None
+        with self._file_lock:
+            self.sync()
+            for m in self._old_mmaps + [self._mmap]:
+                if m is not None:
+                    Container.close_mmap(m)
+            self._mmap = None
+            self._old_mmaps = []
+            self.file.close()
 
     def write_single_page(self,page:CacheablePage):
         """
         写入单页，到page cache 不 flush
+        复制页面和写入文件在同一个文件锁内完成，page cleaner 执行 fsync 时不会遗漏已经标记为干净的页面
         :param page:
         :return:
         """
-        page.set_lsn(binlog.log_end_pos())
-        self.write_page(page.page_num,page.page_data)
+        with self._file_lock:
+            if self.file.closed:
+                return
+            page_data = page.take_snapshot(binlog.log_end_pos())
+            # 写入页面之前先刷新 binlog，保证页面 lsn 之前的日志已经持久化
+            if config.OPEN_BINLOG and self.log:
+                binlog.flush()
+            self.write_page(page.page_num, page_data)
+
+    def write_pages(self, pages: List[CacheablePage]):
+        """
+        按页号顺序写入多个页面，页号连续的页面合并为一次 os.pwritev，到page cache 不 flush
+        :param pages:
+        :return:
+        """
+        if not pages:
+            return
+        pages = sorted(pages, key=lambda page: page.page_num)
+        with self._file_lock:
+            if self.file.closed:
+                return
+            if not hasattr(os, 'pwritev'):
+                for page in pages:
+                    self.write_single_page(page)
+                return
+            # 文件对象缓冲区中的数据需要先写入文件，否则之后会覆盖 pwritev 写入的数据
+            self.file.flush()
+            start = 0
+            for i in range(1, len(pages) + 1):
+                if (i == len(pages) or pages[i].page_num != pages[i - 1].page_num + 1
+                        or i - start >= PWRITEV_MAX_PAGES):
+                    self.write_page_run(pages[start:i])
+                    start = i
+            self.unsynced = True
+
+    def write_page_run(self, pages: List[CacheablePage]):
+        """
+        写入页号连续的页面，写入期间持有这些页面的锁，直接写出页面内容，不需要复制
+        :param pages:
+        :return:
+        """
+        for page in pages:
+            page.latch.acquire()
+        try:
+            log_end_pos = binlog.log_end_pos()
+            for page in pages:
+                page.mark_clean(log_end_pos)
+            # 写入页面之前先刷新 binlog，保证页面 lsn 之前的日志已经持久化
+            if config.OPEN_BINLOG and self.log:
+                binlog.flush()
+            self.pwritev(pages[0].page_num * self.page_size, [page.page_data for page in pages])
+        finally:
+            for page in pages:
+                page.latch.release()
+
+    def pwritev(self, offset: int, buffers: List[bytes | bytearray]):
+        """
+        从 offset 开始连续写入多个缓冲区，没有一次写完时写入剩余的部分
+        :param offset:
+        :param buffers:
+        :return:
+        """
+        total = sum(len(buffer) for buffer in buffers)
+        written = os.pwritev(self.file.fileno(), buffers, offset)
+        if written < total:
+            rest = b''.join(buffers)[written:]
+            while rest:
+                n = os.pwrite(self.file.fileno(), rest, offset + written)
+                written += n
+                rest = rest[n:]
+        self.file_size = max(self.file_size, offset + total)
 
     def flush_page_cache(self):
         """
         刷新 page cache
         :return:
         """
-        self.file.flush()
+        with self._file_lock:
+            if not self.file.closed:
+                self.file.flush()
 
     def flush_single_page(self,page:CacheablePage):
         #刷新页面时设置lsn
-        page.set_lsn(binlog.log_end_pos())
-        self.write_page(page.page_num,page.page_data)
-        self.file.flush()
+        with self._file_lock:
+            self.write_single_page(page)
+            self.flush_page_cache()
 
-    def flush(self):
+    def sync(self):
         """
-        刷新 container 所有 page，几乎不会用到
+        把已经写入的页面 fsync 到磁盘
         :return:
         """
-        for k, v in self.cache.items():
-            log_end_pos = binlog.log_end_pos()
-            if v.dirty:
-                v.set_lsn(log_end_pos)
-                self.write_page(k,v.page_data)
-                v.dirty = False
-        self.file.flush()
-        os.fsync(self.file.fileno())
+        with self._file_lock:
+            if self.unsynced and not self.file.closed:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.unsynced = False
+
+    def flush(self, lsn_limit: int | None = None):
+        """
+        刷新 container 的脏页并 fsync
+        :param lsn_limit: 只刷新 rec_lsn 小于 lsn_limit 的脏页，之后 checkpoint 可以推进到 lsn_limit，默认刷新所有脏页
+        :return:
+        """
+        pages = []
+        for page in page_data_cache.container_pages(self.container_id):
+            if not page.dirty:
+                continue
+            if lsn_limit is None or (page.rec_lsn is not None and page.rec_lsn < lsn_limit):
+                pages.append(page)
+        self.write_pages(pages)
+        self.sync()
 
 
     @staticmethod
-    def open_container(container_name: str | None = None, log:bool = True):
-        container = Container(container_name,log)
+    def open_container(container_name: str | None = None, log:bool = True, page_size: int | None = None):
+        container = Container(container_name,log,page_size)
         container.init()
+        page_cleaner.register(container)
         return container
     @staticmethod
     def open_container_by_id(container_id: int | None = None, log:bool = True):
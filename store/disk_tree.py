@@ -1,99 +1,177 @@
+import bisect
+import contextlib
+import heapq
+import itertools
 import os.path
-from typing import Tuple, List
+import pickle
+import struct
+import tempfile
+from typing import Tuple, List, Iterable, Iterator, Callable
 
 import typing
 
 import config
 from store.container import Container
+from store.legacy import LegacyContainer
+from store.log.binlog import binlog
+from store.cacheable import EXTENT_LEAF, EXTENT_BRANCH
 from store.page import Record, CommonPage, SLOT_TABLE_ENTRY_SIZE
-from store.values import StrValue, BoolValue, value_type_dict
+from store.values import StrValue, BoolValue, value_type_dict, ByteArray, encode_key
 from store.values import Row, generate_row, IntValue, Value,ValueType,IntArrayValue,ModelBase
 
 
-# 叶子/分支节点都包含的信息
-class ControlRow:
-    def __init__(self, node_type: int = None, parent: int = None, left: int = None, right: int = None):
-        self.node_type = node_type
-        self.parent = parent
-        self.left = left
-        self.right = right
-
-    def to_row(self):
-        return generate_row([self.node_type, self.parent, self.left, self.right])
-
-    def is_root(self):
-        return self.parent == -1
-
-
 class BranchRow:
-    def __init__(self, key: Row, child: int):
+    def __init__(self, key: bytes, child: int, count: int | None = None):
+        """
+        :param key: 编码后的分隔符, 第0行的分隔符不使用
+        :param child:
+        :param count: 子树中的行数, 没有开启 counted 的 btree 为 None
+        """
         self.key = key
         self.child = child
+        self.count = count
 
-    def to_row(self) -> Row:
-        result = self.key.values.copy()
-        result.append(IntValue(self.child))
-        return Row(result)
+    def to_row(self, prefix: bytes = b'') -> Row:
+        """
+        存储结构: 去掉页面公共前缀之后的分隔符, child, 开启 counted 时还有子树中的行数
+        :param prefix: 页面中分隔符的公共前缀
+        :return:
+        """
+        values = [ByteArray(bytearray(self.key[len(prefix):])), IntValue(self.child)]
+        if self.count is not None:
+            values.append(IntValue(self.count))
+        return Row(values)
+
+
+def separator(left_key: bytes, right_key: bytes) -> bytes:
+    """
+    后缀截断: 返回满足 left_key < s <= right_key 的最短的 right_key 前缀
+    key 的编码按字节比较，并且每一列都是自定界的，截断后的分隔符和完整的 key 一样可以引导查找
+    left_key 和 right_key 相等时(允许重复 key)不能截断
+    """
+    if left_key >= right_key:
+        return right_key
+    i = 0
+    n = min(len(left_key), len(right_key))
+    while i < n and left_key[i] == right_key[i]:
+        i += 1
+    return right_key[:i + 1]
+
+
+def common_prefix(keys: List[bytes]) -> bytes:
+    if not keys:
+        return b''
+    # 有序的 key 的公共前缀就是最小和最大的 key 的公共前缀
+    lo, hi = min(keys), max(keys)
+    i = 0
+    n = min(len(lo), len(hi))
+    while i < n and lo[i] == hi[i]:
+        i += 1
+    return lo[:i]
 
 
 LEAF_NODE = 0
 BRANCH_NODE = 1
 
 
+class DecodedNode:
+    """
+    解析后的分支节点内容，缓存在页面上，页面修改后失效: 分隔符的公共前缀，每一行完整的分隔符、child 和子树中的行数
+    """
+    def __init__(self, prefix: bytes, keys: List[bytes], children: List[int], counts: List[int | None]):
+        self.prefix = prefix
+        self.keys = keys
+        self.children = children
+        self.counts = counts
+
+
 class Node:
     def __init__(self, page: CommonPage):
         self.page = page
-        self.control_row: ControlRow | None = None
         self.tree = None
 
     def row_num(self):
         """
-        去掉 control row
+        节点类型和左右节点保存在页面头部，每个 slot 都是一行
         :return:
         """
-        return self.page.slot_num - 1
-
-    def child_index(self, child) -> int:
-        pass
+        return self.page.slot_num
 
     def find_index_for_key_insert(self, k) -> int:
         pass
 
     def remove_i(self, i: int):
-        self.page.delete_by_slot(i + 1)
+        self.page.delete_by_slot(i)
 
     def get_row_i(self, i: int):
         pass
 
+    def get_key_i(self, i: int) -> bytearray:
+        """
+        读取第 i 行编码后的key, 只读取第一个字段，不构建 Value
+        :param i:
+        :return:
+        """
+        return self.page.read_first_field_data(i)
+
+    def lower_bound(self, key: bytes, lo: int = 0) -> int:
+        """
+        二分查找第一个 >= key 的行, key 是编码后的key，可以只包含前几列
+        :param key:
+        :param lo: 查找的起始位置
+        :return:
+        """
+        hi = self.row_num()
+        key_len = len(key)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_key_i(mid)[:key_len] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def upper_bound(self, key: bytes, lo: int = 0) -> int:
+        """
+        二分查找第一个 > key 的行, key 是编码后的key，可以只包含前几列
+        :param key:
+        :param lo: 查找的起始位置
+        :return:
+        """
+        hi = self.row_num()
+        key_len = len(key)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < self.get_key_i(mid)[:key_len]:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
     def get_last_row(self):
         pass
 
     def is_root(self):
-        return self.control_row.parent == -1
+        btree: BTree = self.tree
+        return btree.tree.page_num() == self.page_num()
 
     def page_num(self):
         return self.page.page_num
 
-    def parent(self) -> int:
-        return self.control_row.parent
-
-    def set_parent(self, parent: int):
-        self.control_row.parent = parent
-        self.page.update_by_slot(self.control_row.to_row(), 0)
+    def node_type(self):
+        return self.page.node_type
 
     def left(self):
-        return self.control_row.left
+        return self.page.node_left
 
     def right(self):
-        return self.control_row.right
+        return self.page.node_right
 
     def set_left(self, left: int):
-        self.control_row.left = left
-        self.page.update_by_slot(self.control_row.to_row(), 0)
+        self.page.set_node_header(self.page.node_type, left, self.page.node_right)
 
     def set_right(self, right: int):
-        self.control_row.right = right
-        self.page.update_by_slot(self.control_row.to_row(), 0)
+        self.page.set_node_header(self.page.node_type, self.page.node_left, right)
 
     def get_right_node(self):
         btree: BTree = self.tree
@@ -102,13 +180,6 @@ class Node:
             return btree.read_node(right_page_num)
         return None
 
-    def get_parent_node(self):
-        btree: BTree = self.tree
-        parent_page_num = self.parent()
-        if parent_page_num != -1:
-            return btree.read_branch_node(parent_page_num)
-        return None
-
     def get_left_node(self):
         btree: BTree = self.tree
         left_page_num = self.left()
@@ -116,20 +187,45 @@ class Node:
             return btree.read_node(left_page_num)
         return None
 
+    def used_space(self) -> int:
+        """
+        记录和 slot table 在页面中占用的空间，不包括页头
+        """
+        return self.page.page_size - self.page.header_size() - self.page.cal_free_space()
+
+    def is_under_fill(self) -> bool:
+        """
+        删除之后是否需要和兄弟节点合并或者重新分配
+        """
+        return self.row_num() <= 1 or self.used_space() < config.BTREE_MERGE_FILL_FACTOR * self.page.page_size
+
+    def delete_over_flow_rows(self):
+        """
+        页面整体释放之前调用，删除部分内容在 over flow 页面中的行，over flow 页面中的空间才能重新使用
+        """
+        for slot in range(self.page.slot_num - 1, -1, -1):
+            if self.page.has_over_flow_by_slot(slot):
+                self.page.delete_by_slot(slot)
+
+    def can_move_row_to(self, row_i: int, target_node) -> bool:
+        """
+        第 row_i 行在页面中的部分能否直接移动到 target_node 的页面
+        """
+        _, record_len = self.page.read_slot_entry(row_i)
+        return record_len + SLOT_TABLE_ENTRY_SIZE < target_node.page.cal_free_space()
+
     def move_single_row_to_another(self, src_row_i, target_row_i, target_node):
         target_node: Node
-        self.page.move_single_slot_to_another_page(src_row_i + 1, target_row_i + 1, target_node.page)
+        self.page.move_single_slot_to_another_page(src_row_i, target_row_i, target_node.page)
 
     def read_and_delete_page(self, src_slot, target_slot, page, row_list):
         btree: BTree = self.tree
-        is_branch_node = self.control_row.node_type == BRANCH_NODE
         for i in range(src_slot, target_slot):
-            record = page.read_slot(i)
-            if is_branch_node:
-                row_list.append(btree.parse_branch_row(record).to_row())
-            else:
-                row_list.append(btree.parse_leaf_row(record))
-            page.decrease_slot_num()
+            # 删除之后后续的slot会前移，所以总是读取 src_slot
+            record = page.read_slot(src_slot)
+            row_list.append(btree.leaf_record_row(btree.parse_leaf_row(record)))
+            # record 在页中的物理顺序和 slot 的顺序不一致，需要真正删除以回收空间
+            page.delete_by_slot(src_slot)
 
     @staticmethod
     def insert_row_list_to_page(row_list, page):
@@ -143,8 +239,7 @@ class Node:
     def move_to_another_node(self, src, target, other_node):
         other_node: Node
         # 在页中的slot位置
-        src_slot = src + 1
-        target_slot = target + 1
+        src_slot, target_slot = src, target
         cur_page = self.page
         other_page = other_node.page
 
@@ -157,11 +252,11 @@ class Node:
             record_offset, record_len = cur_page.read_slot_entry(i)
             all_record.append((record_offset, record_len))
             need_space += record_len + SLOT_TABLE_ENTRY_SIZE
-        # other_node不够存放，需要将other_node中除了Control Row以外的所有数据都进行over flow
+        # other_node不够存放，需要将other_node中的所有数据都进行over flow
         if need_space > other_page.cal_free_space():
             row_list = []
             # 读取other_page的数据
-            self.read_and_delete_page(1, other_page.slot_num, other_page, row_list)
+            self.read_and_delete_page(0, other_page.slot_num, other_page, row_list)
             # 读取当前 page的数据
             self.read_and_delete_page(src_slot, target_slot, cur_page, row_list)
             self.insert_row_list_to_page(row_list, other_page)
@@ -174,141 +269,189 @@ class LeafNode(Node):
         super().__init__(page)
 
     def __repr__(self):
-        return f'page_num:{self.page_num()},control_row: {self.control_row}'
+        return f'page_num:{self.page_num()},left: {self.left()},right: {self.right()}'
 
-    def key_index(self, key):
+    def key_index(self, key: Row):
+        encoded_key = encode_key(key)
         # key值相等的地方
-        eq_index = None
-        # 符合插入条件的地方
-        insert_index = None
-        for i in range(self.row_num()):
-            row_i = self.get_row_i(i)
-            if eq_index is None and key == row_i:
-                eq_index = i
-            if insert_index is None and key < row_i:
-                insert_index = i
-            if eq_index and insert_index:
-                break
-        if eq_index is None:
+        eq_index = self.lower_bound(encoded_key)
+        if eq_index == self.row_num() or self.get_key_i(eq_index)[:len(encoded_key)] != encoded_key:
             eq_index = -1
-        if insert_index is None:
-            insert_index = self.row_num()
+        # 符合插入条件的地方
+        insert_index = self.upper_bound(encoded_key, max(eq_index, 0))
         return eq_index, insert_index
 
-    def find_index_for_key_insert(self, key):
-        for i in range(self.row_num()):
-            row_i = self.get_row_i(i)
-            if key < row_i:
-                return i
-        return self.row_num()
+    def find_index_for_key_insert(self, key: Row):
+        return self.upper_bound(encode_key(key))
 
     def get_row_i(self, i: int) -> Row:
-        """
-        b tree中的下标真正使用时，要 + 1， 因为 每页里面都有  control row
-
-        :param i:
-        :return:
-        """
         btree: BTree = self.tree
-        return btree.parse_leaf_row(self.page.read_slot(i + 1))
+        return btree.parse_leaf_row(self.page.read_slot(i))
 
     def get_last_row(self):
         btree: BTree = self.tree
         return btree.parse_leaf_row(self.page.read_slot(self.page.slot_num - 1))
 
     def update_row_i(self, i, value: Row):
-        self.page.update_by_slot(value, i + 1)
+        btree: BTree = self.tree
+        self.page.update_by_slot(btree.leaf_record_row(value), i)
 
     def insert_row(self, i: int, value: Row):
-        result, _ = self.page.insert_slot(value, i + 1)
+        btree: BTree = self.tree
+        result, _ = self.page.insert_slot(btree.leaf_record_row(value), i)
         if result == -1:
             return False
         return True
 
 
 class BranchNode(Node):
+    """
+    分支节点每一行是 分隔符 和 child, 第0行的分隔符不使用
+    页面中的分隔符去掉公共前缀之后存储，公共前缀保存在第0行的分隔符字段中
+    分支节点的行总是按行读取后重新写入，不直接在页面之间移动 record, 保证每一行都按照所在页面的前缀存储
+    """
     def __init__(self, page: CommonPage):
         super().__init__(page)
 
-    def child_index(self, child: int):
-        for i in range(self.row_num()):
-            row_i = self.get_row_i(i)
-            if row_i.child == child:
-                return i
-        return -1
-
-    def find_index_for_key_insert(self, k):
+    def find_index_for_key_insert(self, k: Row):
         # 第0个key一定是none
-        for i in range(1, self.row_num()):
-            row_i = self.get_row_i(i)
-            if k < row_i.key:
-                return i
-        return self.row_num()
+        return self.upper_bound(encode_key(k), 1)
 
-    def set_child_parent(self, page_num: int = None):
-        if page_num is None:
-            page_num = self.page_num()
-        btree: BTree = self.tree
-        for i in range(self.row_num()):
-            row_i = self.get_row_i(i)
-            child = btree.read_branch_node(row_i.child)
-            child.set_parent(page_num)
-
-    def get_row_i(self, i: int) -> BranchRow:
+    def get_child_i(self, i: int) -> int:
         """
-        b tree中的下标真正使用时，要 + 1， 因为 每页里面都有  control row
-
+        读取第 i 行的 child
         :param i:
         :return:
         """
-        btree: BTree = self.tree
-        return btree.parse_branch_row(self.page.read_slot(i + 1))
+        return self.decoded().children[i]
 
-    def get_last_row(self):
-        btree: BTree = self.tree
-        return btree.parse_branch_row(self.page.read_slot(self.page.slot_num - 1))
+    def get_key_i(self, i: int) -> bytes:
+        return self.decoded().keys[i]
 
-    def append_row(self, row: BranchRow):
-        result, _ = self.page.insert_to_last_slot(row.to_row())
-        if result == -1:
-            raise Exception('insert b tree error')
+    def lower_bound(self, key: bytes, lo: int = 0) -> int:
+        key_len = len(key)
+        return bisect.bisect_left(self.decoded().keys, key, lo, key=lambda k: k[:key_len])
 
-    def update_row_i(self, i, value: BranchRow):
-        self.page.update_by_slot(value.to_row(), i + 1)
+    def upper_bound(self, key: bytes, lo: int = 0) -> int:
+        key_len = len(key)
+        return bisect.bisect_right(self.decoded().keys, key, lo, key=lambda k: k[:key_len])
 
-    def update_row_i_child(self, i, child: int):
+    def decoded(self) -> DecodedNode:
         btree: BTree = self.tree
-        # child是最后一个字段
-        self.page.update_slot_field_by_index(i + 1, btree.key_len, IntValue(child))
+        return btree.decode_node(self.page)
+
+    def prefix(self) -> bytes:
+        return self.decoded().prefix
 
     def get_row_i(self, i: int) -> BranchRow:
-        """
-        b tree中的下标真正使用时，要 + 1， 因为 每页里面都有  control row
+        decoded = self.decoded()
+        return BranchRow(decoded.keys[i], decoded.children[i], decoded.counts[i])
 
-        :param i:
-        :return:
+    def get_last_row(self) -> BranchRow:
+        return self.get_row_i(self.row_num() - 1)
+
+    def rows(self) -> List[BranchRow]:
+        decoded = self.decoded()
+        return [BranchRow(key, child, count) for key, child, count in zip(decoded.keys, decoded.children, decoded.counts)]
+
+    def get_count_i(self, i: int) -> int:
         """
-        btree: BTree = self.tree
-        return btree.parse_branch_row(self.page.read_slot(i + 1))
+        第 i 个子树中的行数
+        """
+        return self.decoded().counts[i]
 
-    def get_last_row(self) -> BranchRow:
-        btree: BTree = self.tree
-        return btree.parse_branch_row(self.page.read_slot(self.page.slot_num - 1))
+    def total_count(self) -> int:
+        return sum(self.decoded().counts)
+
+    def stored_row(self, i: int, row: BranchRow, prefix: bytes) -> Row:
+        # 第0行的分隔符字段保存公共前缀
+        if i == 0:
+            return BranchRow(prefix, row.child, row.count).to_row()
+        return row.to_row(prefix)
+
+    def update_row_i(self, i, value: BranchRow):
+        prefix = self.prefix()
+        if i > 0 and not value.key.startswith(prefix):
+            rows = self.rows()
+            rows[i] = value
+            self.rebuild(rows)
+            return
+        self.page.update_by_slot(self.stored_row(i, value, prefix), i)
+
+    def update_row_i_count(self, i, count: int):
+        # 第三个字段是子树中的行数, 每次插入删除都会修改, 直接修改解析后的内容，不需要重新解析整个页面
+        decoded = self.decoded()
+        self.page.update_slot_field_by_index(i, 2, IntValue(count))
+        decoded.counts[i] = count
+        self.page.decoded_node_version = self.page.version
+
+    def remove_i(self, i: int):
+        decoded = self.decoded()
+        prefix = decoded.prefix
+        next_row = BranchRow(prefix, decoded.children[1], decoded.counts[1]) if i == 0 and len(decoded.children) > 1 else None
+        self.page.delete_by_slot(i)
+        # 第1行成为第0行，分隔符字段改为保存公共前缀
+        if next_row is not None:
+            self.page.update_by_slot(next_row.to_row(), 0)
 
     def insert_row(self, i: int, value: BranchRow):
-        result, _ = self.page.insert_slot(value.to_row(), i + 1)
+        """
+        在第 i 行插入，i 为 0 时只能是空的页面
+        分隔符不包含页面的公共前缀时，按照新的公共前缀重新构建页面
+        :param i:
+        :param value:
+        :return: 页面放不下时返回 False
+        """
+        decoded = self.decoded()
+        prefix = decoded.prefix
+        if i > 0 and not value.key.startswith(prefix):
+            rows = self.rows()
+            rows.insert(i, value)
+            return self.rebuild(rows, self.row_num() < 3)
+        result, _ = self.page.insert_slot(self.stored_row(i, value, prefix), i)
         if result == -1:
             # 一个 branch row 最少也要有三条记录，才能够进行 split branch操作
             if self.row_num() < 3:
                 # 插入失败，需要调整空间，将 page的内容全部over flow
-                row_list = []
-                self.read_and_delete_page(1, self.page.slot_num, self.page, row_list)
-                row_list.insert(i, value.to_row())
-                self.insert_row_list_to_page(row_list, self.page)
-                return True
+                rows = self.rows()
+                rows.insert(i, value)
+                return self.rebuild(rows, True)
             return False
+        # 直接修改解析后的内容，不需要重新解析整个页面
+        decoded.keys.insert(i, prefix if i == 0 else value.key)
+        decoded.children.insert(i, value.child)
+        decoded.counts.insert(i, value.count)
+        self.page.decoded_node_version = self.page.version
         return True
 
+    def clear(self):
+        """
+        删除所有的行，over flow 的部分一起删除
+        """
+        for slot in range(self.page.slot_num - 1, -1, -1):
+            self.page.delete_by_slot(slot)
+
+    def rebuild(self, rows: List[BranchRow], spill: bool = True) -> bool:
+        """
+        使用 rows 重新写入页面，公共前缀按照第1行开始的分隔符重新计算
+        :param rows:
+        :param spill: 页面放不下时，是否将所有行 over flow 到其他页面
+        :return: 是否写入成功
+        """
+        old_rows = self.rows()
+        self.clear()
+        prefix = common_prefix([row.key for row in rows[1:]])
+        for j, row in enumerate(rows):
+            if self.page.insert_to_last_slot(self.stored_row(j, row, prefix))[0] == -1:
+                break
+        else:
+            return True
+        self.clear()
+        if not spill:
+            self.rebuild(old_rows)
+            return False
+        self.insert_row_list_to_page([self.stored_row(j, row, prefix) for j, row in enumerate(rows)], self.page)
+        return True
 
 
 class BTreeInfo(ModelBase):
@@ -319,14 +462,19 @@ class BTreeInfo(ModelBase):
     duplicate_key  是否支持key重复
     root 根节点 page
     value_types 每条record种值的类型
+    append_split_percent 在最右侧的节点末尾插入导致 split 时，左侧节点保留的行的百分比
+    counted 分支节点的每一行是否记录子树中的行数，开启后 count、rank、nth 只需要从根节点查找一次
     """
     name = StrValue
     key_len = IntValue
     duplicate_key = BoolValue
     root = IntValue
     value_types = IntArrayValue
+    append_split_percent = IntValue
+    counted = BoolValue
 
-    def __init__(self,name: str,root:int, key_len: int,  duplicate_key:bool,value_types: List[typing.Type[Value]]):
+    def __init__(self,name: str,root:int, key_len: int,  duplicate_key:bool,value_types: List[typing.Type[Value]],
+                 append_split_percent: int | None = None, counted: bool | None = False):
         super().__init__()
         self.name:str = name
         self.key_len:int = key_len
@@ -334,6 +482,12 @@ class BTreeInfo(ModelBase):
         self.root = root
         #类型的数值表示
         self.value_types:List[int] = [value_type.type_enum().value for value_type in value_types]
+        if append_split_percent is None:
+            append_split_percent = config.BTREE_APPEND_SPLIT_PERCENT
+        if not 50 <= append_split_percent <= 100:
+            raise Exception('append_split_percent 需要在 50 和 100 之间')
+        self.append_split_percent: int = append_split_percent
+        self.counted: bool = bool(counted)
 
 
 
@@ -354,12 +508,20 @@ class BTreeInfo(ModelBase):
     @staticmethod
     def parse_record(record:Record):
         bytearray_list:List[bytearray] = [field.value for field in record.fields]
+        # 旧的 btree 信息没有后来新增的字段，按照空值解析，使用默认值
+        bytearray_list += [bytearray()] * (len(BTreeInfo.__mappings__) - len(bytearray_list))
         return BTreeInfo.parse_from_bytes_list(bytearray_list,{"value_types":BTreeInfo.value_types_converter})
 
 class BTree:
 
     @staticmethod
-    def create_btree(btree: BTreeInfo,if_not_exist:bool = False):
+    def create_btree(btree: BTreeInfo,if_not_exist:bool = False, page_size: int | None = None):
+        """
+        :param btree:
+        :param if_not_exist:
+        :param page_size: container 的页大小，默认使用 config.PAGE_SIZE
+        :return:
+        """
         if config.container_exists(btree.name):
             if  not if_not_exist:
                 raise Exception(f'btree {btree.name} already exists')
@@ -367,18 +529,56 @@ class BTree:
                 return
         #记录
         config.add_container(btree.name)
+        container = Container.open_container(btree.name, page_size=page_size)
+        BTree.init_btree_container(btree, container)
+        container.close()
+
+    @staticmethod
+    def init_btree_container(btree: BTreeInfo, container: Container):
         #page 1 总是存放 btree的信息
-        container = Container.open_container(btree.name)
         btree_info_page = container.new_common_page(is_over_flow=False)
-        #创建根节点
-        root_page = container.new_common_page()
-        control_row = ControlRow(LEAF_NODE, -1, -1, -1)
-        root_page.insert_to_last_slot(control_row.to_row())
-        #记录节点信息
-        btree.root = root_page.page_num
-        btree_info_page.insert_to_last_slot(btree.to_row())
+        with btree_info_page.pinned():
+            #创建根节点
+            root_page = container.new_common_page()
+            root_page.set_node_header(LEAF_NODE, -1, -1)
+            #记录节点信息
+            btree.root = root_page.page_num
+            btree_info_page.insert_to_last_slot(btree.to_row())
+        container.flush()
+
+    @staticmethod
+    def migrate_btree(name: str, page_size: int):
+        """
+        将 btree 迁移到新的页大小的 container 中: 按照顺序读取所有的行写入新的 container, 然后替换原来的文件
+        旧格式(固定 200 字节的页, 没有记录页大小)的 container 通过 LegacyContainer 读取
+        迁移期间不能有其他地方打开这个 btree
+        :param name:
+        :param page_size: 新的页大小
+        :return:
+        """
+        if LegacyContainer.is_legacy(name):
+            old_container = LegacyContainer(name)
+            btree_info = BTreeInfo.parse_record(old_container.read_slot(config.BTREE_INFO_PAGE_NUM, 0))
+            value_types = btree_info.generate_real_value_types()
+            rows = (LegacyContainer.parse_row(record, value_types) for record in old_container.leaf_records(btree_info.root))
+        else:
+            old_tree = BTree.open_btree(name)
+            old_container = old_tree.container
+            btree_info = BTreeInfo.parse_record(old_container.get_page(config.BTREE_INFO_PAGE_NUM).read_slot(0))
+            rows = old_tree.scan()
+        migrate_name = f'{name}.migrate'
+        config.add_container(migrate_name)
+        container = Container.open_container(migrate_name, page_size=page_size)
+        # btree信息中的名称依然是原来的名称
+        BTree.init_btree_container(btree_info, container)
+        new_tree = BTree(btree_info, container)
+        # 旧格式的行不一定按照当前的 key 编码排序，逐行插入
+        for row in rows:
+            new_tree.insert(row)
         container.flush()
         container.close()
+        old_container.close()
+        config.replace_container(migrate_name, name)
 
     @staticmethod
     def open_btree(name:str):
@@ -388,78 +588,151 @@ class BTree:
         #page 1 总是存放 btree的信息, page 0 是container的页码管理页
         btree_info_page = container.get_page(config.BTREE_INFO_PAGE_NUM)
         btree_info = BTreeInfo.parse_record(btree_info_page.read_slot(0))
-        return BTree(btree_info)
+        return BTree(btree_info, container)
 
 
-    def __init__(self, btree_info:BTreeInfo):
-        self.container = Container.open_container(btree_info.name)
+    def __init__(self, btree_info:BTreeInfo, container: Container | None = None):
+        if container is None:
+            container = Container.open_container(btree_info.name)
+        self.container = container
+        # 每个 pin 作用域中已经 pin 的页面
+        self.pin_scopes: List[List[CommonPage]] = []
+        self._tree = None
         self.tree = self.read_node(btree_info.root)
         self.key_len = btree_info.key_len
         self.value_type = btree_info.generate_real_value_types()
         self.duplicate_key = btree_info.duplicate_key
+        self.append_split_percent = btree_info.append_split_percent
+        self.counted = btree_info.counted
+
+    @property
+    def tree(self) -> Node:
+        return self._tree
+
+    @tree.setter
+    def tree(self, root: Node):
+        # 根节点在 btree 打开期间一直 pin
+        root.page.pin()
+        if self._tree is not None:
+            self._tree.page.unpin()
+        self._tree = root
+
+    @contextlib.contextmanager
+    def pin_scope(self):
+        """
+        with 语句内读取和创建的节点的页面都会被 pin，退出时 unpin
+        修改节点时可能读取或者创建其他页面，没有 pin 的节点可能已经被淘汰，之后的修改写到了不在缓冲池中的副本上
+        只读的操作不需要 pin，淘汰之后的副本内容仍然是正确的
+        :return:
+        """
+        pages = []
+        self.pin_scopes.append(pages)
+        try:
+            yield
+        finally:
+            self.pin_scopes.pop()
+            for page in pages:
+                page.unpin()
+
+    def pin_node(self, node: Node) -> Node:
+        """
+        在当前的 pin 作用域中 pin 节点的页面，不在作用域中时不 pin
+        """
+        node.tree = self
+        if self.pin_scopes:
+            node.page.pin()
+            self.pin_scopes[-1].append(node.page)
+        return node
 
-    def create_leaf_node(self, parent: int):
-        page = self.container.new_common_page()
-        leaf = LeafNode(page)
-        leaf.control_row = ControlRow(LEAF_NODE, parent, -1, -1)
-        page.insert_to_last_slot(leaf.control_row.to_row())
-        leaf.tree = self
-        return leaf
+    def create_leaf_node(self):
+        page = self.container.new_common_page(extent=EXTENT_LEAF)
+        page.set_node_header(LEAF_NODE, -1, -1)
+        return self.pin_node(LeafNode(page))
 
     def read_node(self, page_num: int) -> LeafNode:
         page = self.container.get_page(page_num)
-        control_row = self.parse_control_row(page.read_slot(0))
-        if control_row.node_type == LEAF_NODE:
-            node = LeafNode(page)
-        else:
-            node = BranchNode(page)
-        node.control_row = self.parse_control_row(page.read_slot(0))
-        node.tree = self
-        return node
+        if page.node_type == LEAF_NODE:
+            return self.pin_node(LeafNode(page))
+        return self.pin_node(BranchNode(page))
 
     def read_branch_node(self, page_num: int) -> BranchNode:
         page = self.container.get_page(page_num)
-        branch = BranchNode(page)
-        branch.control_row = self.parse_control_row(page.read_slot(0))
-        branch.tree = self
-        return branch
-
-    def create_branch_node(self, parent: int):
-        page = self.container.new_common_page()
-        branch = BranchNode(page)
-        branch.control_row = ControlRow(BRANCH_NODE, parent, -1, -1)
-        page.insert_to_last_slot(branch.control_row.to_row())
-        branch.tree = self
-        return branch
-
-    def parse_control_row(self, record: Record):
-        if not len(record.fields) == 4:
-            raise Exception(f'record内容与数据类型不匹配')
-        node_type = IntValue.from_bytes(record.fields[0].value).value
-        parent = IntValue.from_bytes(record.fields[1].value).value
-        left = IntValue.from_bytes(record.fields[2].value).value
-        right = IntValue.from_bytes(record.fields[3].value).value
-        return ControlRow(node_type=node_type, parent=parent, left=left, right=right)
-
-    def parse_branch_row(self, record: Record):
-        if not len(record.fields) == self.key_len + 1:
-            raise Exception(f'record内容与数据类型不匹配')
-        # 第一位是 child
-        child = IntValue.from_bytes(record.fields[-1].value).value
-        # 读取key的内容
-        key = []
-        for i in range(self.key_len):
-            if record.fields[i].is_null():
-                key.append(self.value_type[i].none())
-            else:
-                key.append(self.value_type[i].from_bytes(record.fields[i].value))
-        return BranchRow(Row(key), child)
+        return self.pin_node(BranchNode(page))
+
+    def decode_node(self, page: CommonPage) -> DecodedNode:
+        """
+        解析分支节点的内容并缓存在页面上，页面的版本号没有变化时直接使用缓存，上层的分支节点只需要解析一次
+        :param page:
+        :return:
+        """
+        if page.decoded_node_version != page.version:
+            decoded = DecodedNode(b'', [], [], [])
+            for slot in range(page.slot_num):
+                # 第一个字段是去掉公共前缀的分隔符, 第0行保存公共前缀, 第二个字段是 child, 开启 counted 时第三个字段是子树中的行数
+                fields = page.read_slot(slot).fields
+                if slot == 0:
+                    decoded.prefix = bytes(fields[0].value)
+                    decoded.keys.append(decoded.prefix)
+                else:
+                    decoded.keys.append(decoded.prefix + bytes(fields[0].value))
+                decoded.children.append(int.from_bytes(fields[1].value, byteorder='little', signed=True))
+                decoded.counts.append(int.from_bytes(fields[2].value, byteorder='little', signed=True) if len(fields) > 2 else None)
+            page.decoded_node = decoded
+            page.decoded_node_version = page.version
+        return page.decoded_node
+
+    def create_branch_node(self):
+        page = self.container.new_common_page(extent=EXTENT_BRANCH)
+        page.set_node_header(BRANCH_NODE, -1, -1)
+        return self.pin_node(BranchNode(page))
+
+    def subtree_count(self, node: Node) -> int | None:
+        """
+        node 子树中的行数，没有开启 counted 时为 None
+        """
+        if not self.counted:
+            return None
+        if isinstance(node, LeafNode):
+            return node.row_num()
+        return node.total_count()
+
+    def refresh_child_count(self, parent: BranchNode, i: int, child: Node):
+        """
+        子节点的内容变化之后，重新计算父节点中第 i 个子树的行数
+        split、合并和重新分配只在兄弟节点之间移动行，父节点的子树行数之和不变，只需要更新参与的子节点
+        """
+        if not self.counted:
+            return
+        count = self.subtree_count(child)
+        if parent.get_count_i(i) != count:
+            parent.update_row_i_count(i, count)
+
+    def add_count(self, path: List[Tuple[BranchNode, int]], delta: int):
+        """
+        插入或删除一行时，查找路径上每个分支节点中所选子树的行数加上 delta
+        需要在 split 和合并修改查找路径之前调用
+        """
+        if not self.counted:
+            return
+        for branch_node, child_index in path:
+            branch_node.update_row_i_count(child_index, branch_node.get_count_i(child_index) + delta)
+
+    def leaf_record_row(self, row: Row) -> Row:
+        """
+        叶子节点的存储结构: 编码后的key, 数据行
+        :param row:
+        :return:
+        """
+        result = [ByteArray(bytearray(encode_key(self.get_key(row))))]
+        result.extend(row.values)
+        return Row(result)
 
     def parse_leaf_row(self, record: Record):
-        if not len(record.fields) == len(self.value_type):
+        if not len(record.fields) == len(self.value_type) + 1:
             raise Exception(f'record内容与数据类型不匹配')
         result = []
-        for value_type, field in zip(self.value_type, record.fields):
+        # 第0位是编码后的key
+        for value_type, field in zip(self.value_type, record.fields[1:]):
             if field.is_null():
                 result.append(value_type.none())
             else:
@@ -474,106 +747,665 @@ class BTree:
         :param asc: 升序还是降序 (1,1),(1,2),(1,3) 如果升序搜索 (1,)  搜索的是最左边的，如果降序搜索，搜索的是最右边的
         :return:
         """
-        return self._search_part(key,self.tree,asc)
+        return self._search_part(encode_key(key),self.tree,asc)
 
-    def _search_part(self,key,node,asc = True) -> LeafNode | None:
+    def _search_part(self,key:bytes,node,asc = True, path: List[Tuple[BranchNode, int]] | None = None) -> LeafNode | None:
+        """
+        :param key: 编码后的key，可以只包含前几列
+        :param node: 开始查找的节点
+        :param asc: 升序时查找最左侧可能包含 key 的叶子节点，降序时查找最右侧的
+        :param path: 不为 None 时记录查找路径，和 _search 相同
+        :return:
+        """
         # 叶子节点直接返回
         while not isinstance(node, LeafNode):
             branch_node: BranchNode = node
-            i = 1
             row_num = branch_node.row_num()
             if row_num < 1:
                 raise Exception(f'B tree 结构错误:page:{branch_node.page_num()}')
-            while i < row_num:
-                cur_row_key = branch_node.get_row_i(i).key
-                if key < cur_row_key or (key == cur_row_key and asc):
-                    node = self.read_node(branch_node.get_row_i(i - 1).child)
-                    break
-                #什么也不做，进入下一轮
-                elif key == cur_row_key and not asc and i+1 < row_num and branch_node.get_row_i(i+1).key == key:
-                    pass
-                elif key == cur_row_key:
-                    node = self.read_node(branch_node.get_row_i(i).child)
-                    break
-                i += 1
-            if i == row_num:
-                node = self.read_node(branch_node.get_last_row().child)
+            # 升序: 进入第一个 >= key 的分隔符左侧, 降序: 进入最后一个 <= key 的分隔符右侧
+            if asc:
+                i = branch_node.lower_bound(key, 1)
+            else:
+                i = branch_node.upper_bound(key, 1)
+            if path is not None:
+                path.append((branch_node, i - 1))
+            node = self.read_node(branch_node.get_child_i(i - 1))
+        return node
+
+    def scan(self, lo: Row | None = None, hi: Row | None = None, lo_inclusive: bool = True,
+             hi_inclusive: bool = True, reverse: bool = False) -> Iterator[Row]:
+        """
+        按 key 的顺序遍历 [lo, hi] 范围内的行，通过叶子节点的左右指针跨越节点，到达边界后不再读取后面的节点
+        lo 和 hi 可以只包含 key 的前几列，此时按照前缀比较
+        遍历期间不能修改 btree
+        :param lo: 下界，None 表示没有下界
+        :param hi: 上界，None 表示没有上界
+        :param lo_inclusive: 是否包含等于下界的行
+        :param hi_inclusive: 是否包含等于上界的行
+        :param reverse: 是否从大到小遍历
+        :return:
+        """
+        lo_key = None if lo is None else encode_key(lo)
+        hi_key = None if hi is None else encode_key(hi)
+        if not reverse:
+            if lo_key is None:
+                node = self.edge_leaf(False)
+                i = 0
+            else:
+                # 不包含下界时定位到最右侧可能包含下界的叶子节点，之后的节点都大于下界
+                node = self._search_part(lo_key, self.tree, lo_inclusive)
+                i = node.lower_bound(lo_key) if lo_inclusive else node.upper_bound(lo_key)
+            while node:
+                row_num = node.row_num()
+                while i < row_num:
+                    if hi_key is not None:
+                        key = node.get_key_i(i)[:len(hi_key)]
+                        if key > hi_key or (key == hi_key and not hi_inclusive):
+                            return
+                    yield node.get_row_i(i)
+                    i += 1
+                node = node.get_right_node()
+                i = 0
+        else:
+            if hi_key is None:
+                node = self.edge_leaf(True)
+                i = node.row_num() - 1
+            else:
+                node = self._search_part(hi_key, self.tree, not hi_inclusive)
+                i = (node.upper_bound(hi_key) if hi_inclusive else node.lower_bound(hi_key)) - 1
+            while node:
+                while i >= 0:
+                    if lo_key is not None:
+                        key = node.get_key_i(i)[:len(lo_key)]
+                        if key < lo_key or (key == lo_key and not lo_inclusive):
+                            return
+                    yield node.get_row_i(i)
+                    i -= 1
+                node = node.get_left_node()
+                if node:
+                    i = node.row_num() - 1
+
+    def count(self, lo: Row | None = None, hi: Row | None = None, lo_inclusive: bool = True,
+              hi_inclusive: bool = True) -> int:
+        """
+        [lo, hi] 范围内的行数，参数和 scan 相同
+        开启 counted 时分别查找上界和下界之前的行数，否则遍历范围内的行
+        :param lo: 下界，None 表示没有下界
+        :param hi: 上界，None 表示没有上界
+        :param lo_inclusive: 是否包含等于下界的行
+        :param hi_inclusive: 是否包含等于上界的行
+        :return:
+        """
+        if not self.counted:
+            return sum(1 for _ in self.scan(lo, hi, lo_inclusive, hi_inclusive))
+        lo_rank = 0 if lo is None else self.count_before(encode_key(lo), not lo_inclusive)
+        hi_rank = self.subtree_count(self.tree) if hi is None else self.count_before(encode_key(hi), hi_inclusive)
+        return max(0, hi_rank - lo_rank)
+
+    def rank(self, key: Row) -> int:
+        """
+        小于 key 的行数，也就是第一个不小于 key 的行按 key 排序的下标
+        """
+        return self.count(hi=key, hi_inclusive=False)
+
+    def nth(self, i: int) -> Row | None:
+        """
+        按 key 排序的第 i 行(从0开始)，分页时用来跳过前面的行
+        开启 counted 时按照每个子树的行数从根节点查找一次，否则遍历前面的行
+        :param i:
+        :return: 超出范围时返回 None
+        """
+        if i < 0:
+            return None
+        if not self.counted:
+            return next(itertools.islice(self.scan(), i, None), None)
+        node = self.tree
+        while isinstance(node, BranchNode):
+            counts = node.decoded().counts
+            child_index = 0
+            while child_index < len(counts) - 1 and i >= counts[child_index]:
+                i -= counts[child_index]
+                child_index += 1
+            node = self.read_node(node.get_child_i(child_index))
+        if i >= node.row_num():
+            return None
+        return node.get_row_i(i)
+
+    def count_before(self, key: bytes, inclusive: bool) -> int:
+        """
+        key 的前缀小于 key 的行数，inclusive 时包括前缀等于 key 的行，选择子节点的规则和 _search_part 相同
+        左侧子树中的 key 都不大于所选子节点左侧的分隔符，直接累加它们的行数
+        :param key: 编码后的key，可以只包含前几列
+        :param inclusive:
+        :return:
+        """
+        result = 0
+        node = self.tree
+        while isinstance(node, BranchNode):
+            if inclusive:
+                i = node.upper_bound(key, 1)
+            else:
+                i = node.lower_bound(key, 1)
+            result += sum(node.decoded().counts[:i - 1])
+            node = self.read_node(node.get_child_i(i - 1))
+        if inclusive:
+            return result + node.upper_bound(key)
+        return result + node.lower_bound(key)
+
+    def edge_leaf(self, rightmost: bool) -> LeafNode:
+        """
+        返回最左侧或最右侧的叶子节点
+        """
+        node = self.tree
+        while isinstance(node, BranchNode):
+            node = self.read_node(node.get_child_i(node.row_num() - 1 if rightmost else 0))
         return node
 
     def search(self, key):
         """
         支持唯一key查询
         """
-        node = self._search(key, self.tree)
+        node = self._search(encode_key(key), self.tree)
         return node
 
-    def _search(self, key, node, for_insert=False) -> LeafNode | None:
+    def get_many(self, keys: Iterable[Row]) -> List[Row | None]:
+        """
+        批量查找: 按 key 排序后依次查找，key 不大于当前叶子节点的最后一个 key 时复用叶子节点，
+        超过之后先检查右侧相邻的叶子节点，都不在范围内时才从根节点查找，每个叶子节点最多访问一次
+        :param keys:
+        :return: 和 keys 顺序相同的行，key 不存在时为 None，允许重复 key 时返回其中一行
+        """
+        keys = list(keys)
+        items = sorted(((encode_key(key), j) for j, key in enumerate(keys)), key=lambda item: item[0])
+        result: List[Row | None] = [None] * len(keys)
+        leaf: LeafNode | None = None
+        last_key = None
+        # key 是递增的，同一个叶子节点中从上一个 key 的位置开始查找
+        index = 0
+        for key_bytes, j in items:
+            if leaf is not None and key_bytes > last_key:
+                right = leaf.get_right_node()
+                leaf = None
+                if right is not None and right.row_num() > 0 and key_bytes <= right.get_key_i(right.row_num() - 1):
+                    leaf = right
+                    last_key = leaf.get_key_i(leaf.row_num() - 1)
+                    index = 0
+            if leaf is None:
+                leaf = self._search(key_bytes, self.tree)
+                if leaf.row_num() == 0:
+                    # 空的 btree
+                    return result
+                last_key = leaf.get_key_i(leaf.row_num() - 1)
+                index = 0
+            index = leaf.lower_bound(key_bytes, index)
+            if index < leaf.row_num() and leaf.get_key_i(index)[:len(key_bytes)] == key_bytes:
+                result[j] = leaf.get_row_i(index)
+        return result
+
+    def _search(self, key: bytes, node, for_insert=False, path: List[Tuple[BranchNode, int]] | None = None) -> LeafNode | None:
+        """
+        :param key: 编码后的key
+        :param node: 开始查找的节点
+        :param for_insert:
+        :param path: 不为 None 时记录查找路径: 经过的分支节点和进入的子节点下标, split 和合并时用来找到父节点
+        :return:
+        """
         # 叶子节点直接返回
         while not isinstance(node, LeafNode):
             branch_node: BranchNode = node
-            # branchnode 第0行数据的key是不使用的仅占位用
-            i = 1
             row_num = branch_node.row_num()
             if row_num < 1:
                 raise Exception(f'B tree 结构错误:page:{branch_node.page_num()}')
-            while i < row_num:
-                # 如果允许重复插入，新节点，插入左侧节点
-                cur_row_key = branch_node.get_row_i(i).key
-                if key < cur_row_key or (for_insert and key == cur_row_key and self.duplicate_key):
-                    node = self.read_node(branch_node.get_row_i(i - 1).child)
-                    break
-                elif key == cur_row_key:
-                    node = self.read_node(branch_node.get_row_i(i).child)
-                    break
-                i += 1
-            if i == row_num:
-                node = self.read_node(branch_node.get_last_row().child)
+            # branchnode 第0行数据的key是不使用的仅占位用, 从1开始二分查找
+            i = branch_node.lower_bound(key, 1)
+            # 如果允许重复插入，新节点，插入左侧节点
+            if i < row_num and not (for_insert and self.duplicate_key) and key == branch_node.get_key_i(i):
+                child_index = i
+            else:
+                child_index = i - 1
+            if path is not None:
+                path.append((branch_node, child_index))
+            node = self.read_node(branch_node.get_child_i(child_index))
         return node
 
+    def _search_with_fence(self, key: bytes, for_insert=False,
+                           path: List[Tuple[BranchNode, int]] | None = None) -> Tuple[LeafNode, bytes | None]:
+        """
+        和 _search 相同，同时返回叶子节点的上界: 查找路径上所选子节点右侧的分隔符，越深的分隔符越小
+        :param key: 编码后的key
+        :param for_insert:
+        :param path: 记录查找路径
+        :return: 叶子节点，上界(None 表示没有上界)
+        """
+        node = self.tree
+        fence = None
+        while not isinstance(node, LeafNode):
+            branch_node: BranchNode = node
+            row_num = branch_node.row_num()
+            if row_num < 1:
+                raise Exception(f'B tree 结构错误:page:{branch_node.page_num()}')
+            i = branch_node.lower_bound(key, 1)
+            if i < row_num and not (for_insert and self.duplicate_key) and key == branch_node.get_key_i(i):
+                child_index = i
+            else:
+                child_index = i - 1
+            if child_index + 1 < row_num:
+                fence = branch_node.get_key_i(child_index + 1)
+            if path is not None:
+                path.append((branch_node, child_index))
+            node = self.read_node(branch_node.get_child_i(child_index))
+        return node, fence
+
+    def in_fence(self, key: bytes, fence: bytes | None, for_insert=False) -> bool:
+        """
+        key 是否在上界 fence 以内，和 _search 的规则一致: 等于分隔符的 key 进入右侧节点，允许重复 key 插入时进入左侧节点
+        """
+        if fence is None:
+            return True
+        if for_insert and self.duplicate_key:
+            return key <= fence
+        return key < fence
+
+    def insert_many(self, rows: Iterable[Row]):
+        """
+        批量插入: 按 key 排序后依次插入，key 在当前叶子节点的范围内时复用叶子节点，不需要从根节点重新查找
+        叶子节点满了才进行 split，批量产生的日志作为一个整体写入
+        :param rows:
+        :return:
+        """
+        items = sorted(((encode_key(self.get_key(row)), row) for row in rows), key=lambda item: item[0])
+        with binlog.batch():
+            i = 0
+            while i < len(items):
+                # 每个叶子节点上的插入使用一个 pin 作用域，批量插入期间 pin 的页面数量不会一直增加
+                with self.pin_scope():
+                    path = []
+                    leaf, fence = self._search_with_fence(items[i][0], True, path)
+                    while i < len(items) and self.in_fence(items[i][0], fence, True):
+                        row = items[i][1]
+                        i += 1
+                        eq_index, insert_index = leaf.key_index(self.get_key(row))
+                        if eq_index != -1 and not self.duplicate_key:
+                            leaf.update_row_i(eq_index, row)
+                            continue
+                        self.add_count(path, 1)
+                        if leaf.insert_row(insert_index, row):
+                            continue
+                        # split 之后节点的范围发生了变化，下一个 key 重新查找
+                        self.split_leaf_node(leaf, row, insert_index, path)
+                        break
+
+    def delete_many(self, keys: Iterable[Row]) -> int:
+        """
+        批量删除: 按 key 排序后依次删除，key 在当前叶子节点的范围内时复用叶子节点
+        叶子节点中的行不足时才进行合并，批量产生的日志作为一个整体写入
+        :param keys:
+        :return: 删除的行数
+        """
+        items = sorted(((encode_key(key), key) for key in keys), key=lambda item: item[0])
+        deleted = 0
+        with binlog.batch():
+            i = 0
+            while i < len(items):
+                # 每个叶子节点上的删除使用一个 pin 作用域
+                with self.pin_scope():
+                    path = []
+                    leaf, fence = self._search_with_fence(items[i][0], path=path)
+                    while i < len(items) and self.in_fence(items[i][0], fence):
+                        key = items[i][1]
+                        i += 1
+                        index, _ = leaf.key_index(key)
+                        if index == -1:
+                            continue
+                        leaf.remove_i(index)
+                        self.add_count(path, -1)
+                        deleted += 1
+                        # 合并之后节点的范围发生了变化，下一个 key 重新查找
+                        if leaf.is_under_fill() and path:
+                            self.leaf_node_un_balance(leaf, path)
+                            break
+        return deleted
+
+    def delete_range(self, lo: Row | None = None, hi: Row | None = None, lo_inclusive: bool = True,
+                     hi_inclusive: bool = True) -> int:
+        """
+        删除 [lo, hi] 范围内的行: 完全在范围内的子树整体从父节点中删除并释放所有页面，只有范围两端的叶子节点逐行删除
+        最后沿着两端的查找路径处理不平衡的节点
+        lo 和 hi 可以只包含 key 的前几列，此时按照前缀比较，和 scan 相同
+        :param lo: 下界，None 表示没有下界
+        :param hi: 上界，None 表示没有上界
+        :param lo_inclusive: 是否删除等于下界的行
+        :param hi_inclusive: 是否删除等于上界的行
+        :return: 删除的行数
+        """
+        lo_key = None if lo is None else encode_key(lo)
+        hi_key = None if hi is None else encode_key(hi)
+
+        def above_lo(key: bytes) -> bool:
+            if lo_key is None:
+                return True
+            key = key[:len(lo_key)]
+            return key > lo_key or (key == lo_key and lo_inclusive)
+
+        def below_hi(key: bytes) -> bool:
+            if hi_key is None:
+                return True
+            key = key[:len(hi_key)]
+            return key < hi_key or (key == hi_key and hi_inclusive)
+
+        # 只有两端的查找路径上的节点在作用域中 pin，整体删除的子树中的节点由 free_subtree 逐个 pin
+        with binlog.batch(), self.pin_scope():
+            deleted = self.delete_range_node(self.tree, above_lo, below_hi, lo_key is None, hi_key is None)
+            if isinstance(self.tree, BranchNode) and self.tree.row_num() == 0:
+                # 所有的子节点都被删除了，根节点换成空的叶子节点
+                old_root = self.tree.page_num()
+                self.tree = self.create_leaf_node()
+                self.update_root()
+                self.container.free_page(old_root)
+            # 逐行删除的是两端的叶子节点: 包含第一个被删除的行和最后一个被删除的行的叶子节点，
+            # 按前缀比较或者存在重复 key 时，它们不一定在 _search 的查找路径上
+            if lo_key is not None:
+                self.rebalance_search_path(lo_key, lo_inclusive)
+            if hi_key is not None:
+                self.rebalance_search_path(hi_key, not hi_inclusive)
+        return deleted
+
+    def delete_range_node(self, node: Node, above_lo: Callable[[bytes], bool], below_hi: Callable[[bytes], bool],
+                          lo_covered: bool, hi_covered: bool) -> int:
+        """
+        删除 node 中在范围内的行
+        子节点中所有的 key 都在父节点中左右两个分隔符之间: 左侧分隔符在范围内时子节点的下界在范围内，右侧同理
+        :param node:
+        :param above_lo: key 是否满足下界
+        :param below_hi: key 是否满足上界
+        :param lo_covered: node 中所有的 key 都满足下界
+        :param hi_covered: node 中所有的 key 都满足上界
+        :return: 删除的行数
+        """
+        row_num = node.row_num()
+        if isinstance(node, LeafNode):
+            start = 0
+            while not lo_covered and start < row_num and not above_lo(node.get_key_i(start)):
+                start += 1
+            end = start
+            while end < row_num and (hi_covered or below_hi(node.get_key_i(end))):
+                end += 1
+            for i in range(end - 1, start - 1, -1):
+                node.remove_i(i)
+            return end - start
+
+        deleted = 0
+        decoded = node.decoded()
+        keys, children = list(decoded.keys), list(decoded.children)
+        # 从右向左处理，删除子节点不影响左侧子节点的下标
+        for i in range(row_num - 1, -1, -1):
+            if i + 1 < row_num and not above_lo(keys[i + 1]):
+                break
+            if i > 0 and not below_hi(keys[i]):
+                continue
+            child_lo_covered = lo_covered if i == 0 else above_lo(keys[i])
+            child_hi_covered = hi_covered if i + 1 == row_num else below_hi(keys[i + 1])
+            if child_lo_covered and child_hi_covered:
+                deleted += self.free_subtree(children[i])
+                node.remove_i(i)
+                continue
+            child = self.read_node(children[i])
+            deleted += self.delete_range_node(child, above_lo, below_hi, child_lo_covered, child_hi_covered)
+            if child.row_num() == 0:
+                self.free_subtree(children[i])
+                node.remove_i(i)
+            else:
+                self.refresh_child_count(node, i, child)
+        return deleted
+
+    def free_subtree(self, page_num: int) -> int:
+        """
+        从 btree 中摘除以 page_num 为根的子树并释放子树中所有的页面，每一层两端的节点和相邻的节点互相链接
+        从父节点中删除子树由调用方处理
+        :param page_num:
+        :return: 子树中的行数
+        """
+        row_num = 0
+        level = [page_num]
+        while level:
+            # 子树可能很大，每次修改只 pin 用到的节点
+            with self.pin_scope():
+                left = self.read_node(level[0]).left()
+                right = self.read_node(level[-1]).right()
+                if left != -1:
+                    self.read_node(left).set_right(right)
+                if right != -1:
+                    self.read_node(right).set_left(left)
+            next_level = []
+            for num in level:
+                with self.pin_scope():
+                    node = self.read_node(num)
+                    if isinstance(node, BranchNode):
+                        next_level.extend(node.decoded().children)
+                    else:
+                        row_num += node.row_num()
+                    node.delete_over_flow_rows()
+                self.container.free_page(num)
+            level = next_level
+        return row_num
+
+    def rebalance_search_path(self, key: bytes, asc: bool = True):
+        """
+        从上到下依次处理 key 的查找路径上不平衡的节点，每处理一层重新查找一次路径，合并时被释放的节点不会再被使用
+        上层先处理，下层的节点才有兄弟节点
+        :param key: 编码后的key，可以只包含前几列
+        :param asc: 查找路径的方向，和 _search_part 相同
+        """
+        level = 1
+        height = None
+        while True:
+            while isinstance(self.tree, BranchNode) and self.tree.row_num() == 1:
+                self.branch_node_un_balance(self.tree, [])
+            path = []
+            leaf = self._search_part(key, self.tree, asc, path)
+            # 树的高度降低时，层数跟着调整
+            if height is not None:
+                level = max(1, level - (height - len(path)))
+            height = len(path)
+            if level > height:
+                return
+            if level == height:
+                if leaf.is_under_fill():
+                    self.leaf_node_un_balance(leaf, path)
+            else:
+                node = path[level][0]
+                if node.is_under_fill():
+                    self.branch_node_un_balance(node, path[:level])
+            level += 1
+
     def update(self,value):
-        key = self.get_key(value)
-        # 找到叶子节点
-        node: LeafNode = self._search(key, self.tree, True)
-        # 查找key相等的部分，如果不存在，就找可以插入的部分
-        eq_index, _ = node.key_index(key)
-        if eq_index == -1:
-            raise Exception(f'key={key}不存在')
-        node.update_row_i(eq_index,value)
+        with self.pin_scope():
+            key = self.get_key(value)
+            # 找到叶子节点
+            node: LeafNode = self._search(encode_key(key), self.tree, True)
+            # 查找key相等的部分，如果不存在，就找可以插入的部分
+            eq_index, _ = node.key_index(key)
+            if eq_index == -1:
+                raise Exception(f'key={key}不存在')
+            node.update_row_i(eq_index,value)
 
     def insert(self, value):
-        key = self.get_key(value)
-        # 找到叶子节点
-        node: LeafNode = self._search(key, self.tree, True)
-        # 查找key相等的部分，如果不存在，就找可以插入的部分
-        eq_index, insert_index = node.key_index(key)
-        if eq_index != -1 and not self.duplicate_key:
-            node.update_row_i(eq_index, value)
-            return
-        # 校验，直接进入插入，如果插入失败，说明满了
-        if node.insert_row(insert_index, value):
+        with self.pin_scope():
+            key = self.get_key(value)
+            # 找到叶子节点
+            path = []
+            node: LeafNode = self._search(encode_key(key), self.tree, True, path)
+            # 查找key相等的部分，如果不存在，就找可以插入的部分
+            eq_index, insert_index = node.key_index(key)
+            if eq_index != -1 and not self.duplicate_key:
+                node.update_row_i(eq_index, value)
+                return
+            # 先更新查找路径上的行数, split 会修改查找路径
+            self.add_count(path, 1)
+            # 校验，直接进入插入，如果插入失败，说明满了
+            if node.insert_row(insert_index, value):
+                return
+            # 溢出了，进行split,  将 FULL-1 的部分平分
+            self.split_leaf_node(node, value, insert_index, path)
+
+    def bulk_load(self, rows: Iterable[Row], fill_factor: float = 0.9, is_sorted: bool = True):
+        """
+        自底向上构建 btree: 按顺序写满叶子节点，再逐层构建分支节点，最后更新一次 root
+        只能用于空的 btree，不允许重复 key 时，相同 key 的行保留最后一个
+        :param rows: 按 key 排序的行
+        :param fill_factor: 节点的填充率，节点剩余 (1 - fill_factor) 的空间留给之后的插入
+        :param is_sorted: 输入没有排序时先进行外部排序
+        :return:
+        """
+        if not isinstance(self.tree, LeafNode) or self.tree.row_num() > 0:
+            raise Exception('bulk_load 只能用于空的 btree')
+        if not 0 < fill_factor <= 1:
+            raise Exception('fill_factor 需要在 0 和 1 之间')
+        if not is_sorted:
+            rows = self.sort_rows(rows)
+        reserve = int(self.container.page_size * (1 - fill_factor))
+        # 下一层的内容: 子节点和左侧节点之间的分隔符，子节点页号 和 子树中的行数
+        level: List[BranchRow] = []
+        leaf: LeafNode | None = None
+        prev_key = None
+        try:
+            for row in rows:
+                key_bytes = encode_key(self.get_key(row))
+                if prev_key is not None:
+                    if key_bytes < prev_key:
+                        raise Exception('bulk_load 的输入没有按照 key 排序')
+                    if key_bytes == prev_key and not self.duplicate_key:
+                        leaf.update_row_i(leaf.row_num() - 1, row)
+                        continue
+                record_row = Row([ByteArray(bytearray(key_bytes))] + row.values)
+                if leaf is None or (leaf.row_num() > 0 and
+                                    leaf.page.cal_free_space() - CommonPage.record_space(record_row) < reserve):
+                    leaf = self.bulk_new_node(LEAF_NODE, leaf)
+                    level.append(BranchRow(key_bytes if prev_key is None else separator(prev_key, key_bytes),
+                                           leaf.page_num(), 0 if self.counted else None))
+                prev_key = key_bytes
+                if leaf.page.insert_to_last_slot(record_row)[0] == -1:
+                    raise Exception('插入数据失败')
+                if self.counted:
+                    level[-1].count += 1
+        finally:
+            if leaf is not None:
+                leaf.page.unpin()
+        if not level:
             return
-        # 溢出了，进行split,  将 FULL-1 的部分平分
-        self.split_leaf_node(node, value, insert_index)
+        while len(level) > 1:
+            level = self.bulk_build_branch_level(level, reserve)
+        old_root = self.tree.page_num()
+        self.tree = self.read_node(level[0].child)
+        self.update_root()
+        self.container.free_page(old_root)
+
+    def bulk_new_node(self, node_type: int, left_node: Node | None) -> Node:
+        """
+        bulk_load 创建节点并和左侧节点互相链接
+        写入节点时可能分配 over flow 页面，正在写入的节点需要 pin，左侧节点链接之后不再修改，unpin
+        写完最后一个节点之后由调用方 unpin
+        """
+        if node_type == LEAF_NODE:
+            node = self.create_leaf_node()
+        else:
+            node = self.create_branch_node()
+        node.page.pin()
+        if left_node is not None:
+            node.set_left(left_node.page_num())
+            left_node.set_right(node.page_num())
+            left_node.page.unpin()
+        return node
+
+    def bulk_build_branch_level(self, level: List[BranchRow], reserve: int) -> List[BranchRow]:
+        """
+        为 level 中的节点构建上一层分支节点
+        :param level: 子节点的分隔符，子节点页号 和 子树中的行数
+        :param reserve: 节点保留的空间
+        :return: 上一层的内容
+        """
+        capacity = self.container.page_size - struct.calcsize(CommonPage.header_fmt()) - reserve
+        groups: List[List[BranchRow]] = [[]]
+        used = 0
+        for row in level:
+            # 按照没有公共前缀估算空间
+            space = CommonPage.record_space(row.to_row())
+            if len(groups[-1]) >= 2 and used + space > capacity:
+                groups.append([])
+                used = 0
+            groups[-1].append(row)
+            used += space
+        # 分支节点至少需要两个子节点
+        if len(groups) > 1 and len(groups[-1]) < 2:
+            if len(groups[-2]) >= 3:
+                groups[-1].insert(0, groups[-2].pop())
+            else:
+                groups[-2].extend(groups.pop())
+        upper_level: List[BranchRow] = []
+        node: BranchNode | None = None
+        try:
+            for group in groups:
+                node = self.bulk_new_node(BRANCH_NODE, node)
+                # 分支节点第0行的key不使用, 页面很小时放不下合并后的三行, rebuild 会将它们 over flow
+                node.rebuild([BranchRow(b'' if j == 0 else row.key, row.child, row.count) for j, row in enumerate(group)])
+                upper_level.append(BranchRow(group[0].key, node.page_num(), self.subtree_count(node)))
+        finally:
+            if node is not None:
+                node.page.unpin()
+        return upper_level
+
+    def sort_rows(self, rows: Iterable[Row]) -> Iterator[Row]:
+        """
+        按照 key 对行进行外部排序: 每 config.BULK_LOAD_SORT_RUN_ROWS 行排序后写入临时文件，最后归并
+        key 相同的行保持输入的顺序
+        :param rows:
+        :return:
+        """
+        runs = []
+        buffer = []
+        for seq, row in enumerate(rows):
+            buffer.append((encode_key(self.get_key(row)), seq, row))
+            if len(buffer) >= config.BULK_LOAD_SORT_RUN_ROWS:
+                runs.append(BTree.spill_sort_run(buffer))
+                buffer = []
+        buffer.sort(key=lambda item: item[:2])
+        if not runs:
+            return (row for _, _, row in buffer)
+        runs.append(BTree.spill_sort_run(buffer))
+        merged = heapq.merge(*[BTree.read_sort_run(run) for run in runs], key=lambda item: item[:2])
+        return (row for _, _, row in merged)
+
+    @staticmethod
+    def spill_sort_run(buffer: list):
+        buffer.sort(key=lambda item: item[:2])
+        run = tempfile.TemporaryFile()
+        for item in buffer:
+            pickle.dump(item, run)
+        run.seek(0)
+        return run
 
-    def none_key(self) -> Row:
-        key = []
-        for i in range(self.key_len):
-            key.append(self.value_type[i].none())
-        return Row(key)
+    @staticmethod
+    def read_sort_run(run):
+        with run:
+            while True:
+                try:
+                    yield pickle.load(run)
+                except EOFError:
+                    return
 
     def update_root(self):
         #btree 信息放在第一页
         btree_info_page = self.container.get_page(config.BTREE_INFO_PAGE_NUM)
         #根据 BtreeInfo中 root值位置的下标更新内容，如果 BtreeInfo中 root位置发生了调整，这里也要调整
-        btree_info_page.update_field_by_index(0,3,IntValue(self.tree.page_num()))
-        btree_info_page.flush()
+        with btree_info_page.pinned():
+            btree_info_page.update_field_by_index(0,3,IntValue(self.tree.page_num()))
+            btree_info_page.flush()
 
     def create_root(self, old_root: Node, right_node: Node, key):
-        root = self.create_branch_node(-1)
-        root.append_row(BranchRow(self.none_key(), old_root.page_num()))
-        root.append_row(BranchRow(key, right_node.page_num()))
-        old_root.set_parent(root.page_num())
-        right_node.set_parent(root.page_num())
+        root = self.create_branch_node()
+        root.rebuild([BranchRow(b'', old_root.page_num(), self.subtree_count(old_root)),
+                      BranchRow(key, right_node.page_num(), self.subtree_count(right_node))])
         self.tree = root
         #更新root节点
         self.update_root()
@@ -586,13 +1418,25 @@ class BTree:
         else:
             raise Exception('不支持获取key')
 
-    def split_leaf_node(self, node: LeafNode, value, index):
-        mid = (node.row_num() + 1) // 2
+    def split_leaf_node(self, node: LeafNode, value, index, path: List[Tuple[BranchNode, int]]):
+        """
+        :param node:
+        :param value:
+        :param index: value 在 node 中的插入位置
+        :param path: 从根节点到 node 的查找路径, 最后一项是 node 的父节点
+        :return:
+        """
+        if index == node.row_num() and node.right() == -1:
+            # 在最右侧的叶子节点末尾插入，key 是递增的时候左侧节点之后不会再有插入，按照比例保留更多的行
+            mid = min(node.row_num(), max(1, (node.row_num() + 1) * self.append_split_percent // 100))
+        else:
+            mid = (node.row_num() + 1) // 2
         # 为了分配left个节点，需要计算从node 中取的内容
-        if mid > index:
+        insert_left = mid > index
+        if insert_left:
             mid = mid - 1
 
-        right_node = self.create_leaf_node(node.parent())
+        right_node = self.create_leaf_node()
         right_node.set_right(node.right())
         if node.right() != -1:
             node.get_right_node().set_left(right_node.page_num())
@@ -600,23 +1444,27 @@ class BTree:
         node.set_right(right_node.page_num())
         # node[mid:]移动到 right_node
         node.move_to_another_node(mid, node.row_num(), right_node)
-        if index < mid:
-            node.insert_row(index, value)
+        # 不能使用调整后的 mid 判断，index == mid 时应该插入左侧
+        if insert_left:
+            inserted = node.insert_row(index, value)
         else:
-            right_node.insert_row(index - mid, value)
+            inserted = right_node.insert_row(index - mid, value)
+        if not inserted:
+            raise Exception('插入失败')
 
+        # 只保留能够区分两个节点的最短分隔符
+        insert_key = separator(node.get_key_i(node.row_num() - 1), right_node.get_key_i(0))
         # 重新创建即可
-        if node.is_root():
-            self.create_root(node, right_node, self.get_key(right_node.get_row_i(0)))
+        if not path:
+            self.create_root(node, right_node, insert_key)
             return
         # 需要将节点，进行插入
-        parent = node.get_parent_node()
-        node_in_parent_index = parent.child_index(node.page_num())
+        parent, node_in_parent_index = path.pop()
+        self.refresh_child_count(parent, node_in_parent_index, node)
         # 不满直接插入
-        insert_key = self.get_key(right_node.get_row_i(0))
-        if parent.insert_row(node_in_parent_index + 1, BranchRow(insert_key, right_node.page_num())):
+        if parent.insert_row(node_in_parent_index + 1, BranchRow(insert_key, right_node.page_num(), self.subtree_count(right_node))):
             return
-        self.split_branch_node(parent, insert_key, right_node, node_in_parent_index + 1)
+        self.split_branch_node(parent, insert_key, right_node, node_in_parent_index + 1, path)
 
     @staticmethod
     def find_index_for_key_insert(keys, k):
@@ -625,14 +1473,22 @@ class BTree:
                 return i
         return len(keys)
 
-    def split_branch_node(self, node: BranchNode, key, value, key_index):
+    def split_branch_node(self, node: BranchNode, key: bytes, value, key_index, path: List[Tuple[BranchNode, int]]):
         if node.row_num() < 3:
             raise Exception('node key < 3')
-        # 左边分配的长度
-        mid = (node.row_num()) // 2 + 1
+        rows = node.rows()
+        # 使用插入的位置而不是按key重新查找，key重复时按key查找的位置可能不正确
+        rows.insert(key_index, BranchRow(key, value.page_num(), self.subtree_count(value)))
+        # 左边分配的长度, 右边第一行的分隔符插入父节点
+        if key_index == node.row_num() and node.right() == -1:
+            # 在最右侧的分支节点末尾插入，和叶子节点一样按照比例 split，两边至少保留两个子节点
+            mid = min(len(rows) - 2, max(2, len(rows) * self.append_split_percent // 100))
+        else:
+            mid = (len(rows) - 1) // 2 + 1
+        mid_key = rows[mid].key
 
         # 创建好split的节点
-        right_node = self.create_branch_node(node.parent())
+        right_node = self.create_branch_node()
 
         right_node.set_right(node.right())
         if node.right() != -1:
@@ -640,239 +1496,374 @@ class BTree:
         right_node.set_left(node.page_num())
         node.set_right(right_node.page_num())
 
-        # 新增的key就是插入父级的
-        if key_index == mid:
-            mid_key = key
-            node.move_to_another_node(mid, node.row_num(), right_node)
-            if not right_node.insert_row(0, BranchRow(self.none_key(), value.page_num())):
-                raise Exception('插入失败')
-
-        elif key_index > mid:
-            mid_key = node.get_row_i(mid).key
-            node.move_to_another_node(mid, node.row_num(), right_node)
-            # 特殊调整
-            if right_node.row_num() > 0:
-                first_row = right_node.get_row_i(0)
-                first_row.key = self.none_key()
-                right_node.update_row_i(0, first_row)
-            key_insert_loc = right_node.find_index_for_key_insert(key)
-            if not right_node.insert_row(key_insert_loc, BranchRow(key, value.page_num())):
-                raise Exception('插入失败')
-        else:
-            mid_key = self.get_key(node.get_row_i(mid - 1))
-            node.move_to_another_node(mid - 1, node.row_num(), right_node)
-            if right_node.row_num() > 0:
-                first_row = right_node.get_row_i(0)
-                first_row.key = self.none_key()
-                right_node.update_row_i(0, first_row)
-            key_insert_loc = node.find_index_for_key_insert(key)
-            if not node.insert_row(key_insert_loc, BranchRow(key, value.page_num())):
-                raise Exception('插入失败')
-
-        # 调整右边树的结构
-        right_node.set_child_parent()
-        node.set_child_parent()
+        # 两个节点按照各自的公共前缀重新写入
+        node.rebuild(rows[:mid])
+        right_node.rebuild(rows[mid:])
 
         # 重新创建即可
-        if node.is_root():
+        if not path:
             self.create_root(node, right_node, mid_key)
             return
         # 需要将节点，进行插入
-        parent = node.get_parent_node()
-        node_in_parent_index = parent.child_index(node.page_num())
+        parent, node_in_parent_index = path.pop()
+        self.refresh_child_count(parent, node_in_parent_index, node)
         # 不满直接插入
-        if parent.insert_row(node_in_parent_index + 1, BranchRow(mid_key, right_node.page_num())):
+        if parent.insert_row(node_in_parent_index + 1, BranchRow(mid_key, right_node.page_num(), self.subtree_count(right_node))):
             return
-        self.split_branch_node(parent, mid_key, right_node, node_in_parent_index + 1)
+        self.split_branch_node(parent, mid_key, right_node, node_in_parent_index + 1, path)
 
     def delete(self, key):
-        node = self._search(key, self.tree)
-
-        index, _ = node.key_index(key)
-        if index == -1:
-            print(f'key={key}不存在')
-            return False
-        # 删除叶子节点的key
-        node.remove_i(index)
-        # 对于磁盘上的 B tree 当 一个节点都没有时，才考虑balance操作
-        if node.row_num() <= 1:
-            # root节点直接删除即可
-            if not node.is_root():
-                self.leaf_node_un_balance(node)
-        return True
+        with self.pin_scope():
+            path = []
+            node = self._search(encode_key(key), self.tree, path=path)
+
+            index, _ = node.key_index(key)
+            if index == -1:
+                print(f'key={key}不存在')
+                return False
+            # 删除叶子节点的key
+            node.remove_i(index)
+            self.add_count(path, -1)
+            # 节点的已用空间低于阈值时，才考虑balance操作
+            if node.is_under_fill():
+                # root节点直接删除即可
+                if path:
+                    self.leaf_node_un_balance(node, path)
+            return True
+
+    def sibling_nodes(self, parent: BranchNode, i: int) -> Tuple[Node | None, Node | None]:
+        """
+        父节点中第 i 个子节点的左右兄弟节点, 不存在时为 None
+        """
+        left_sibling = self.read_node(parent.get_child_i(i - 1)) if i > 0 else None
+        right_sibling = self.read_node(parent.get_child_i(i + 1)) if i + 1 < parent.row_num() else None
+        return left_sibling, right_sibling
 
-    def leaf_node_un_balance(self, node: LeafNode):
+    def leaf_node_un_balance(self, node: LeafNode, path: List[Tuple[BranchNode, int]]):
         """
         叶子节点不平衡
-        若兄弟结点key有富余：
-            向兄弟结点借一个记录，同时用借到的key替换父结（指当前结点和兄弟结点共同的父结点）点中的key，删除结束
-        若兄弟结点中没有富余的key
-            当前结点和兄弟结点合并成一个新的叶子结点，并删除父结点中的key（父结点中的这个key两边的孩子指针就变成了一个指针，
+        若当前结点能放进兄弟结点(或者兄弟结点能放进当前结点)：
+            两个结点合并成一个叶子结点，并删除父结点中的key（父结点中的这个key两边的孩子指针就变成了一个指针，
             正好指向这个新的叶子结点），将当前结点指向父结点（必为索引结点）
 
             处理索引节点
+        若兄弟结点key有富余：
+            向兄弟结点借记录，直到两个结点的已用空间接近，同时用借到的key替换父结点（指当前结点和兄弟结点共同的父结点）中的key，删除结束
 
+        :param node:
+        :param path: 从根节点到 node 的查找路径, 最后一项是 node 的父节点
         """
-        parent = node.get_parent_node()
-        node_in_parent_index = parent.child_index(node.page_num())
-        left = node.get_left_node()
-        right = node.get_right_node()
-        left_sibling, right_sibling = None, None
-        if left and left.parent() == node.parent():
-            left_sibling = left
-        if right and right.parent() == node.parent():
-            right_sibling = right
-
-        # 起码要有两个才能借
-        if left_sibling and left_sibling.row_num() >= 2:
-            row = left_sibling.get_last_row()
-            left_sibling.move_single_row_to_another(left_sibling.row_num() - 1, 0, node)
-            # 替换父节点中的key  这里可以取等值，和下方的处理方式不一样
+        parent, node_in_parent_index = path.pop()
+        left_sibling, right_sibling = self.sibling_nodes(parent, node_in_parent_index)
+
+        # 合并之后不需要 over flow 时直接合并
+        if left_sibling and node.used_space() <= left_sibling.page.cal_free_space():
+            self.merge_leaf_nodes(left_sibling, node, parent, node_in_parent_index)
+            self.branch_node_un_balance(parent, path)
+            return
+        if right_sibling and right_sibling.used_space() <= node.page.cal_free_space():
+            self.merge_leaf_nodes(node, right_sibling, parent, node_in_parent_index + 1)
+            self.branch_node_un_balance(parent, path)
+            return
+
+        # 起码要有两个才能借, 当前节点剩下的行很大时可能放不下借来的行
+        if left_sibling and left_sibling.row_num() >= 2 and left_sibling.can_move_row_to(left_sibling.row_num() - 1, node):
+            self.borrow_leaf_rows(left_sibling, node, True)
+            # 替换父节点中的key
             parent_row: BranchRow = parent.get_row_i(node_in_parent_index)
-            parent_row.key = self.get_key(row)
+            parent_row.key = separator(left_sibling.get_key_i(left_sibling.row_num() - 1), node.get_key_i(0))
             parent.update_row_i(node_in_parent_index, parent_row)
+            self.refresh_child_count(parent, node_in_parent_index - 1, left_sibling)
+            self.refresh_child_count(parent, node_in_parent_index, node)
             return
 
-        if right_sibling and right_sibling.row_num() >= 2:
-            right_sibling.move_single_row_to_another(0, node.row_num(), node)
+        if right_sibling and right_sibling.row_num() >= 2 and right_sibling.can_move_row_to(0, node):
+            self.borrow_leaf_rows(right_sibling, node, False)
             # 替换父节点中的key
             parent_row: BranchRow = parent.get_row_i(node_in_parent_index + 1)
-            parent_row.key = self.get_key(right_sibling.get_row_i(0))
+            parent_row.key = separator(node.get_key_i(node.row_num() - 1), right_sibling.get_key_i(0))
             parent.update_row_i(node_in_parent_index + 1, parent_row)
+            self.refresh_child_count(parent, node_in_parent_index, node)
+            self.refresh_child_count(parent, node_in_parent_index + 1, right_sibling)
+            return
+
+        # 当前节点还有多行，或者兄弟节点有富余但是当前节点放不下，节点保持不变
+        if node.row_num() > 1 or (node.row_num() > 0 and ((left_sibling and left_sibling.row_num() >= 2) or
+                                                          (right_sibling and right_sibling.row_num() >= 2))):
             return
 
+        # 只剩一行的节点，合并时放不下的部分 over flow
         if left_sibling:
-            # 合并到左节点
-            node.move_to_another_node(0, node.row_num(), left_sibling)
-            # 从父节点中删除当前节点
-            parent.remove_i(node_in_parent_index)
-            # 调整左右节点
-            left_sibling.set_right(node.right())
-            if node.right() != -1:
-                node.get_right_node().set_left(left_sibling.page_num())
-            self.branch_node_un_balance(parent)
-            # 释放 node 所在的page
-            self.container.free_page(node.page_num())
+            self.merge_leaf_nodes(left_sibling, node, parent, node_in_parent_index)
+            self.branch_node_un_balance(parent, path)
             return
         if right_sibling:
-            # 合并右节点到node
-            right_sibling.move_to_another_node(0, right_sibling.row_num(), node)
-            # 从父节点中删除右节点
-            parent.remove_i(node_in_parent_index + 1)
-            # 调整左右节点
-            node.set_right(right_sibling.right())
-            if right_sibling.right() != -1:
-                right_sibling.get_right_node().set_left(node.page_num())
-            self.branch_node_un_balance(parent)
-            # 释放 right_sibling 所在的page
-            self.container.free_page(right_sibling.page_num())
+            self.merge_leaf_nodes(node, right_sibling, parent, node_in_parent_index + 1)
+            self.branch_node_un_balance(parent, path)
             return
 
         raise Exception("B tree error")
 
-    def branch_node_un_balance(self, node: BranchNode):
+    @staticmethod
+    def borrow_leaf_rows(sibling: LeafNode, node: LeafNode, from_left: bool):
+        """
+        从兄弟节点借行，直到当前节点的已用空间不小于兄弟节点，兄弟节点至少保留一行
+        :param sibling:
+        :param node:
+        :param from_left: 兄弟节点是否在左侧，左侧借最后一行，右侧借第一行
+        """
+        while sibling.row_num() >= 2:
+            src_row_i = sibling.row_num() - 1 if from_left else 0
+            if not sibling.can_move_row_to(src_row_i, node):
+                return
+            sibling.move_single_row_to_another(src_row_i, 0 if from_left else node.row_num(), node)
+            if node.used_space() >= sibling.used_space():
+                return
+
+    def merge_leaf_nodes(self, left: LeafNode, right: LeafNode, parent: BranchNode, right_in_parent_index: int):
+        """
+        right 的所有行移动到 left，从父节点中删除 right 并释放 right 所在的page
+        """
+        right.move_to_another_node(0, right.row_num(), left)
+        parent.remove_i(right_in_parent_index)
+        self.refresh_child_count(parent, right_in_parent_index - 1, left)
+        # 调整左右节点
+        left.set_right(right.right())
+        if right.right() != -1:
+            right.get_right_node().set_left(left.page_num())
+        self.container.free_page(right.page_num())
+
+    def branch_node_un_balance(self, node: BranchNode, path: List[Tuple[BranchNode, int]]):
         """
         分支节点不平衡
-        若索引结点的key的个数大于等于 min_key_num结束
-        若兄弟结点有富余，父结点key下移，兄弟结点key上移，删除结束
-        否则：
-         当前结点和兄弟结点及父结点下移key合并成一个新的结点。将当前结点指向父结点
+        若索引结点的已用空间不低于阈值并且至少有两个子结点，结束
+        若当前结点、兄弟结点及父结点下移的key能放进一个结点，合并成一个新的结点。将当前结点指向父结点
+        若兄弟结点有富余，父结点key下移，两个结点平分所有的key，中间的key上移，删除结束
         """
-        # 只要有一个就结束
-        if node.row_num() >= 2:
+        if not node.is_under_fill():
             return
         # 根节点允许一定的不平衡
-        if node.is_root():
+        if not path:
             if node.row_num() == 1:
                 self.tree = self.read_node(node.get_row_i(0).child)
-                self.tree.set_parent(-1)
                 self.tree.set_left(-1)
                 self.tree.set_right(-1)
                 self.update_root()
-                return
-
-        parent = node.get_parent_node()
-        node_in_parent_index = parent.child_index(node.page_num())
-        left = node.get_left_node()
-        right = node.get_right_node()
-        left_sibling, right_sibling = None, None
-        if left and left.parent() == node.parent():
-            left_sibling = left
-        if right and right.parent() == node.parent():
-            right_sibling = right
-
-        if left_sibling and left_sibling.row_num() >= 3:
-            left_sibling: BranchNode
-            row: BranchRow = left_sibling.get_last_row()
-            left_sibling.remove_i(left_sibling.row_num() - 1)
-            parent_row = parent.get_row_i(node_in_parent_index)
-            node_first = node.get_row_i(0)
-            node_first.key = parent_row.key
-            parent_row.key = row.key
-            # 父节点的key下移
-            node.update_row_i(0, node_first)
-            parent.update_row_i(node_in_parent_index, parent_row)
-            # 兄弟节点的key上移动,移动到父亲节点
-            # 兄弟节点移除的value给node节点 ！！！！ 需要调整 left right 关系
-            row.key = self.none_key()
-            self.read_node(row.child).set_parent(node.page_num())
-            node.insert_row(0, row)
-            return
-        if right_sibling and right_sibling.row_num() >= 3:
-            right_sibling: BranchNode
-            # 移除 right_sibling第一个元素
-            row = right_sibling.get_row_i(0)
-            right_sibling.remove_i(0)
-            parent_row = parent.get_row_i(node_in_parent_index + 1)
-            parent_key = parent_row.key
-            right_first = right_sibling.get_row_i(0)
-            parent_row.key = right_first.key
-            parent.update_row_i(node_in_parent_index + 1, parent_row)
-            right_first.key = self.none_key()
-            right_sibling.update_row_i(0, right_first)
-            row.key = parent_key
-            self.read_node(row.child).set_parent(node.page_num())
-            node.append_row(row)
+                self.container.free_page(node.page_num())
             return
 
-        if left_sibling:
-            # 合并到左节点
-            # 从父节点中移除 key 和node
-            parent_row = parent.get_row_i(node_in_parent_index)
-            parent.remove_i(node_in_parent_index)
-
-            node_first = node.get_row_i(0)
-            node_first.key = parent_row.key
-            node.update_row_i(0, node_first)
-            node.set_child_parent(left_sibling.page_num())
-            node.move_to_another_node(0, node.row_num(), left_sibling)
-            left_sibling.set_right(node.right())
-            if node.right() != -1:
-                node.get_right_node().set_left(left_sibling.page_num())
-            self.branch_node_un_balance(parent)
-            # 释放 node 所在的page
-            self.container.free_page(node.page_num())
-            return
+        parent, node_in_parent_index = path.pop()
+        if self.balance_branch_node(node, parent, node_in_parent_index):
+            self.branch_node_un_balance(parent, path)
+
+    def balance_branch_node(self, node: BranchNode, parent: BranchNode, node_in_parent_index: int) -> bool:
+        """
+        分支节点和兄弟节点合并，或者从兄弟节点重新分配行
+        :param node:
+        :param parent:
+        :param node_in_parent_index: node 在父节点中的位置
+        :return: 是否和兄弟节点进行了合并，合并之后父节点少了一行，父节点也可能不平衡
+        """
+        left_sibling, right_sibling = self.sibling_nodes(parent, node_in_parent_index)
 
+        if left_sibling and self.merge_branch_nodes(left_sibling, node, parent, node_in_parent_index, False):
+            return True
+        if right_sibling and self.merge_branch_nodes(node, right_sibling, parent, node_in_parent_index + 1, False):
+            return True
+
+        if left_sibling and left_sibling.row_num() >= 3 and left_sibling.row_num() > node.row_num() + 1:
+            self.redistribute_branch_nodes(left_sibling, node, parent, node_in_parent_index)
+            return False
+        if right_sibling and right_sibling.row_num() >= 3 and right_sibling.row_num() > node.row_num() + 1:
+            self.redistribute_branch_nodes(node, right_sibling, parent, node_in_parent_index + 1)
+            return False
+
+        # 只要有两个子节点就结束
+        if node.row_num() >= 2:
+            return False
+        # 页面很小时合并后的几行也可能放不下，over flow 到其他页面
+        if left_sibling:
+            self.merge_branch_nodes(left_sibling, node, parent, node_in_parent_index, True)
+            return True
         if right_sibling:
-            # 右节点合并到node
-            parent_row = parent.get_row_i(node_in_parent_index + 1)
-            parent.remove_i(node_in_parent_index + 1)
-            right_sibling_first = right_sibling.get_row_i(0)
-            right_sibling_first.key = parent_row.key
-            right_sibling.update_row_i(0, right_sibling_first)
-
-            right_sibling.set_child_parent(node.page_num())
-            right_sibling.move_to_another_node(0, right_sibling.row_num(), node)
-            node.set_right(right_sibling.right())
-            if right_sibling.right() != -1:
-                right_sibling.get_right_node().set_left(node.page_num())
-            self.branch_node_un_balance(parent)
-            # 释放 right_sibling 所在的page
-            self.container.free_page(right_sibling.page_num())
-            return
+            self.merge_branch_nodes(node, right_sibling, parent, node_in_parent_index + 1, True)
+            return True
         raise Exception("B tree error")
 
+    def merge_branch_nodes(self, left: BranchNode, right: BranchNode, parent: BranchNode,
+                           right_in_parent_index: int, spill: bool) -> bool:
+        """
+        父节点中的key下移，和 right 的所有行一起追加到 left，从父节点中删除 right 并释放 right 所在的page
+        :param left:
+        :param right:
+        :param parent:
+        :param right_in_parent_index:
+        :param spill: 放不下时是否 over flow，不 over flow 时不进行合并
+        :return: 是否进行了合并
+        """
+        if not spill and left.used_space() + right.used_space() > left.page.page_size - left.page.header_size():
+            return False
+        parent_row = parent.get_row_i(right_in_parent_index)
+        rows = right.rows()
+        rows[0].key = parent_row.key
+        if not left.rebuild(left.rows() + rows, spill):
+            return False
+        parent.remove_i(right_in_parent_index)
+        self.refresh_child_count(parent, right_in_parent_index - 1, left)
+        right.clear()
+        left.set_right(right.right())
+        if right.right() != -1:
+            right.get_right_node().set_left(left.page_num())
+        self.container.free_page(right.page_num())
+        return True
+
+    def redistribute_branch_nodes(self, left: BranchNode, right: BranchNode, parent: BranchNode, right_in_parent_index: int):
+        """
+        父节点中的key下移，left 和 right 平分所有的行，right 的第一个key上移到父节点
+        """
+        parent_row = parent.get_row_i(right_in_parent_index)
+        right_rows = right.rows()
+        right_rows[0].key = parent_row.key
+        rows = left.rows() + right_rows
+        mid = len(rows) // 2
+        left.rebuild(rows[:mid])
+        right.rebuild(rows[mid:])
+        parent_row.key = rows[mid].key
+        parent.update_row_i(right_in_parent_index, parent_row)
+        self.refresh_child_count(parent, right_in_parent_index - 1, left)
+        self.refresh_child_count(parent, right_in_parent_index, right)
+
+    def defragment(self, fill_factor: float = 1.0) -> int:
+        """
+        在线整理 btree: 自底向上把同一个父节点下相邻节点的行尽量移动到左侧节点，
+        空出来的节点从父节点中删除，页面交给 PageManager 重新分配。大量删除之后用于减少页面数量，不需要重建 btree
+        :param fill_factor: 叶子节点的填充率，节点剩余 (1 - fill_factor) 的空间留给之后的插入
+        :return: 释放的页面数量
+        """
+        if not 0 < fill_factor <= 1:
+            raise Exception('fill_factor 需要在 0 和 1 之间')
+        reserve = int(self.container.page_size * (1 - fill_factor))
+        freed = 0
+        while isinstance(self.tree, BranchNode):
+            # 分支节点合并之后，原来属于不同父节点的相邻子节点才能继续合并，需要再整理一遍
+            round_freed = self.defragment_branch(self.tree, reserve)
+            # 根节点只剩一个子节点时降低树的高度
+            while isinstance(self.tree, BranchNode) and self.tree.row_num() == 1:
+                with self.pin_scope():
+                    self.branch_node_un_balance(self.tree, [])
+                round_freed += 1
+            if round_freed == 0:
+                break
+            freed += round_freed
+        return freed + self.free_unreferenced_over_flow_pages()
+
+    def free_unreferenced_over_flow_pages(self) -> int:
+        """
+        释放没有被任何行引用的 over flow 页面，这些页面中的记录已经无法访问(例如旧版本删除记录时遗留的页面)
+        :return: 释放的页面数量
+        """
+        referenced = set()
+        # btree 信息页面中的记录也可能使用 over flow 页面
+        info_page = self.container.get_page(config.BTREE_INFO_PAGE_NUM)
+        wait_visit = [ref for i in range(info_page.slot_num) for ref in info_page.over_flow_refs_by_slot(i)]
+        level = [self.tree.page_num()]
+        while level:
+            next_level = []
+            for page_num in level:
+                node = self.read_node(page_num)
+                for i in range(node.row_num()):
+                    wait_visit.extend(node.page.over_flow_refs_by_slot(i))
+                    if isinstance(node, BranchNode):
+                        next_level.append(node.get_child_i(i))
+                # 沿着 over flow 记录链表访问
+                while wait_visit:
+                    over_page_num, over_record_id = wait_visit.pop()
+                    if (over_page_num, over_record_id) in referenced:
+                        continue
+                    referenced.add((over_page_num, over_record_id))
+                    over_page = self.container.get_page(over_page_num)
+                    slot = over_page.get_slot_num_by_record_id(over_record_id)
+                    if slot != -1:
+                        wait_visit.extend(over_page.over_flow_refs_by_slot(slot))
+            level = next_level
+        referenced_pages = {page_num for page_num, _ in referenced}
+        freed = 0
+        file_pages = self.container.get_size() // self.container.page_size
+        with binlog.batch():
+            for page_num in self.container.page_manager.allocated_pages():
+                # extent 中预留的页面还没有写入文件，不是 over flow 页面
+                if page_num >= file_pages or page_num in referenced_pages:
+                    continue
+                if self.container.is_over_flow_page(page_num):
+                    self.container.free_over_flow_page(page_num)
+                    freed += 1
+        return freed
+
+    def defragment_branch(self, node: BranchNode, reserve: int) -> int:
+        """
+        先整理每个子树，再合并 node 的相邻子节点
+        :param node:
+        :param reserve: 叶子节点保留的空间
+        :return: 释放的页面数量
+        """
+        freed = 0
+        if isinstance(self.read_node(node.get_child_i(0)), BranchNode):
+            for i in range(node.row_num()):
+                # 整理子树期间 node 由调用方 pin，子树中的节点只在整理它们的时候 pin
+                with self.pin_scope():
+                    freed += self.defragment_branch(self.read_branch_node(node.get_child_i(i)), reserve)
+        # 每个节点的整理产生的日志作为一个整体写入
+        with binlog.batch():
+            i = 0
+            while i + 1 < node.row_num():
+                with self.pin_scope():
+                    left = self.read_node(node.get_child_i(i))
+                    right = self.read_node(node.get_child_i(i + 1))
+                    if isinstance(left, LeafNode):
+                        merged = self.pack_leaf_nodes(left, right, node, i + 1, reserve)
+                    else:
+                        merged = self.merge_branch_nodes(left, right, node, i + 1, False)
+                if merged:
+                    freed += 1
+                else:
+                    i += 1
+            # 子节点中的叶子节点合并之后，子节点可能只剩一个子节点，删除时需要至少两个子节点才能找到兄弟节点
+            i = 0
+            while node.row_num() >= 2 and i < node.row_num():
+                with self.pin_scope():
+                    child = self.read_node(node.get_child_i(i))
+                    if not isinstance(child, BranchNode):
+                        break
+                    if child.row_num() >= 2:
+                        i += 1
+                    elif self.balance_branch_node(child, node, i):
+                        freed += 1
+        return freed
+
+    def pack_leaf_nodes(self, left: LeafNode, right: LeafNode, parent: BranchNode, right_in_parent_index: int,
+                        reserve: int) -> bool:
+        """
+        right 的行按顺序移动到 left，直到 left 只剩 reserve 的空间
+        :return: right 是否被合并到 left
+        """
+        if right.used_space() + reserve <= left.page.cal_free_space():
+            self.merge_leaf_nodes(left, right, parent, right_in_parent_index)
+            return True
+        moved = False
+        while right.row_num() > 1 and right.can_move_row_to(0, left):
+            _, record_len = right.page.read_slot_entry(0)
+            if left.page.cal_free_space() - record_len - SLOT_TABLE_ENTRY_SIZE < reserve:
+                break
+            right.move_single_row_to_another(0, left.row_num(), left)
+            moved = True
+        if moved:
+            parent_row: BranchRow = parent.get_row_i(right_in_parent_index)
+            parent_row.key = separator(left.get_key_i(left.row_num() - 1), right.get_key_i(0))
+            parent.update_row_i(right_in_parent_index, parent_row)
+            self.refresh_child_count(parent, right_in_parent_index - 1, left)
+            self.refresh_child_count(parent, right_in_parent_index, right)
+        return False
+
     def show(self):
         q = [self.tree]
         while len(q) > 0:
@@ -887,7 +1878,7 @@ class BTree:
                 for i in range(num):
                     row = node.get_row_i(i)
                     child_page.append(row.child)
-                    if row.key != self.none_key():
+                    if i > 0:
                         keys.append(row.key)
                     child_node = self.read_node(row.child)
                     if isinstance(child_node, BranchNode):
@@ -901,7 +1892,7 @@ class BTree:
                         if isinstance(temp_row, Row):
                             temp_child.append(temp_row)
                         elif isinstance(temp_row, BranchRow):
-                            if temp_row.key != self.none_key():
+                            if x > 0:
                                 temp_child.append(temp_row.key)
                     print_child.append(temp_child)
                 print(
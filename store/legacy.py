@@ -0,0 +1,195 @@
+import struct
+from pathlib import Path
+from typing import Iterator, List, Type
+
+import config
+from store.cacheable import MANAGEMENT_PAGE
+from store.container import ManagementPage
+from store.page import Record, Field, CommonPageRecordHeader, CommonPage, SLOT_TABLE_ENTRY_SIZE, \
+    FIELD_NOT_OVER_FLOW, FIELD_OVER_FLOW, FIELD_NOT_OVER_FLOW_NULL, FIELD_OVER_FLOW_NULL
+from store.values import Row, Value, IntValue
+
+# 旧格式固定的页大小
+LEGACY_PAGE_SIZE = 200
+# 旧格式 btree 节点 control row 中的节点类型
+LEGACY_LEAF_NODE = 0
+
+
+class LegacyContainer:
+    """
+    只读地打开旧格式(没有记录页大小和格式标识)的 container，只用于把其中的 btree 迁移到当前格式
+    和当前格式的区别:
+        页大小固定为 200 字节
+        管理页头部 '<biiL': page_type free next_management lsn
+        页头部 '<biiiL': page_type slot_num next_id over_flow_page_num lsn
+        field 头部 '<bhh' / '<bhhii', fieldSpace 和 fieldDataLength 是 2 字节
+        btree 节点的 slot 0 是 control row: node_type parent left right
+        叶子节点的行只有 value, 分支节点的行是 key + child
+    slot table、record 头部和溢出链的结构没有变化
+    直接读取文件，不经过缓冲池和 binlog，binlog 需要在迁移之前已经 checkpoint
+    """
+
+    def __init__(self, container_name: str):
+        self.container_name = container_name
+        self.file = open(Path(config.CONTAINER_PATH) / container_name, 'rb')
+
+    @staticmethod
+    def page_header_fmt():
+        return '<biiiL'
+
+    @staticmethod
+    def field_header_fmt():
+        """
+        status field_space_use field_data_length
+        """
+        return '<bhh'
+
+    @staticmethod
+    def field_header_length():
+        return struct.calcsize(LegacyContainer.field_header_fmt())
+
+    @staticmethod
+    def is_legacy(container_name: str) -> bool:
+        """
+        page 0 是管理页但是没有当前格式的标识，并且文件按照旧的页大小对齐
+        :param container_name:
+        :return:
+        """
+        if config.container_size(container_name) % LEGACY_PAGE_SIZE != 0:
+            return False
+        with open(Path(config.CONTAINER_PATH) / container_name, 'rb') as file:
+            header = file.read(ManagementPage.header_size())
+        if len(header) < ManagementPage.header_size() or header[0] != MANAGEMENT_PAGE:
+            return False
+        return not ManagementPage.has_magic(header)
+
+    def close(self):
+        self.file.close()
+
+    def read_page(self, page_num: int) -> bytes:
+        self.file.seek(page_num * LEGACY_PAGE_SIZE)
+        page_data = self.file.read(LEGACY_PAGE_SIZE)
+        if len(page_data) != LEGACY_PAGE_SIZE:
+            raise Exception(f'container {self.container_name} 的 page {page_num} 不完整')
+        return page_data
+
+    @staticmethod
+    def slot_num(page_data: bytes) -> int:
+        return struct.unpack_from(LegacyContainer.page_header_fmt(), page_data, 0)[1]
+
+    @staticmethod
+    def read_slot_entry(page_data: bytes, slot: int):
+        """
+        返回 记录的: offset, length
+        """
+        return struct.unpack_from('<ii', page_data, LEGACY_PAGE_SIZE - (slot + 1) * SLOT_TABLE_ENTRY_SIZE)
+
+    @staticmethod
+    def read_record_header(page_data: bytes, slot: int):
+        record_offset, _ = LegacyContainer.read_slot_entry(page_data, slot)
+        return record_offset, CommonPageRecordHeader(
+            *struct.unpack_from(CommonPage.record_header_fmt(), page_data, record_offset))
+
+    @staticmethod
+    def get_slot_num_by_record_id(page_data: bytes, record_id: int):
+        for i in range(LegacyContainer.slot_num(page_data)):
+            offset, _ = LegacyContainer.read_slot_entry(page_data, i)
+            _, temp_record_id = struct.unpack_from('<bi', page_data, offset)
+            if temp_record_id == record_id:
+                return i
+        raise Exception(f'record {record_id} 不存在')
+
+    def read_over_flow_field(self, next_page_num: int, next_record_id: int, field: Field):
+        """
+        读取 over flow field 在后续页中的数据, 和旧格式的 CommonPage.read_over_flow_field 一致
+        """
+        while True:
+            page_data = self.read_page(next_page_num)
+            slot = self.get_slot_num_by_record_id(page_data, next_record_id)
+            record_offset, _ = self.read_record_header(page_data, slot)
+            field_offset = record_offset + CommonPage.record_header_size()
+            status, _, field_data_length = struct.unpack_from(self.field_header_fmt(), page_data, field_offset)
+            field_offset += self.field_header_length()
+            if status == FIELD_NOT_OVER_FLOW:
+                field.value.extend(page_data[field_offset:field_offset + field_data_length])
+                return
+            next_page_num, next_record_id = struct.unpack_from('<ii', page_data, field_offset)
+            field_offset += CommonPage.over_flow_field_data_size()
+            if field_data_length > 0:
+                field.value.extend(page_data[field_offset:field_offset + field_data_length])
+            if next_page_num == -1 or field_data_length == Field.NO_DATA:
+                return
+
+    def read_slot(self, page_num: int, slot: int) -> Record:
+        """
+        读取一条完整的记录, 记录的字段和 over flow 的数据可能分布在多个页中
+        :param page_num:
+        :param slot:
+        :return:
+        """
+        page_data = self.read_page(page_num)
+        record_offset, record_header = self.read_record_header(page_data, slot)
+        result_record_header = record_header
+        fields: List[Field] = []
+        while True:
+            field_offset = record_offset + CommonPage.record_header_size()
+            for _ in range(record_header.col_num):
+                status, field_space_use, field_data_length = struct.unpack_from(self.field_header_fmt(), page_data,
+                                                                                field_offset)
+                field = Field(status, page_num, field_offset, field_space_use, field_data_length)
+                fields.append(field)
+                field_offset += self.field_header_length()
+                if status == FIELD_NOT_OVER_FLOW_NULL:
+                    field_offset += field_space_use
+                elif status == FIELD_OVER_FLOW_NULL:
+                    field_offset += CommonPage.over_flow_field_data_size() + field_space_use
+                elif status == FIELD_NOT_OVER_FLOW:
+                    field.value.extend(page_data[field_offset:field_offset + field_data_length])
+                    field_offset += field_space_use
+                else:
+                    next_page_num, next_record_id = struct.unpack_from('<ii', page_data, field_offset)
+                    field_offset += CommonPage.over_flow_field_data_size()
+                    field.value.extend(page_data[field_offset:field_offset + max(field_data_length, 0)])
+                    field_offset += field_space_use
+                    if next_page_num != -1:
+                        self.read_over_flow_field(next_page_num, next_record_id, field)
+            if record_header.next_page_num == -1:
+                break
+            page_num = record_header.next_page_num
+            page_data = self.read_page(page_num)
+            slot = self.get_slot_num_by_record_id(page_data, record_header.next_record_id)
+            record_offset, record_header = self.read_record_header(page_data, slot)
+        return Record(result_record_header, fields)
+
+    def read_control_row(self, page_num: int) -> List[int]:
+        """
+        :return: node_type parent left right
+        """
+        return [IntValue.from_bytes(field.value).value for field in self.read_slot(page_num, 0).fields]
+
+    def leaf_records(self, root: int) -> Iterator[Record]:
+        """
+        从最左侧的叶子节点开始，沿着叶子节点的右指针按顺序返回所有的行
+        :param root: btree 的根节点
+        :return:
+        """
+        page_num = root
+        node_type, _, _, right = self.read_control_row(page_num)
+        # 分支节点第一行的 child 是最左侧的子节点, child 是最后一个字段
+        while node_type != LEGACY_LEAF_NODE:
+            page_num = IntValue.from_bytes(self.read_slot(page_num, 1).fields[-1].value).value
+            node_type, _, _, right = self.read_control_row(page_num)
+        while True:
+            for slot in range(1, self.slot_num(self.read_page(page_num))):
+                yield self.read_slot(page_num, slot)
+            if right == -1:
+                return
+            page_num = right
+            _, _, _, right = self.read_control_row(page_num)
+
+    @staticmethod
+    def parse_row(record: Record, value_types: List[Type[Value]]) -> Row:
+        if len(record.fields) != len(value_types):
+            raise Exception(f'record内容与数据类型不匹配')
+        return Row([value_type.none() if field.is_null() else value_type.from_bytes(field.value)
+                    for value_type, field in zip(value_types, record.fields)])
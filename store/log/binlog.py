@@ -1,4 +1,5 @@
 import struct
+from contextlib import contextmanager
 
 import config
 from store.log.logger import RotatingLogger
@@ -47,7 +48,10 @@ class PhysicalPageLogEntry(LogEntry):
 
     @staticmethod
     def header_fmt():
-       return "<HIH"
+       """
+       container_id page_id offset
+       """
+       return "<HII"
     @staticmethod
     def header_size():
        return struct.calcsize(PhysicalPageLogEntry.header_fmt())
@@ -63,14 +67,18 @@ class BinLog:
     def __init__(self):
         self.lock = threading.Lock()
         self.logger = RotatingLogger("binlog",config.LOG_FILE_PER_SIZE,config.LOG_BUFFER_SIZE)
+        # 批量写入期间暂存的日志，批量结束时一次写入 logger
+        self.batch_depth = 0
+        self.pending: list = []
+        self.pending_size = 0
 
     @staticmethod
     def size_fmt():
         """
-        记录 log entry size 的fmt,使用2字节，最大 65535， 由于 包含 undo log， 所以页面大小不能超过 65535/2 约等于 == 32KB
+        记录 log entry size 的fmt,使用4字节，页面大小可以达到 64KB
         :return:
         """
-        return "<H"
+        return "<I"
     @staticmethod
     def size_length():
         return struct.calcsize(BinLog.size_fmt())
@@ -80,9 +88,37 @@ class BinLog:
         byte_content = log_entry.serialize()
         size = len(byte_content)
         with self.lock:
+            if self.batch_depth > 0:
+                self.pending.append(struct.pack(BinLog.size_fmt(),size))
+                self.pending.append(byte_content)
+                self.pending_size += BinLog.size_length() + size
+                return
             self.logger.write(struct.pack(BinLog.size_fmt(),size))
             self.logger.write(byte_content)
 
+    @contextmanager
+    def batch(self):
+        """
+        批量写入日志: 期间的日志先暂存，结束时作为一个整体写入 logger
+        暂存的日志也计入 log_end_pos, 写入页面之前调用的 flush 会先写入暂存的日志
+        :return:
+        """
+        with self.lock:
+            self.batch_depth += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    self._write_pending()
+
+    def _write_pending(self):
+        if self.pending:
+            self.logger.write(b''.join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+
     def read_single_log_entry(self,offset):
         size = struct.unpack_from(BinLog.size_fmt(),self.logger.read(offset,BinLog.size_length()),0)[0]
         entry = PhysicalPageLogEntry.deserialize(self.logger.read(offset + BinLog.size_length(),size))
@@ -90,7 +126,8 @@ class BinLog:
         return entry
 
     def read_log_entry(self,offset):
-        end_pos = self.log_end_pos()
+        # 暂存的日志还不能读取
+        end_pos = self.logger.end_position
         while offset < end_pos:
             size = struct.unpack_from(BinLog.size_fmt(),self.logger.read(offset,BinLog.size_length()),0)[0]
             entry = PhysicalPageLogEntry.deserialize(self.logger.read(offset + BinLog.size_length(),size))
@@ -100,11 +137,16 @@ class BinLog:
             offset+=size
 
     def log_end_pos(self):
-        return self.logger.end_position
+        with self.lock:
+            return self.logger.end_position + self.pending_size
 
     def flush(self):
+        with self.lock:
+            self._write_pending()
         self.logger.flush()
     def close(self):
+        with self.lock:
+            self._write_pending()
         self.logger.close()
 
 binlog = BinLog()
\ No newline at end of file
@@ -129,7 +129,10 @@ class RotatingLogger:
             self.end_position +=msg_size
 
     def flush(self):
-        self._flush_buffer()
+        # page cleaner 线程也会刷新日志，需要和写日志互斥
+        with self.lock:
+            if self.buffer_bytes > 0:
+                self._flush_buffer()
 
 
     def _flush_buffer(self):
@@ -18,21 +18,32 @@ def pack_into(fmt,page:CacheablePage, offset, *args):
 if config.OPEN_BINLOG:
 
     def set_page_data(page:CacheablePage, offset, data):
-        if page.container.log:
-            logentry = PhysicalPageLogEntry(page.container_id,page.page_num,offset,data)
-            binlog.write_log_entry(logentry)
-        if isinstance(data, Sized):
-            page.page_data[offset:offset + len(data)] = data
-        else:
-            page.page_data[offset] = data
-        page.dirty = True
+        with page.latch:
+            # 页面第一次变脏时记录写日志之前的位置，checkpoint 不会超过这个位置
+            if page.rec_lsn is None:
+                page.rec_lsn = binlog.log_end_pos()
+            page.materialize()
+            if page.container.log:
+                logentry = PhysicalPageLogEntry(page.container_id,page.page_num,offset,data)
+                binlog.write_log_entry(logentry)
+            if isinstance(data, Sized):
+                page.page_data[offset:offset + len(data)] = data
+            else:
+                page.page_data[offset] = data
+            page.dirty = True
+            page.version += 1
 else:
     def set_page_data(page:CacheablePage, offset, data):
-        if isinstance(data, Sized):
-            page.page_data[offset:offset + len(data)] = data
-        else:
-            page.page_data[offset] = data
-        page.dirty = True
+        with page.latch:
+            if page.rec_lsn is None:
+                page.rec_lsn = binlog.log_end_pos()
+            page.materialize()
+            if isinstance(data, Sized):
+                page.page_data[offset:offset + len(data)] = data
+            else:
+                page.page_data[offset] = data
+            page.dirty = True
+            page.version += 1
 
 def set_page_range_data(page:CacheablePage,src,dst,data):
     set_page_data(page, src, data)
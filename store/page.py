@@ -1,14 +1,15 @@
 
+import contextlib
+
 from store import log_struct
 
 
 
-from typing import Tuple, List, Any
+from typing import Tuple, List, Any, Dict
 
-import config
 import struct
 from store.values import Row,  Value
-from store.cacheable import CacheablePage,NORMAL_PAGE,OVER_FLOW_PAGE
+from store.cacheable import CacheablePage,NORMAL_PAGE,OVER_FLOW_PAGE,EXTENT_OVER_FLOW
 
 """
 slot table entry 大小固定
@@ -18,13 +19,14 @@ SLOT_TABLE_ENTRY_SIZE = 4 + 4
 
 
 
-def cal_slot_entry_offset(slot: int):
+def cal_slot_entry_offset(slot: int, page_size: int):
     """
     计算 slot entry的偏移量
     :param slot:
+    :param page_size: 页的大小
     :return:
     """
-    return config.PAGE_SIZE - (slot + 1) * SLOT_TABLE_ENTRY_SIZE
+    return page_size - (slot + 1) * SLOT_TABLE_ENTRY_SIZE
 
 
 class BasePage(CacheablePage):
@@ -32,20 +34,33 @@ class BasePage(CacheablePage):
         super().__init__(page_num, page_data)
         self.slot_num = 0
         self.next_id = 0
+        # 页面剩余可用空间，随 slot 的增减增量维护，避免每次遍历 slot table
+        self.free_space = 0
 
     def is_over_flow(self) -> bool:
         pass
 
 
     def increase_slot_num(self):
+        """
+        新增的 slot entry 需要先写入 slot table，再调用此方法
+        """
         self.slot_num += 1
+        _, record_len = self.read_slot_entry(self.slot_num - 1)
+        self.free_space -= record_len + SLOT_TABLE_ENTRY_SIZE
         self.sync()
 
     def set_slot_num(self,num:int):
         self.slot_num = num
+        self.free_space = self.count_free_space()
         self.sync()
 
     def decrease_slot_num(self):
+        """
+        被移除的 slot entry 需要先移动到最后一个 slot，再调用此方法
+        """
+        _, record_len = self.read_slot_entry(self.slot_num - 1)
+        self.free_space += record_len + SLOT_TABLE_ENTRY_SIZE
         self.slot_num -= 1
         self.sync()
 
@@ -106,15 +121,22 @@ class BasePage(CacheablePage):
         :param slot:
         :return:
         """
-        offset = cal_slot_entry_offset(slot)
+        offset = cal_slot_entry_offset(slot, self.page_size)
         return log_struct.unpack_from('<ii', self.page_data, offset)
 
     def cal_free_space(self):
+        return self.free_space
+
+    def count_free_space(self):
+        """
+        遍历 slot table 计算剩余可用空间
+        :return:
+        """
         space_used = self.header_size() + self.slot_num * SLOT_TABLE_ENTRY_SIZE
         for i in range(self.slot_num):
             record_offset, record_len = self.read_slot_entry(i)
             space_used += record_len
-        return config.PAGE_SIZE - space_used
+        return self.page_size - space_used
 
     def header_records_length(self, free_space: int):
         """
@@ -122,7 +144,7 @@ class BasePage(CacheablePage):
         :param free_space:
         :return:
         """
-        return config.PAGE_SIZE - self.slot_num * SLOT_TABLE_ENTRY_SIZE - free_space
+        return self.page_size - self.slot_num * SLOT_TABLE_ENTRY_SIZE - free_space
 
     def shrink(self, offset_start: int, shrink_bytes: int):
         """
@@ -154,10 +176,11 @@ class BasePage(CacheablePage):
         for slot, record_offset in shrink_slot:
             self.set_slot_record_offset(slot, record_offset)
 
-    def read_slot(self, slot: int) -> Any:
+    def read_slot(self, slot: int, field_num: int | None = None) -> Any:
         """
         根据 slot位置读取数据
         :param slot:
+        :param field_num: 只读取前 field_num 个field
         :return:
         """
         pass
@@ -179,13 +202,13 @@ class BasePage(CacheablePage):
         """
         # 读取src_slot的内容
         record_offset, record_len = self.read_slot_entry(src_slot)
-        log_struct.pack_into("<ii",self, cal_slot_entry_offset(target_slot), record_offset, record_len)
+        log_struct.pack_into("<ii",self, cal_slot_entry_offset(target_slot, self.page_size), record_offset, record_len)
 
     def set_slot(self, slot: int, record_offset: int, record_len: int):
-        log_struct.pack_into("<ii", self, cal_slot_entry_offset(slot), record_offset, record_len)
+        log_struct.pack_into("<ii", self, cal_slot_entry_offset(slot, self.page_size), record_offset, record_len)
 
     def set_slot_record_offset(self, slot: int, record_offset: int):
-        log_struct.pack_into("<i", self, cal_slot_entry_offset(slot), record_offset)
+        log_struct.pack_into("<i", self, cal_slot_entry_offset(slot, self.page_size), record_offset)
 
     def search_slot_by_record_offset(self, offset: int):
         for i in range(self.slot_num):
@@ -302,7 +325,7 @@ class Field:
          status field_space_use   field_data_length
         :return:
         """
-        return "<bhh"
+        return "<bii"
     @staticmethod
     def over_flow_field_header_fmt():
         """
@@ -311,7 +334,7 @@ class Field:
         status field_space_use   field_data_length over_flow_page over_flow_record
         :return:
         """
-        return "<bhhii"
+        return "<biiii"
 
 
 class Record:
@@ -330,6 +353,10 @@ class CommonPage(BasePage):
      slot数量  4
      下一个可用的记录id  4
      当前页使用的over_flow_page的最大id 4
+     剩余可用空间 4
+     btree 节点类型 1
+     btree 左侧节点 4
+     btree 右侧节点 4
      日志记录号 8
      record1,record2,record3 ....
      <slot table>
@@ -344,9 +371,9 @@ class CommonPage(BasePage):
        和slot table中的 record length含义不一样
         status: 1  字段状态
         如果不over，flow:
-        fieldSpace 2  fieldDataLength 2   fieldData
+        fieldSpace 4  fieldDataLength 4   fieldData
         如果over flow
-        fieldSpace 2  fieldDataLength 2  over_flow page_number 4   over_flow_record id 4  fieldData
+        fieldSpace 4  fieldDataLength 4  over_flow page_number 4   over_flow_record id 4  fieldData
         如果null,长度依然保留，后续可能会更改内容
      <slot table>
       slot 偏移量  4
@@ -356,8 +383,14 @@ class CommonPage(BasePage):
 
     def __init__(self, page_num: int, page_data: bytearray):
         super().__init__(page_num, page_data)
-        self.page_type, self.slot_num, self.next_id, self.over_flow_page_num,self.lsn = log_struct.unpack_from('<biiiL',
-                                                                                                  self.page_data, 0)
+        (self.page_type, self.slot_num, self.next_id, self.over_flow_page_num, self.free_space,
+         self.node_type, self.node_left, self.node_right, self.lsn) = log_struct.unpack_from(CommonPage.header_fmt(), self.page_data, 0)
+        # record id -> slot 的索引，以及构建索引时页面的版本号
+        self.record_slot_index: Dict[int, int] = {}
+        self.record_slot_version = -1
+        # btree 解析后的节点内容，以及解析时页面的版本号
+        self.decoded_node = None
+        self.decoded_node_version = -1
 
     def set_lsn(self, lsn):
         super().set_lsn(lsn)
@@ -366,15 +399,34 @@ class CommonPage(BasePage):
 
     def sync(self):
         log_struct.pack_into(CommonPage.header_fmt(), self, 0, self.page_type, self.slot_num, self.next_id,
-                         self.over_flow_page_num,self.lsn)
+                         self.over_flow_page_num, self.free_space, self.node_type, self.node_left, self.node_right, self.lsn)
         self.dirty = True
 
+    def set_node_header(self, node_type: int, left: int, right: int):
+        """
+        btree 节点的类型和左右节点固定保存在页面头部，只写入这一部分
+        :param node_type:
+        :param left: 左侧节点的页号，没有时为 -1
+        :param right: 右侧节点的页号，没有时为 -1
+        :return:
+        """
+        self.node_type, self.node_left, self.node_right = node_type, left, right
+        log_struct.pack_into(CommonPage.node_header_fmt(), self, CommonPage.node_header_offset(), node_type, left, right)
+
     def lsn_offset(self):
         return struct.calcsize(CommonPage.header_fmt()[0:-1])
 
     @staticmethod
     def header_fmt():
-        return '<biiiL'
+        return '<biiiibiiL'
+
+    @staticmethod
+    def node_header_fmt():
+        return '<bii'
+
+    @staticmethod
+    def node_header_offset():
+        return struct.calcsize(CommonPage.header_fmt()[0:6])
 
     def header_size(self) -> int:
         return struct.calcsize(self.header_fmt())
@@ -389,7 +441,7 @@ class CommonPage(BasePage):
          status fieldSpace fieldDataLength
         :return:
         """
-        return 1 + 2 + 2
+        return 1 + 4 + 4
 
     @staticmethod
     def record_header_fmt():
@@ -415,6 +467,21 @@ class CommonPage(BasePage):
         """
         return CommonPage.record_header_size() + SLOT_TABLE_ENTRY_SIZE
 
+    @staticmethod
+    def record_space(row: Row) -> int:
+        """
+        记录全部存放在当页时占用的空间，包括 slot
+        :param row:
+        :return:
+        """
+        size = CommonPage.record_min_size()
+        for value in row.values:
+            if value.len_variable():
+                size += CommonPage.over_flow_field_header() + (0 if value.is_null else value.space_use())
+            else:
+                size += CommonPage.field_header_length() + value.space_use()
+        return size
+
     @staticmethod
     def over_flow_field_data_size() -> int:
         """
@@ -426,23 +493,30 @@ class CommonPage(BasePage):
         return 4 + 4
 
     def get_over_flow_page(self, min_space: int | None = None):
+        # over flow 页面中的记录全部删除之后页面会被释放，之后可能分配给了其他节点
+        if self.over_flow_page_num != -1 and not self.container.is_over_flow_page(self.over_flow_page_num):
+            self.over_flow_page_num = -1
         if self.over_flow_page_num == -1:
-            over_page = self.container.new_common_page(is_over_flow=True)
+            over_page = self.container.new_common_page(is_over_flow=True, extent=EXTENT_OVER_FLOW)
             self.over_flow_page_num = over_page.page_num
         else:
             over_page = self.container.get_page(self.over_flow_page_num)
         if min_space and over_page.cal_free_space() < min_space:
-            over_page = self.container.new_common_page(is_over_flow=True)
+            over_page = self.container.new_common_page(is_over_flow=True, extent=EXTENT_OVER_FLOW)
             self.over_flow_page_num = over_page.page_num
         return over_page
 
     def get_slot_num_by_record_id(self, record_id: int):
-        for i in range(self.slot_num):
-            offset, record_length = self.read_slot_entry(i)
-            _, temp_record_id = log_struct.unpack_from('<bi', self.page_data, offset)
-            if temp_record_id == record_id:
-                return i
-        return -1
+        # 页面修改过之后才重新构建 record id -> slot 的索引
+        if self.record_slot_version != self.version:
+            self.record_slot_index = {}
+            for i in range(self.slot_num):
+                offset, record_length = self.read_slot_entry(i)
+                _, temp_record_id = log_struct.unpack_from('<bi', self.page_data, offset)
+                # 存在相同的 record id 时(删除过程中)，和顺序查找一样返回第一个
+                self.record_slot_index.setdefault(temp_record_id, i)
+            self.record_slot_version = self.version
+        return self.record_slot_index.get(record_id, -1)
 
     def get_record_id_by_slot(self, slot: int):
         offset, _ = self.read_slot_entry(slot)
@@ -454,6 +528,36 @@ class CommonPage(BasePage):
         return record_offset, record_length, CommonPageRecordHeader(
             *log_struct.unpack_from(CommonPage.record_header_fmt(), self.page_data, record_offset))
 
+    def has_over_flow_by_slot(self, slot: int) -> bool:
+        """
+        记录是否有部分内容存放在 over flow 页面中
+        """
+        return len(self.over_flow_refs_by_slot(slot)) > 0
+
+    def over_flow_refs_by_slot(self, slot: int) -> List[Tuple[int, int]]:
+        """
+        记录直接引用的 over flow 记录，包括 field 的后续部分和 record 的后续部分
+        :return: [(page num, record id)]
+        """
+        refs = []
+        record_offset, _, record_header = self.read_record_header_by_slot(slot)
+        field_offset = record_offset + self.record_header_size()
+        for i in range(record_header.col_num):
+            status, field_space_use, _ = log_struct.unpack_from(Field.no_over_flow_field_header_fmt(), self.page_data, field_offset)
+            field_offset += self.field_header_length()
+            if status == FIELD_OVER_FLOW:
+                next_page_num, next_record_id = log_struct.unpack_from('<ii', self.page_data, field_offset)
+                if next_page_num != -1:
+                    refs.append((next_page_num, next_record_id))
+                field_offset += field_space_use + self.over_flow_field_data_size()
+            elif status == FIELD_OVER_FLOW_NULL:
+                field_offset += self.over_flow_field_data_size()
+            else:
+                field_offset += field_space_use
+        if record_header.next_page_num != -1:
+            refs.append((record_header.next_page_num, record_header.next_record_id))
+        return refs
+
     def read_record_header_by_record_id(self, record_id: int) -> Tuple[int, int, int, CommonPageRecordHeader]:
         """
         返回 记录偏移，记录长度 slot record_header
@@ -475,66 +579,68 @@ class CommonPage(BasePage):
 
     def write_long_field(self, field: Value, write_from, over_record_id: int, page: BasePage):
         cur_record_id = over_record_id
-        cur_page = page
         field_bytes = field.get_bytes()
         field_size = len(field_bytes)
-        # 每次都尝试把页写满
-        while write_from < field_size:
-            free_space = cur_page.cal_free_space()
-            # 还需要写的数据长度
-            field_length = field_size - write_from
-            # 获取写入数据的
-            record_offset_start = cur_page.header_records_length(free_space)
-            slot_offset_start = cal_slot_entry_offset(cur_page.slot_num)
-            # 调整可用空间
-            free_space -= CommonPage.record_min_size()
-            # 写入field的位置
-            field_write_offset = record_offset_start + cur_page.record_header_size()
-            # 写入field
-            #  !!!!!!! 1. 本次可以完全写完,但是也采用 FIELD_OVER_FLOW形式，方便扩容
-            if field_length + CommonPage.over_flow_field_header() <= free_space:
-                # 写入数据部分, field_space_use和field_data_length保持一致
-                log_struct.pack_into(Field.over_flow_field_header_fmt(), cur_page, field_write_offset, FIELD_OVER_FLOW, field_length,field_length,-1,-1)
-
-                log_struct.set_page_range_data(cur_page,
-                                               field_write_offset + CommonPage.over_flow_field_header(),
-                                               field_write_offset + CommonPage.over_flow_field_header() + field_length,
-                                               field.get_bytes()[write_from:]
-               )
-                # 写入 record header
-                log_struct.pack_into(CommonPage.record_header_fmt(), cur_page, record_offset_start, SINGLE_PAGE, cur_record_id, 1, -1,
-                                 -1)
-                # 写入 slot table
-                log_struct.pack_into('<ii', cur_page, slot_offset_start, record_offset_start,
-                                 field_write_offset + CommonPage.over_flow_field_header() + field_length - record_offset_start)
-                write_from += field_length
-                cur_page.increase_slot_num()
-                break
-            # 写多次
-            else:
-                cur_page_len = free_space - CommonPage.over_flow_field_header()
-                over_page = cur_page.get_over_flow_page(
-                    CommonPage.record_min_size() + CommonPage.field_header_length() + min(cur_page_len, 10))
-                over_page_record_id = over_page.get_next_record_id()
-                log_struct.pack_into(Field.over_flow_field_header_fmt(), cur_page, field_write_offset, FIELD_OVER_FLOW, cur_page_len,cur_page_len,
-                                 over_page.page_num, over_page_record_id)
-
-                log_struct.set_page_range_data(cur_page,
-                                               field_write_offset + CommonPage.over_flow_field_header() ,
-                                               CommonPage.over_flow_field_header() + field_write_offset + cur_page_len ,
-                                               field.get_bytes()[write_from:write_from + cur_page_len]
-                )
-                write_from += cur_page_len
-                # 写入 record header
-                log_struct.pack_into(CommonPage.record_header_fmt(), cur_page, record_offset_start, MULTI_PAGE, cur_record_id, 1,
-                                 over_page.page_num, over_page_record_id)
-                # 写入 slot table
-                log_struct.pack_into('<ii', cur_page, slot_offset_start, record_offset_start,
-                                 field_write_offset + CommonPage.over_flow_field_header() + cur_page_len - record_offset_start)
-                cur_page.increase_slot_num()
-                # 多的写入下一页
-                cur_page = over_page
-                cur_record_id = over_page_record_id
+        # 写入的页面在分配下一个溢出页时不能被淘汰
+        with contextlib.ExitStack() as pinned_pages:
+            cur_page = pinned_pages.enter_context(page.pinned())
+            # 每次都尝试把页写满
+            while write_from < field_size:
+                free_space = cur_page.cal_free_space()
+                # 还需要写的数据长度
+                field_length = field_size - write_from
+                # 获取写入数据的
+                record_offset_start = cur_page.header_records_length(free_space)
+                slot_offset_start = cal_slot_entry_offset(cur_page.slot_num, cur_page.page_size)
+                # 调整可用空间
+                free_space -= CommonPage.record_min_size()
+                # 写入field的位置
+                field_write_offset = record_offset_start + cur_page.record_header_size()
+                # 写入field
+                #  !!!!!!! 1. 本次可以完全写完,但是也采用 FIELD_OVER_FLOW形式，方便扩容
+                if field_length + CommonPage.over_flow_field_header() <= free_space:
+                    # 写入数据部分, field_space_use和field_data_length保持一致
+                    log_struct.pack_into(Field.over_flow_field_header_fmt(), cur_page, field_write_offset, FIELD_OVER_FLOW, field_length,field_length,-1,-1)
+
+                    log_struct.set_page_range_data(cur_page,
+                                                   field_write_offset + CommonPage.over_flow_field_header(),
+                                                   field_write_offset + CommonPage.over_flow_field_header() + field_length,
+                                                   field.get_bytes()[write_from:]
+                   )
+                    # 写入 record header
+                    log_struct.pack_into(CommonPage.record_header_fmt(), cur_page, record_offset_start, SINGLE_PAGE, cur_record_id, 1, -1,
+                                     -1)
+                    # 写入 slot table
+                    log_struct.pack_into('<ii', cur_page, slot_offset_start, record_offset_start,
+                                     field_write_offset + CommonPage.over_flow_field_header() + field_length - record_offset_start)
+                    write_from += field_length
+                    cur_page.increase_slot_num()
+                    break
+                # 写多次
+                else:
+                    cur_page_len = free_space - CommonPage.over_flow_field_header()
+                    over_page = cur_page.get_over_flow_page(
+                        CommonPage.record_min_size() + CommonPage.over_flow_field_header() + min(cur_page_len, 10))
+                    over_page_record_id = over_page.get_next_record_id()
+                    log_struct.pack_into(Field.over_flow_field_header_fmt(), cur_page, field_write_offset, FIELD_OVER_FLOW, cur_page_len,cur_page_len,
+                                     over_page.page_num, over_page_record_id)
+
+                    log_struct.set_page_range_data(cur_page,
+                                                   field_write_offset + CommonPage.over_flow_field_header() ,
+                                                   CommonPage.over_flow_field_header() + field_write_offset + cur_page_len ,
+                                                   field.get_bytes()[write_from:write_from + cur_page_len]
+                    )
+                    write_from += cur_page_len
+                    # 写入 record header
+                    log_struct.pack_into(CommonPage.record_header_fmt(), cur_page, record_offset_start, MULTI_PAGE, cur_record_id, 1,
+                                     over_page.page_num, over_page_record_id)
+                    # 写入 slot table
+                    log_struct.pack_into('<ii', cur_page, slot_offset_start, record_offset_start,
+                                     field_write_offset + CommonPage.over_flow_field_header() + cur_page_len - record_offset_start)
+                    cur_page.increase_slot_num()
+                    # 多的写入下一页
+                    cur_page = pinned_pages.enter_context(over_page.pinned())
+                    cur_record_id = over_page_record_id
 
 
     def write_over_flow_field(self, field: Value, page, free_space: int, write_offset: int,status:int):
@@ -561,7 +667,7 @@ class CommonPage(BasePage):
         if cur_page_len < field_data_length:
             # 新开辟的页，最少也要有写入一个field的空间
             over_page = page.get_over_flow_page(
-                CommonPage.record_min_size() + CommonPage.field_header_length() + min(cur_page_len, 10))
+                CommonPage.record_min_size() + CommonPage.over_flow_field_header() + min(cur_page_len, 10))
             over_page_record_id = over_page.get_next_record_id()
             log_struct.pack_into(Field.over_flow_field_header_fmt(), page, write_offset, FIELD_OVER_FLOW, cur_page_len,cur_page_len,
                                  over_page.page_num, over_page_record_id)
@@ -627,7 +733,7 @@ class CommonPage(BasePage):
         # 不够写入header信息
         if free_space < CommonPage.record_min_size():
             return -1, -1
-        slot_offset_start = cal_slot_entry_offset(self.slot_num)
+        slot_offset_start = cal_slot_entry_offset(self.slot_num, self.page_size)
         # 获取写入record数据的偏移
         record_offset_start = self.header_records_length(free_space)
         log_struct.pack_into(CommonPage.record_header_fmt(), self, record_offset_start, MULTI_PAGE, record_id,
@@ -651,53 +757,55 @@ class CommonPage(BasePage):
             record_id = cur_record_id = self.get_next_record_id()
         else:
             cur_record_id = record_id
-        cur_page = self
-        # 逐个field的写入
-        wrote_cols = 0
-        while wrote_cols < len(row.values):
-            # 可用空间
-            free_space = cur_page.cal_free_space()
-            # 不够写入header信息
-            if free_space < CommonPage.record_min_size():
-                return -1, -1
-            # 获取写入数据的
-            record_offset_start = cur_page.header_records_length(free_space)
-
-            slot_offset_start = cal_slot_entry_offset(cur_page.slot_num)
-            # 调整可用空间
-            free_space -= CommonPage.record_min_size()
-            # 写入field的位置
-            field_write_offset = record_offset_start + cur_page.record_header_size()
-            step_wrote_cols = 0
-            while wrote_cols + step_wrote_cols < len(row.values):
-                value = row.values[wrote_cols + step_wrote_cols]
-                write_len = cur_page.write_field(value, cur_page, free_space, field_write_offset)
-                if write_len == -1:
-                    break
-                free_space -= write_len
-                field_write_offset += write_len
-                step_wrote_cols += 1
-            # 当页没有写完,record需要多个页来存储
-            if wrote_cols + step_wrote_cols < len(row.values):
-                over_page = cur_page.get_over_flow_page(CommonPage.record_min_size())
-                over_record_id = over_page.get_next_record_id()
-                log_struct.pack_into(CommonPage.record_header_fmt(), cur_page, record_offset_start, MULTI_PAGE, cur_record_id,
-                                 step_wrote_cols, over_page.page_num,
-                                 over_record_id)
-                log_struct.pack_into('<ii', cur_page, slot_offset_start, record_offset_start,
-                                 field_write_offset - record_offset_start)
-                cur_page.increase_slot_num()
-                cur_record_id = over_record_id
-                cur_page = over_page
-            #当页写完了
-            else:
-                cur_page.increase_slot_num()
-                log_struct.pack_into(CommonPage.record_header_fmt() , cur_page, record_offset_start, SINGLE_PAGE, cur_record_id,
-                                 step_wrote_cols, -1,
-                                 -1)
-                log_struct.pack_into('<ii', cur_page, slot_offset_start, record_offset_start,
-                                 field_write_offset - record_offset_start)
-            wrote_cols += step_wrote_cols
+        # 记录所在的页面在分配溢出页时不能被淘汰
+        with contextlib.ExitStack() as pinned_pages:
+            cur_page = pinned_pages.enter_context(self.pinned())
+            # 逐个field的写入
+            wrote_cols = 0
+            while wrote_cols < len(row.values):
+                # 可用空间
+                free_space = cur_page.cal_free_space()
+                # 不够写入header信息
+                if free_space < CommonPage.record_min_size():
+                    return -1, -1
+                # 获取写入数据的
+                record_offset_start = cur_page.header_records_length(free_space)
+
+                slot_offset_start = cal_slot_entry_offset(cur_page.slot_num, cur_page.page_size)
+                # 调整可用空间
+                free_space -= CommonPage.record_min_size()
+                # 写入field的位置
+                field_write_offset = record_offset_start + cur_page.record_header_size()
+                step_wrote_cols = 0
+                while wrote_cols + step_wrote_cols < len(row.values):
+                    value = row.values[wrote_cols + step_wrote_cols]
+                    write_len = cur_page.write_field(value, cur_page, free_space, field_write_offset)
+                    if write_len == -1:
+                        break
+                    free_space -= write_len
+                    field_write_offset += write_len
+                    step_wrote_cols += 1
+                # 当页没有写完,record需要多个页来存储
+                if wrote_cols + step_wrote_cols < len(row.values):
+                    over_page = cur_page.get_over_flow_page(CommonPage.record_min_size())
+                    over_record_id = over_page.get_next_record_id()
+                    log_struct.pack_into(CommonPage.record_header_fmt(), cur_page, record_offset_start, MULTI_PAGE, cur_record_id,
+                                     step_wrote_cols, over_page.page_num,
+                                     over_record_id)
+                    log_struct.pack_into('<ii', cur_page, slot_offset_start, record_offset_start,
+                                     field_write_offset - record_offset_start)
+                    cur_page.increase_slot_num()
+                    cur_record_id = over_record_id
+                    cur_page = pinned_pages.enter_context(over_page.pinned())
+                #当页写完了
+                else:
+                    log_struct.pack_into(CommonPage.record_header_fmt() , cur_page, record_offset_start, SINGLE_PAGE, cur_record_id,
+                                     step_wrote_cols, -1,
+                                     -1)
+                    log_struct.pack_into('<ii', cur_page, slot_offset_start, record_offset_start,
+                                     field_write_offset - record_offset_start)
+                    cur_page.increase_slot_num()
+                wrote_cols += step_wrote_cols
 
         return record_id, self.page_num
 
@@ -709,11 +817,15 @@ class CommonPage(BasePage):
         """
         写入头部信息
         """
+        self.free_space = self.page_size - self.header_size()
         if is_over_flow:
-            log_struct.pack_into('<biiiL', self, 0, OVER_FLOW_PAGE, 0, 0, -1,0)
+            log_struct.pack_into(CommonPage.header_fmt(), self, 0, OVER_FLOW_PAGE, 0, 0, -1, self.free_space, 0, -1, -1, 0)
         else:
-            log_struct.pack_into('<biiiL', self, 0, NORMAL_PAGE, 0, 0, -1,0)
+            log_struct.pack_into(CommonPage.header_fmt(), self, 0, NORMAL_PAGE, 0, 0, -1, self.free_space, 0, -1, -1, 0)
+        # sync 按照属性重新写入头部，页面类型需要和头部一致
+        self.page_type = OVER_FLOW_PAGE if is_over_flow else NORMAL_PAGE
         self.over_flow_page_num = -1
+        self.node_type, self.node_left, self.node_right = 0, -1, -1
 
     def delete_by_slot(self, slot: int) -> int:
         record_id = self.get_record_id_by_slot(slot)
@@ -869,8 +981,11 @@ class CommonPage(BasePage):
         record_id = self.get_record_id_by_slot(slot)
         self.update_field_by_index(record_id, field_index,value)
     def update_field_by_index(self, record_id: int, field_index: int, value: Value):
-        field = self.read_field_by_index(record_id, field_index)
-        self.update_field(field, value)
+        with self.pinned():
+            field = self.read_field_by_index(record_id, field_index)
+            self.update_field(field, value)
+            # field 可能在 over flow 页面中原地修改，记录所在的页面也要增加版本号，使基于页面内容的缓存失效
+            self.version += 1
 
     def update_field_data_length(self,field:Field,field_data_length: int):
         """
@@ -949,13 +1064,15 @@ class CommonPage(BasePage):
             over_flow_page = self.get_over_flow_page(
                 CommonPage.record_min_size() + CommonPage.over_flow_field_header())
             over_flow_record_id = over_flow_page.get_next_record_id()
-            last_field_page = self.container.get_page(last_field.page_num)
+            # 读取 last_field 所在的页面时 over_flow_page 不能被淘汰
+            with over_flow_page.pinned():
+                last_field_page = self.container.get_page(last_field.page_num)
 
-            #数据已经写入了，这里只修改 over flow 信息
-            log_struct.pack_into('<ii', last_field_page, last_field.offset + self.field_header_length(), over_flow_page.page_num,
-                                 over_flow_record_id)
+                #数据已经写入了，这里只修改 over flow 信息
+                log_struct.pack_into('<ii', last_field_page, last_field.offset + self.field_header_length(), over_flow_page.page_num,
+                                     over_flow_record_id)
 
-            last_field_page.write_long_field(value, wrote_data_length, over_flow_record_id, over_flow_page)
+                last_field_page.write_long_field(value, wrote_data_length, over_flow_record_id, over_flow_page)
 
     def update_over_flow_field(self,field:Field,value:Value):
         page = self.container.get_page(field.page_num)
@@ -965,10 +1082,11 @@ class CommonPage(BasePage):
             log_struct.pack_into(Field.no_over_flow_field_header_fmt(), page, field.offset, FIELD_OVER_FLOW_NULL, field.field_space_use, 0)
             return
 
-        #读取 over flow field 后续的部分
+        #读取 over flow field 后续的部分, 读取期间 page 不能被淘汰
         follow_over_flow:List[Field]|None= None
         if field.over_flow_page and field.over_flow_page != -1:
-            follow_over_flow = self.read_over_flow_field_header(field.over_flow_page,field.over_flow_record)
+            with page.pinned():
+                follow_over_flow = self.read_over_flow_field_header(field.over_flow_page,field.over_flow_record)
 
         #空间占用
         field_data_length = value.space_use()
@@ -1000,8 +1118,10 @@ class CommonPage(BasePage):
     def update_by_record_id(self, row: Row, record_id: int):
         #! !!!! 一定要反向更新，因为每个field在调整时会shrink data，如果正向更新，后续的field的offset会
         #变化
-        for field,value in zip(reversed(self.read_all_field(record_id)),reversed(row.values)):
-            self.update_field(field, value)
+        with self.pinned():
+            for field,value in zip(reversed(self.read_all_field(record_id)),reversed(row.values)):
+                self.update_field(field, value)
+            self.version += 1
 
 
 
@@ -1009,7 +1129,12 @@ class CommonPage(BasePage):
         record_id = self.get_record_id_by_slot(slot)
         self.update_by_record_id(row, record_id)
 
-    def read_slot(self, slot: int) -> Record:
+    def read_slot(self, slot: int, field_num: int | None = None) -> Record:
+        """
+        :param slot:
+        :param field_num: 只读取前 field_num 个field, 为None时读取全部
+        :return:
+        """
         cur_slot = slot
         cur_page = self
         record_offset, _, record_header = cur_page.read_record_header_by_slot(cur_slot)
@@ -1019,6 +1144,9 @@ class CommonPage(BasePage):
             # 读取field
             field_offset = record_offset + cur_page.record_header_size()
             for i in range(record_header.col_num):
+                # 已经读取到足够的field
+                if field_num is not None and len(fields_list) >= field_num:
+                    break
                 status, field_space_use,field_data_length = log_struct.unpack_from(Field.no_over_flow_field_header_fmt(), cur_page.page_data, field_offset)
                 field = Field(status, cur_page.page_num, field_offset, field_space_use,field_data_length)
                 fields_list.append(field)
@@ -1041,6 +1169,8 @@ class CommonPage(BasePage):
                     field_offset += field_space_use
                     if  next_page_num != -1:
                         cur_page.read_over_flow_field(next_page_num, next_record_id, field)
+            if field_num is not None and len(fields_list) >= field_num:
+                break
             # 读取下一页
             if  record_header.next_page_num != -1:
                 cur_page = self.container.get_page(record_header.next_page_num)
@@ -1050,6 +1180,27 @@ class CommonPage(BasePage):
                 break
         return Record(result_record_header, fields_list)
 
+    def read_first_field_data(self, slot: int) -> bytearray:
+        """
+        读取 slot 对应 record 第一个 field 的数据, 数据完整的存放在当页时直接截取 page_data，不构建 Record
+        :param slot:
+        :return:
+        """
+        record_offset, _, record_header = self.read_record_header_by_slot(slot)
+        if record_header.col_num > 0:
+            field_offset = record_offset + self.record_header_size()
+            status = self.page_data[field_offset]
+            if status == FIELD_NOT_OVER_FLOW:
+                _, _, field_data_length = log_struct.unpack_from(Field.no_over_flow_field_header_fmt(), self.page_data, field_offset)
+                data_offset = field_offset + self.field_header_length()
+                return bytes(self.page_data[data_offset:data_offset + field_data_length])
+            if status == FIELD_OVER_FLOW:
+                _, _, field_data_length, next_page_num, _ = log_struct.unpack_from(Field.over_flow_field_header_fmt(), self.page_data, field_offset)
+                if next_page_num == -1:
+                    data_offset = field_offset + self.over_flow_field_header()
+                    return bytes(self.page_data[data_offset:data_offset + field_data_length])
+        return self.read_slot(slot, 1).fields[0].value
+
     def _delete_record_id(self, record_id: int):
         """
         :return:
@@ -1058,7 +1209,7 @@ class CommonPage(BasePage):
         wait_deleted = [(self.page_num, record_id)]
         while len(wait_deleted) > 0:
             cur_page_num, cur_record_id = wait_deleted.pop(0)
-            if (cur_page_num, record_id) in deleted:
+            if (cur_page_num, cur_record_id) in deleted:
                 continue
             deleted.append((cur_page_num, cur_record_id))
             cur_page = self.container.get_page(cur_page_num)
@@ -1089,6 +1240,9 @@ class CommonPage(BasePage):
             # 删除slot,将被删除的slot移除到最后的位置
             cur_page.move_and_insert_slot(slot, cur_page.slot_num - 1)
             cur_page.decrease_slot_num()
+            # over flow 页面中没有记录之后交给 PageManager 重新分配
+            if cur_page.is_over_flow() and cur_page.slot_num == 0:
+                self.container.free_over_flow_page(cur_page_num)
             if  record_header.next_page_num != -1 and  (record_header.next_page_num,
                                                               record_header.next_record_id) not in wait_deleted:
                 wait_deleted.append((record_header.next_page_num, record_header.next_record_id))
@@ -1097,7 +1251,7 @@ class CommonPage(BasePage):
         record_offset,record_len = self.read_slot_entry(src_page_slot)
         free_space = another_page.cal_free_space()
         new_record_offset_start = another_page.header_records_length(free_space)
-        new_slot_offset_start = cal_slot_entry_offset(another_page.slot_num)
+        new_slot_offset_start = cal_slot_entry_offset(another_page.slot_num, another_page.page_size)
         if new_record_offset_start + record_len >= new_slot_offset_start:
             raise Exception('another_page 没有足够的空间')
         #拷贝数据
@@ -1141,7 +1295,7 @@ class CommonPage(BasePage):
         for record_offset,record_len in all_record:
             free_space = another_page.cal_free_space()
             new_record_offset_start = another_page.header_records_length(free_space)
-            new_slot_offset_start = cal_slot_entry_offset(another_page.slot_num)
+            new_slot_offset_start = cal_slot_entry_offset(another_page.slot_num, another_page.page_size)
             if new_record_offset_start + record_len > new_slot_offset_start:
                 raise Exception('another_page 没有足够的空间')
             #拷贝数据
@@ -0,0 +1,104 @@
+import threading
+import weakref
+
+import config
+from store.log.binlog import binlog
+from store.pagedatacache import page_data_cache
+
+
+class PageCleaner:
+    """
+    后台写回脏页的线程
+    每轮按 rec_lsn 从小到大写回一部分脏页，然后记录 fuzzy checkpoint:
+    缓冲池中所有脏页 rec_lsn 的最小值，没有脏页时为当前日志结束位置
+    checkpoint 之前的日志对应的修改都已经 fsync 到 container 文件，恢复时只需要从 checkpoint 开始重放
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # 已经打开的 container，记录 checkpoint 之前需要 fsync
+        self._containers = weakref.WeakSet()
+
+    def register(self, container):
+        with self._lock:
+            self._containers.add(container)
+        # 没有日志时写回的页面可能是 split 等操作的中间状态，崩溃之后无法恢复，只在关闭和淘汰时写回
+        if config.PAGE_CLEANER_ENABLED and config.OPEN_BINLOG:
+            self.start()
+
+    def unregister(self, container):
+        with self._lock:
+            self._containers.discard(container)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='page-cleaner', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._stop_event.set()
+            thread.join()
+
+    def _run(self):
+        while not self._stop_event.wait(config.PAGE_CLEANER_INTERVAL):
+            self.clean()
+
+    def clean(self, max_pages: int | None = None) -> int:
+        """
+        按 rec_lsn 顺序写回最多 max_pages 个脏页并记录 checkpoint
+        :param max_pages: 默认 config.PAGE_CLEANER_PAGES_PER_ROUND
+        :return: 写回的页面数量
+        """
+        if max_pages is None:
+            max_pages = config.PAGE_CLEANER_PAGES_PER_ROUND
+        log_end_pos = binlog.log_end_pos()
+        # 写回之前页面不能被淘汰，否则主线程可能重新读取并修改页面，之后这里又写回了旧的内容
+        pinned_pages = page_data_cache.pin_dirty_pages()
+        try:
+            dirty_pages = sorted(pinned_pages,
+                                 key=lambda page: log_end_pos if page.rec_lsn is None else page.rec_lsn)[:max_pages]
+            # 同一个 container 的页面按页号排序后合并写入
+            container_pages = {}
+            for page in dirty_pages:
+                container_pages.setdefault(id(page.container), (page.container, []))[1].append(page)
+            for container, pages in container_pages.values():
+                container.write_pages(pages)
+            written = len(dirty_pages)
+        finally:
+            for page in pinned_pages:
+                page.unpin()
+        self.check_point()
+        return written
+
+    def check_point(self) -> int:
+        """
+        记录 fuzzy checkpoint
+        先读取日志结束位置再扫描脏页: 扫描时还没有开始修改的页面，它的日志一定在这个位置之后
+        :return: checkpoint
+        """
+        check_point = binlog.log_end_pos()
+        for page in page_data_cache.dirty_pages():
+            rec_lsn = page.rec_lsn
+            if rec_lsn is not None and rec_lsn < check_point:
+                check_point = rec_lsn
+        # 已经标记为干净的页面可能只写入了操作系统缓存
+        with self._lock:
+            containers = list(self._containers)
+        for container in containers:
+            container.sync()
+        # 没有日志时 checkpoint 没有意义，不需要每轮重写 meta.json
+        if config.OPEN_BINLOG and check_point > config.get_check_point():
+            config.set_check_point(check_point)
+        return check_point
+
+
+page_cleaner = PageCleaner()
@@ -1,30 +1,46 @@
-import threading
+from typing import List
+
+from store.bufferpool import BufferPool
+from store.cacheable import CacheablePage
 
 
 class PageDataCache:
-    def __init__(self):
-        self._lock = threading.Lock()
-        self._dict = {}
-    def set(self, container_id,page_id, value):
-        with self._lock:
-            self._dict[(container_id,page_id)] = value
+    """
+    进程内唯一的页面缓存, 所有 container 共享同一个容量有限的缓冲池
+    使用 (container_id, page_id) 作为 key, 同一个页面在内存中只有一份
+    """
+    def __init__(self, capacity: int | None = None):
+        self._pool = BufferPool(capacity)
+    def set(self, container_id,page_id, value, referenced: bool = True):
+        self._pool.put((container_id,page_id), value, referenced)
     def get(self,  container_id,page_id, default=None):
-        with self._lock:
-            return self._dict.get((container_id,page_id), default)
+        page = self._pool.get((container_id,page_id))
+        if page is None:
+            return default
+        return page
+    def contains(self, container_id, page_id) -> bool:
+        return (container_id, page_id) in self._pool
     def delete(self,  container_id,page_id):
-        with self._lock:
-            if (container_id,page_id) in self._dict:
-                del self._dict[(container_id,page_id)]
+        self._pool.remove((container_id,page_id))
     def items(self):
-        with self._lock:
-            return list(self._dict.items())
+        return self._pool.items()
     def keys(self):
-        with self._lock:
-            return list(self._dict.keys())
+        return [key for key, _ in self._pool.items()]
     def values(self):
-        with self._lock:
-            return list(self._dict.values())
+        return [page for _, page in self._pool.items()]
+    def dirty_pages(self) -> List[CacheablePage]:
+        return self._pool.dirty_pages()
+    def pin_dirty_pages(self) -> List[CacheablePage]:
+        return self._pool.pin_dirty_pages()
+    def capacity(self) -> int:
+        return self._pool.capacity
+    def resize(self, capacity: int):
+        self._pool.resize(capacity)
+    def container_pages(self, container_id) -> List[CacheablePage]:
+        """
+        返回缓存中属于 container 的所有页面
+        """
+        return [page for (cur_container_id, _), page in self._pool.items() if cur_container_id == container_id]
 
 
 page_data_cache = PageDataCache()
-
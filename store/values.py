@@ -76,6 +76,13 @@ class Value:
     @abstractmethod
     def get_bytes(self)->bytearray:
         pass
+
+    def key_bytes(self)->bytes:
+        """
+        保序的二进制编码, 编码后按字节比较的结果和按值比较的结果一致, 不包含null标识
+        :return:
+        """
+        raise Exception(f'{self.type_enum()} 不支持作为key')
 class ByteArray(Value):
     def __init__(self,value:bytearray|None):
         super().__init__()
@@ -92,6 +99,8 @@ class ByteArray(Value):
 
     def get_bytes(self) -> bytearray:
         return self.value
+    def key_bytes(self) -> bytes:
+        return escape_key_bytes(self.value)
     def __repr__(self):
         return f"bytearray:{self.value}"
     @staticmethod
@@ -116,7 +125,8 @@ class StrValue(Value):
 
     @staticmethod
     def from_bytes(value:bytearray)->Value|None:
-        if not value:
+        # 空字符串不是 null
+        if value is None:
             return None
         return StrValue(value.decode('utf8'))
     @staticmethod
@@ -143,6 +153,10 @@ class StrValue(Value):
             self.init_result()
         return self.bytes_content
 
+    def key_bytes(self) -> bytes:
+        # utf-8 的字节序和 unicode 码点的顺序一致
+        return escape_key_bytes(self.get_bytes())
+
     def __repr__(self):
         return f"str:{self.value}"
 
@@ -152,6 +166,19 @@ def int_to_bytes(num,size,signed = True):
     # size = math.ceil(num.bit_length() / 8)
     return num.to_bytes(size, byteorder='little', signed=signed)
 
+def int_to_key_bytes(num,size):
+    """
+    有符号整数的保序编码: 翻转符号位后按大端存储
+    """
+    return (num + (1 << (size * 8 - 1))).to_bytes(size, byteorder='big')
+
+def escape_key_bytes(b)->bytes:
+    """
+    变长数据的保序编码: 0x00 转义为 0x00 0xFF, 以 0x00 0x00 结尾
+    保证较短的数据总是排在以它为前缀的数据之前，并且组合key中后续的列不会影响前面列的比较
+    """
+    return bytes(b).replace(b'\x00', b'\x00\xff') + b'\x00\x00'
+
 class ShortValue(Value):
     """
         2 字节
@@ -179,6 +206,8 @@ class ShortValue(Value):
     @staticmethod
     def type_enum() -> ValueType:
         return ValueType.SHORT
+    def key_bytes(self) -> bytes:
+        return int_to_key_bytes(self.value,2)
     def __repr__(self):
         return f"short:{self.value}"
 
@@ -209,6 +238,8 @@ class IntValue(Value):
     def from_bytes(value:bytearray)->Value|None:
         return IntValue(int.from_bytes(value, byteorder='little', signed=True))
 
+    def key_bytes(self) -> bytes:
+        return int_to_key_bytes(self.value,4)
     def __repr__(self):
         return f"int:{self.value}"
 
@@ -228,6 +259,8 @@ class LongValue(Value):
         self.is_null = value is None
         if  not self.is_null:
             self.bytes_content = int_to_bytes(value,8)
+    def key_bytes(self) -> bytes:
+        return int_to_key_bytes(self.value,8)
     def __repr__(self):
         return f'long:{self.value}'
 
@@ -265,6 +298,9 @@ class BoolValue(Value):
     def type_enum() -> ValueType:
         return ValueType.BOOL
 
+    def key_bytes(self) -> bytes:
+        return b'\x01' if self.value else b'\x00'
+
     @staticmethod
     def from_bytes(value:bytearray)->Value|None:
         return BoolValue(struct.unpack('<b',value)[0] == 1)
@@ -420,15 +456,37 @@ class Row:
         for v1,v2 in zip(self.values,other.values):
             if v1 > v2:
                 return True
+            elif v1 < v2:
+                return False
         return False
 
     def __lt__(self, other):
         for v1,v2 in zip(self.values,other.values):
             if v1 < v2:
                 return True
+            elif v1 > v2:
+                return False
         return False
 
 
+# key 编码中 null 的标识, null 排在所有非 null 值的前面
+KEY_NULL = b'\x00'
+KEY_NOT_NULL = b'\x01'
+
+def encode_key(row:Row)->bytes:
+    """
+    将 key 编码为保序的字节串，两个key编码后按字节比较(memcmp)的结果和按列依次比较的结果一致
+    每一列的编码都是自定界的，所以 key 前几列的编码总是完整 key 编码的前缀
+    """
+    result = bytearray()
+    for value in row.values:
+        if value.is_null:
+            result.extend(KEY_NULL)
+        else:
+            result.extend(KEY_NOT_NULL)
+            result.extend(value.key_bytes())
+    return bytes(result)
+
 def over_flow_row(v: bytearray):
     return Row([ByteArray(v)])
 
@@ -41,7 +41,8 @@ def test_tree(name:str):
 
 def recovery(name:str):
     container = Container.open_container(name,False)
-    for i in binlog.read_log_entry(0):
+    # checkpoint 之前的日志对应的页面都已经写入 container
+    for i in binlog.read_log_entry(config.get_check_point()):
         i:PhysicalPageLogEntry
         page = container.get_page(i.page_id)
         if i.get_entry_pos() >= page.lsn:
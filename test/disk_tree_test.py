@@ -6,19 +6,38 @@ def del_tree(t: BTree, start, end):
         t.delete(generate_row([i + 1]))
 
 def test_count(t:BTree):
-    node2 = t.search(generate_row([0]))
     count = 0
-    while node2:
-        count += node2.row_num()
-        if node2.row_num() == 0:
-            pass
-        else:
-            for i in range(node2.row_num()):
-                print(node2.get_row_i(i), end=',')
-            print()
-        node2 = node2.get_right_node()
+    for row in t.scan():
+        count += 1
+        print(row, end=',')
+    print()
     print(count)
 
+def check_tree(t: BTree):
+    """
+    检查 btree 的结构: 除根节点之外的分支节点至少有两个子节点, 每一层的节点通过左右指针按顺序连接
+    """
+    level = [t.tree]
+    while True:
+        for i, node in enumerate(level):
+            assert node.left() == (level[i - 1].page_num() if i > 0 else -1)
+            assert node.right() == (level[i + 1].page_num() if i + 1 < len(level) else -1)
+        if isinstance(level[0], LeafNode):
+            return
+        for node in level:
+            assert node is t.tree or node.row_num() >= 2
+        level = [t.read_node(node.get_child_i(i)) for node in level for i in range(node.row_num())]
+
+def leaf_count(t: BTree):
+    node = t.tree
+    while isinstance(node, BranchNode):
+        node = t.read_node(node.get_child_i(0))
+    count = 1
+    while node.right() != -1:
+        node = node.get_right_node()
+        count += 1
+    return count
+
 # 普通增删改查
 def test_tree1():
     info = BTreeInfo("my_tree1",-1,1,False,[IntValue,StrValue])
@@ -227,3 +246,564 @@ def test_tree5():
 
 
 
+
+
+def test_tree6():
+    """
+    测试 页大小迁移
+    :return:
+    """
+    info = BTreeInfo("my_tree6",-1,1,False,[IntValue,StrValue])
+    BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+    t = BTree.open_btree("my_tree6")
+    for i in range(500):
+        t.insert(generate_row([i, "hello"]))
+    t.container.flush()
+    t.container.close()
+    BTree.migrate_btree("my_tree6",16 * 1024)
+    t = BTree.open_btree("my_tree6")
+    print(t.container.page_size)
+    test_count(t)
+    t.container.close()
+
+
+def test_tree7():
+    """
+    测试 page cleaner 写回脏页并记录 checkpoint
+    :return:
+    """
+    from store.pagecleaner import page_cleaner
+    from store.pagedatacache import page_data_cache
+    from store.log.binlog import binlog
+    info = BTreeInfo("my_tree7",-1,1,False,[IntValue,StrValue])
+    BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+    t = BTree.open_btree("my_tree7")
+    for i in range(500):
+        t.insert(generate_row([i, "hello"]))
+    check_point = config.get_check_point()
+    while page_cleaner.clean() > 0:
+        pass
+    # 没有日志时不记录 checkpoint
+    if not config.OPEN_BINLOG:
+        assert config.get_check_point() == check_point
+    print(config.get_check_point(), binlog.log_end_pos())
+    assert not any(page.dirty for page in page_data_cache.container_pages(t.container.container_id))
+    t.container.close()
+    t = BTree.open_btree("my_tree7")
+    test_count(t)
+    t.container.close()
+
+
+def test_tree8():
+    """
+    测试 bulk_load，输入没有排序
+    :return:
+    """
+    import random
+    info = BTreeInfo("my_tree8",-1,1,False,[IntValue,StrValue])
+    BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+    t = BTree.open_btree("my_tree8")
+    keys = list(range(1000))
+    random.shuffle(keys)
+    t.bulk_load((generate_row([i, "hello"]) for i in keys), fill_factor=0.8, is_sorted=False)
+    for i in range(1000, 1100):
+        t.insert(generate_row([i, "hello"]))
+    test_count(t)
+    t.container.close()
+
+
+def test_tree9():
+    """
+    测试 大量删除之后整理 btree
+    :return:
+    """
+    import random
+    rand = random.Random(11)
+    info = BTreeInfo("my_tree9",-1,1,False,[IntValue,StrValue])
+    BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+    t = BTree.open_btree("my_tree9")
+    keys = set()
+    for _ in range(2):
+        batch = {rand.randint(0, 5000) for _ in range(1500)}
+        t.insert_many(generate_row([i, "hello" * rand.randint(0, 8)]) for i in batch)
+        keys |= batch
+        for i in rand.sample(sorted(keys), len(keys) // 2):
+            keys.remove(i)
+            assert t.delete(generate_row([i]))
+    leaves = leaf_count(t)
+    assert t.defragment() > 0
+    # 已经整理过，没有可以释放的页面
+    assert t.defragment() == 0
+    assert leaf_count(t) < leaves
+    check_tree(t)
+    assert [row.values[0].value for row in t.scan()] == sorted(keys)
+    for i in rand.sample(sorted(keys), len(keys)):
+        assert t.delete(generate_row([i]))
+    assert list(t.scan()) == []
+    t.container.close()
+
+
+def test_tree10():
+    """
+    测试 范围删除
+    :return:
+    """
+    info = BTreeInfo("my_tree10",-1,1,False,[IntValue,StrValue])
+    BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+    t = BTree.open_btree("my_tree10")
+    for i in range(1000):
+        t.insert(generate_row([i, "hello"]))
+    assert t.delete_range(generate_row([100]), generate_row([900]), True, False) == 800
+    keys = [i for i in range(1000) if not 100 <= i < 900]
+    assert [row.values[0].value for row in t.scan()] == keys
+    check_tree(t)
+    for i in keys:
+        assert t.delete(generate_row([i]))
+    assert list(t.scan()) == []
+    t.container.close()
+
+    # 按前缀删除，被删除的行在多个叶子节点中
+    info = BTreeInfo("my_tree10_prefix",-1,2,False,[StrValue,IntValue,StrValue])
+    BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+    t = BTree.open_btree("my_tree10_prefix")
+    for p in "amz":
+        for i in range(300):
+            t.insert(generate_row([p, i, "hello"]))
+    assert t.delete_range(generate_row(["m"]), generate_row(["m"])) == 300
+    assert t.delete_range(generate_row(["a", 100]), generate_row(["a"]), False, True) == 199
+    keys = [("a", i) for i in range(101)] + [("z", i) for i in range(300)]
+    assert [(row.values[0].value, row.values[1].value) for row in t.scan()] == keys
+    check_tree(t)
+    for p, i in reversed(keys):
+        assert t.delete(generate_row([p, i]))
+    assert list(t.scan()) == []
+    t.container.close()
+
+    # 重复的 key 分布在多个叶子节点中
+    info = BTreeInfo("my_tree10_dup",-1,1,True,[IntValue,IntValue])
+    BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+    t = BTree.open_btree("my_tree10_dup")
+    for j in range(900):
+        t.insert(generate_row([j % 6, j]))
+    assert t.delete_range(generate_row([2]), generate_row([2])) == 150
+    assert t.delete_range(generate_row([3]), generate_row([5]), False, True) == 300
+    check_tree(t)
+    keys = [0, 1, 3]
+    assert sorted(row.values[0].value for row in t.scan()) == sorted(keys * 150)
+    for k in keys:
+        assert t.delete_range(generate_row([k]), generate_row([k])) == 150
+        check_tree(t)
+    assert list(t.scan()) == []
+    t.container.close()
+
+    # 长字段使用 over flow 页面，范围删除之后页面需要全部释放
+    def allocated_count(name):
+        # 重新打开之后 extent 中没有使用的页面已经释放
+        t = BTree.open_btree(name)
+        count = t.container.page_manager.allocated_count()
+        t.container.close()
+        return count
+    info = BTreeInfo("my_tree10_over_flow",-1,1,False,[IntValue,StrValue,StrValue])
+    BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+    empty = allocated_count("my_tree10_over_flow")
+    t = BTree.open_btree("my_tree10_over_flow")
+    for i in range(600):
+        t.insert(generate_row([i, "a" * (i * 37 % 600), "b" * (i * 53 % 300)]))
+    t.container.close()
+    full = allocated_count("my_tree10_over_flow")
+    t = BTree.open_btree("my_tree10_over_flow")
+    assert t.delete_range(generate_row([50]), generate_row([550])) == 501
+    t.container.close()
+    assert allocated_count("my_tree10_over_flow") < full // 4
+    t = BTree.open_btree("my_tree10_over_flow")
+    assert t.delete_range(generate_row([0]), generate_row([600])) == 99
+    assert list(t.scan()) == []
+    t.container.close()
+    assert allocated_count("my_tree10_over_flow") == empty
+
+
+def test_tree11():
+    """
+    测试 记录子树行数的 btree: count、rank、nth，和不记录行数的 btree 的结果比较
+    :return:
+    """
+    import bisect
+    import random
+    def check(t: BTree, keys):
+        assert t.count() == len(keys)
+        for lo, hi in ((100, 200), (-5, 50), (333, 2000), (500, 500), (700, 600)):
+            for lo_inclusive in (True, False):
+                for hi_inclusive in (True, False):
+                    lo_i = bisect.bisect_left(keys, lo) if lo_inclusive else bisect.bisect_right(keys, lo)
+                    hi_i = bisect.bisect_right(keys, hi) if hi_inclusive else bisect.bisect_left(keys, hi)
+                    assert t.count(generate_row([lo]), generate_row([hi]), lo_inclusive, hi_inclusive) == max(0, hi_i - lo_i)
+        for k in range(-1, 1102, 17):
+            assert t.rank(generate_row([k])) == bisect.bisect_left(keys, k)
+        for i in range(-1, len(keys) + 2, 17):
+            row = t.nth(i)
+            if 0 <= i < len(keys):
+                assert row.values[0].value == keys[i]
+            else:
+                assert row is None
+
+    for counted in (True, False):
+        rand = random.Random(11)
+        name = "my_tree11" if counted else "my_tree11_uncounted"
+        info = BTreeInfo(name,-1,1,False,[IntValue,StrValue],counted=counted)
+        BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+        t = BTree.open_btree(name)
+        keys = list(range(1000))
+        rand.shuffle(keys)
+        for i in keys:
+            t.insert(generate_row([i, "hello"]))
+        keys.sort()
+        check(t, keys)
+        for i in range(0, 1000, 3):
+            assert t.delete(generate_row([i]))
+        keys = [i for i in keys if i % 3 != 0]
+        check(t, keys)
+        assert t.delete_range(generate_row([100]), generate_row([200])) == 68
+        keys = [i for i in keys if not 100 <= i <= 200]
+        check(t, keys)
+        t.container.close()
+        t = BTree.open_btree(name)
+        check(t, keys)
+        for i in range(1000, 1100):
+            t.insert(generate_row([i, "hello"]))
+        keys += list(range(1000, 1100))
+        check(t, keys)
+        t.container.close()
+
+
+def test_tree12():
+    """
+    测试 批量查找 get_many: 输入的 key 没有排序并且有重复，结果和输入的位置对应
+    :return:
+    """
+    import random
+    rand = random.Random(12)
+    info = BTreeInfo("my_tree12",-1,1,False,[IntValue,StrValue])
+    BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+    t = BTree.open_btree("my_tree12")
+    assert t.get_many([generate_row([1]), generate_row([2])]) == [None, None]
+    for i in range(0, 2000, 2):
+        t.insert(generate_row([i, f"value{i}"]))
+    keys = [rand.randint(-10, 2010) for _ in range(1500)] + [0, 1998, 0, 1998, 5, 5]
+    rand.shuffle(keys)
+    result = t.get_many(generate_row([i]) for i in keys)
+    assert len(result) == len(keys)
+    for i, row in zip(keys, result):
+        if 0 <= i < 2000 and i % 2 == 0:
+            assert row.values[0].value == i and row.values[1].value == f"value{i}"
+        else:
+            assert row is None
+    t.container.close()
+
+
+def test_tree13():
+    """
+    测试 叶子节点的已用空间低于 BTREE_MERGE_FILL_FACTOR 时就和兄弟节点合并，不需要等到只剩一行
+    :return:
+    """
+    merge_fill_factor = config.BTREE_MERGE_FILL_FACTOR
+    config.BTREE_MERGE_FILL_FACTOR = 0.5
+    try:
+        # 页面需要能放下足够多的行，阈值和只剩一行才能区分开
+        page_size = config.MIN_PAGE_SIZE * 4
+        info = BTreeInfo("my_tree13",-1,1,False,[IntValue,StrValue])
+        BTree.create_btree(info,True,page_size=page_size)
+        t = BTree.open_btree("my_tree13")
+        count = 0
+        while isinstance(t.tree, LeafNode):
+            t.insert(generate_row([count, "h"]))
+            count += 1
+        threshold = config.BTREE_MERGE_FILL_FACTOR * page_size
+        key = 0
+        while isinstance(t.tree, BranchNode):
+            left = t.read_node(t.tree.get_child_i(0))
+            # 已用空间低于阈值的叶子节点在上一次删除时就已经合并
+            assert left.used_space() >= threshold
+            row_num = left.row_num()
+            assert t.delete(generate_row([key]))
+            key += 1
+        assert row_num > 2
+        assert [row.values[0].value for row in t.scan()] == list(range(key, count))
+        t.container.close()
+    finally:
+        config.BTREE_MERGE_FILL_FACTOR = merge_fill_factor
+
+
+def test_tree14():
+    """
+    测试 缓冲池只能放下几个页面时，修改过程中读取和创建的页面会淘汰其他页面，淘汰的脏页写回之后重新读取的内容正确
+    只有根节点一直 pin，修改操作结束之后其他页面都已经 unpin
+    :return:
+    """
+    import random
+    from store.pagedatacache import page_data_cache
+    capacity = page_data_cache.capacity()
+    page_data_cache.resize(8 * config.MIN_PAGE_SIZE)
+    try:
+        rand = random.Random(14)
+        info = BTreeInfo("my_tree14",-1,1,False,[IntValue,StrValue])
+        BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+        t = BTree.open_btree("my_tree14")
+        rows = {}
+
+        def check(t: BTree):
+            pinned = [page.page_num for page in page_data_cache.container_pages(t.container.container_id) if page.pin_count > 0]
+            assert pinned == [t.tree.page_num()]
+            assert {row.values[0].value: row.values[1].value for row in t.scan()} == rows
+
+        for _ in range(3):
+            batch = {rand.randint(0, 2000): "hello" * rand.choice([0, 1, 10, 100]) for _ in range(300)}
+            t.insert_many(generate_row([k, v]) for k, v in batch.items())
+            rows.update(batch)
+            check(t)
+            # 暂停的 scan 持有叶子节点，不能让叶子节点的页面一直 pin
+            suspended_scan = t.scan()
+            next(suspended_scan)
+            for k in rand.sample(sorted(rows), 50):
+                rows[k] = "world" * rand.choice([0, 1, 10, 100])
+                t.update(generate_row([k, rows[k]]))
+            for k in rand.sample(sorted(rows), 50):
+                del rows[k]
+                assert t.delete(generate_row([k]))
+            check(t)
+            keys = rand.sample(sorted(rows), len(rows) // 3)
+            assert t.delete_many(generate_row([k]) for k in keys) == len(keys)
+            for k in keys:
+                del rows[k]
+            lo = rand.randint(0, 1500)
+            removed = [k for k in rows if lo <= k <= lo + 300]
+            assert t.delete_range(generate_row([lo]), generate_row([lo + 300])) == len(removed)
+            for k in removed:
+                del rows[k]
+            t.defragment()
+            check(t)
+            suspended_scan.close()
+        # btree 的页面远多于缓冲池能放下的页面
+        assert t.container.page_manager.allocated_count() > 4 * page_data_cache.capacity() // config.MIN_PAGE_SIZE
+        t.container.close()
+        t = BTree.open_btree("my_tree14")
+        check(t)
+        t.container.close()
+    finally:
+        page_data_cache.resize(capacity)
+
+
+def test_tree15():
+    """
+    测试 mmap 模式下的插入、删除和重新打开
+    文件变大时重新映射，还在使用的旧映射延迟到 close 时关闭，修改的页面复制为 bytearray，写回之后重新读取的内容正确
+    :return:
+    """
+    import random
+    from store.pagedatacache import page_data_cache
+    mmap_enabled = config.CONTAINER_MMAP
+    capacity = page_data_cache.capacity()
+    config.CONTAINER_MMAP = True
+    page_data_cache.resize(32 * config.MIN_PAGE_SIZE)
+    try:
+        rand = random.Random(15)
+        info = BTreeInfo("my_tree15",-1,1,False,[IntValue,StrValue])
+        BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+        t = BTree.open_btree("my_tree15")
+        assert t.container.use_mmap
+        rows = {}
+        for i in range(1000):
+            rows[i] = "hello" * rand.choice([0, 1, 10, 100])
+            t.insert(generate_row([i, rows[i]]))
+        for k in rand.sample(sorted(rows), 300):
+            del rows[k]
+            assert t.delete(generate_row([k]))
+        t.container.close()
+
+        t = BTree.open_btree("my_tree15")
+        assert {row.values[0].value: row.values[1].value for row in t.scan()} == rows
+        # 最左侧的叶子节点之后不会被修改，页面内容一直是文件映射的 memoryview
+        leaf = t.search_part(generate_row([0]))
+        leaf_page = leaf.page
+        leaf_data = bytes(leaf_page.page_data)
+        assert isinstance(leaf_page.page_data, memoryview)
+        leaf_mmap = leaf_page.page_data.obj
+        # 在最右侧插入, 文件变大之后重新映射，旧映射还有页面引用，不能立即关闭
+        for i in range(1000, 3000):
+            rows[i] = "world" * rand.choice([0, 1, 10, 100])
+            t.insert(generate_row([i, rows[i]]))
+        assert leaf_mmap in t.container._old_mmaps and not leaf_mmap.closed
+        assert isinstance(leaf_page.page_data, memoryview) and bytes(leaf_page.page_data) == leaf_data
+        for k in rand.sample(sorted(rows), 500):
+            del rows[k]
+            assert t.delete(generate_row([k]))
+        assert {row.values[0].value: row.values[1].value for row in t.scan()} == rows
+        del leaf, leaf_page
+        t.container.close()
+        assert leaf_mmap.closed and t.container._mmap is None and t.container._old_mmaps == []
+
+        t = BTree.open_btree("my_tree15")
+        assert {row.values[0].value: row.values[1].value for row in t.scan()} == rows
+        check_tree(t)
+        t.container.close()
+    finally:
+        config.CONTAINER_MMAP = mmap_enabled
+        page_data_cache.resize(capacity)
+
+
+def test_tree16():
+    """
+    测试 key 递增插入时按照 append_split_percent split
+    除了最右侧的节点, 叶子节点保留的行数由比例决定; 分支节点 split 之后两边至少有两个子节点
+    :return:
+    """
+    fills = {}
+    for percent in [100, 90, 50]:
+        name = f"my_tree16_{percent}"
+        # 节点能放下足够多的行，不同的比例 split 的位置不同
+        BTree.create_btree(BTreeInfo(name,-1,1,False,[IntValue,StrValue],append_split_percent=percent),True,
+                           page_size=config.MIN_PAGE_SIZE * 4)
+        t = BTree.open_btree(name)
+        assert t.append_split_percent == percent
+        for i in range(3000):
+            t.insert(generate_row([i, "hello"]))
+            # 最右侧的分支节点刚 split 之后也至少有两个子节点
+            node = t.tree
+            while isinstance(node, BranchNode):
+                assert node is t.tree or node.row_num() >= 2
+                node = t.read_node(node.get_child_i(node.row_num() - 1))
+        check_tree(t)
+        assert isinstance(t.tree, BranchNode) and isinstance(t.read_node(t.tree.get_child_i(0)), BranchNode)
+        assert [row.values[0].value for row in t.scan()] == list(range(3000))
+        node = t.search_part(generate_row([0]))
+        fills[percent] = []
+        while True:
+            fills[percent].append(node.row_num())
+            if node.right() == -1:
+                break
+            node = node.get_right_node()
+        t.container.close()
+    # 100 时节点放满之后才 split, 第一个节点的行数就是一个节点能放下的行数
+    full = fills[100][0]
+    for percent, fill in fills.items():
+        left = min(full, max(1, (full + 1) * percent // 100))
+        assert all(row_num == left for row_num in fill[:-1]) and 0 < fill[-1] <= full
+        assert len(fill) == (3000 - fill[-1]) // left + 1
+    assert len(fills[100]) < len(fills[90]) < len(fills[50])
+
+
+def test_tree17():
+    """
+    测试 没有 append_split_percent 和 counted 字段的旧 btree 信息, 打开时使用默认值
+    :return:
+    """
+    info = BTreeInfo("my_tree17",-1,1,False,[IntValue,StrValue])
+    if not config.container_exists("my_tree17"):
+        config.add_container("my_tree17")
+        container = Container.open_container("my_tree17", page_size=config.MIN_PAGE_SIZE)
+        btree_info_page = container.new_common_page(is_over_flow=False)
+        with btree_info_page.pinned():
+            root_page = container.new_common_page()
+            root_page.set_node_header(LEAF_NODE, -1, -1)
+            info.root = root_page.page_num
+            # 旧的 btree 信息只有前 5 个字段
+            btree_info_page.insert_to_last_slot(Row(info.to_value_list()[:5]))
+        container.close()
+    t = BTree.open_btree("my_tree17")
+    assert t.container.get_page(config.BTREE_INFO_PAGE_NUM).read_slot(0).header.col_num == 5
+    assert t.append_split_percent == config.BTREE_APPEND_SPLIT_PERCENT and not t.counted
+    for i in range(500):
+        t.insert(generate_row([i, "hello"]))
+    assert t.count() == 500
+    t.container.close()
+    # 根节点变化之后仍然可以打开
+    t = BTree.open_btree("my_tree17")
+    assert [row.values[0].value for row in t.scan()] == list(range(500))
+    t.container.close()
+
+
+def test_tree18():
+    """
+    测试 叶子节点、分支节点和溢出页从各自预留的 extent 中分配，close 时释放预留但没有使用的页面
+    :return:
+    """
+    info = BTreeInfo("my_tree18",-1,1,False,[IntValue,StrValue])
+    BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+    t = BTree.open_btree("my_tree18")
+    for i in range(300):
+        t.insert(generate_row([i, "hello" * (40 if i % 10 == 0 else 1)]))
+    page_manager = t.container.page_manager
+    reserved = [page_num for page_nums in t.container.extents.values() for page_num in page_nums]
+    assert len(reserved) > 0 and all(page_manager.is_allocated(page_num) for page_num in reserved)
+    allocated = page_manager.allocated_pages()
+    assert set(reserved) <= set(allocated) and page_manager.allocated_count() == len(allocated)
+    # 按顺序插入时新的叶子节点依次从 extent 中分配，只有换到下一个 extent 时页号不连续
+    leaves = []
+    node = t.search_part(generate_row([0]))
+    while True:
+        leaves.append(node.page_num())
+        if node.right() == -1:
+            break
+        node = node.get_right_node()
+    gaps = sum(1 for a, b in zip(leaves, leaves[1:]) if b != a + 1)
+    # 第一个叶子节点是创建 btree 时分配的根节点，不在 extent 中
+    assert gaps <= (len(leaves) - 2) // config.EXTENT_PAGES + 1
+    t.container.close()
+
+    t = BTree.open_btree("my_tree18")
+    page_manager = t.container.page_manager
+    assert not any(page_manager.is_allocated(page_num) for page_num in reserved)
+    assert page_manager.allocated_pages() == [page_num for page_num in allocated if page_num not in reserved]
+    assert page_manager.allocated_count() == len(allocated) - len(reserved)
+    assert [row.values[0].value for row in t.scan()] == list(range(300))
+    t.container.close()
+
+
+def test_tree19():
+    """
+    测试 冷启动时沿着叶子节点链表顺序读取会预读后续的页面，读取的行和写入的一致
+    预读跳过已经释放的页面，缓冲池很小时预读的页面被淘汰之后重新读取的内容也正确
+    :return:
+    """
+    import random
+    from store.pagedatacache import page_data_cache
+    read_ahead_pages, mmap_enabled = config.READ_AHEAD_PAGES, config.CONTAINER_MMAP
+    capacity = page_data_cache.capacity()
+    config.READ_AHEAD_PAGES, config.CONTAINER_MMAP = 8, False
+    try:
+        rand = random.Random(19)
+        info = BTreeInfo("my_tree19",-1,1,False,[IntValue,StrValue])
+        BTree.create_btree(info,True,page_size=config.MIN_PAGE_SIZE)
+        t = BTree.open_btree("my_tree19")
+        rows = {i: "hello" * rand.choice([0, 1, 10, 100]) for i in range(2000)}
+        for k, v in rows.items():
+            t.insert(generate_row([k, v]))
+        # 中间的叶子节点和溢出页被释放
+        assert t.delete_range(generate_row([500]), generate_row([899])) == 400
+        for k in range(500, 900):
+            del rows[k]
+        t.container.close()
+
+        for pool_pages in [0, 8]:
+            if pool_pages:
+                page_data_cache.resize(pool_pages * config.MIN_PAGE_SIZE)
+            t = BTree.open_btree("my_tree19")
+            container = t.container
+            loads = []
+            load_page_data = container.load_page_data
+            container.load_page_data = lambda page_num: loads.append(page_num) or load_page_data(page_num)
+            assert {row.values[0].value: row.values[1].value for row in t.scan()} == rows
+            scan_loads = len(loads)
+            node, leaves = t.search_part(generate_row([0])), 1
+            while node.right() != -1:
+                node, leaves = node.get_right_node(), leaves + 1
+            if not pool_pages:
+                # 顺序读取的叶子节点和溢出页大部分由预读读入
+                assert scan_loads < leaves
+            assert all(page.page_num % (container.page_manager.management_capacity + 1) == 0 or
+                       container.page_manager.is_allocated(page.page_num)
+                       for page in page_data_cache.container_pages(container.container_id))
+            del container.load_page_data
+            container.close()
+    finally:
+        config.READ_AHEAD_PAGES, config.CONTAINER_MMAP = read_ahead_pages, mmap_enabled
+        page_data_cache.resize(capacity)
@@ -0,0 +1,223 @@
+import struct
+from pathlib import Path
+
+from store.disk_tree import *
+from store.cacheable import MANAGEMENT_PAGE, NORMAL_PAGE, OVER_FLOW_PAGE
+from store.legacy import LegacyContainer, LEGACY_PAGE_SIZE, LEGACY_LEAF_NODE
+from store.page import SLOT_TABLE_ENTRY_SIZE, FIELD_NOT_OVER_FLOW, FIELD_OVER_FLOW, FIELD_NOT_OVER_FLOW_NULL
+
+# 旧格式分支节点的类型
+LEGACY_BRANCH_NODE = 1
+# 字段在节点中最多保存的数据长度，剩下的数据写入溢出链
+LEGACY_INLINE_LENGTH = 16
+# 溢出链中每一段的数据长度
+LEGACY_CHUNK_LENGTH = 120
+
+
+class LegacyWriter:
+    """
+    按照旧格式生成 btree 的 container, 格式见 LegacyContainer
+    所有的行按照顺序写入叶子节点, 分支节点逐层向上生成, 每一层的节点通过左右指针连接
+    字段: (status, 当页的数据, 溢出链的 (page_num, record_id))
+    """
+
+    def __init__(self):
+        self.pages: List[bytearray] = []
+        # 每一页下一条记录写入的位置
+        self.write_offsets: List[int] = []
+        # 每一页的 slot 数量, 没有删除的记录，和下一个 record id 一致
+        self.slot_nums: List[int] = []
+        # 节点的 control row: node_type parent left right
+        self.controls: Dict[int, List[int]] = {}
+        self.new_page(MANAGEMENT_PAGE)
+        # page 1 存放 btree 的信息
+        self.new_page(NORMAL_PAGE)
+
+    def new_page(self, page_type: int) -> int:
+        page_data = bytearray(LEGACY_PAGE_SIZE)
+        page_data[0] = page_type
+        self.pages.append(page_data)
+        self.write_offsets.append(struct.calcsize(LegacyContainer.page_header_fmt()))
+        self.slot_nums.append(0)
+        return len(self.pages) - 1
+
+    @staticmethod
+    def field_length(field) -> int:
+        """
+        字段在当页占用的空间, 包括头部和溢出链的指针
+        """
+        status, data, over_flow = field
+        length = LegacyContainer.field_header_length() + len(data)
+        return length + (CommonPage.over_flow_field_data_size() if over_flow is not None else 0)
+
+    def add_record(self, page_num: int, fields) -> int:
+        """
+        :return: record id, 当前页没有足够的空间时返回 -1
+        """
+        page_data = self.pages[page_num]
+        slot = self.slot_nums[page_num]
+        offset = self.write_offsets[page_num]
+        length = CommonPage.record_header_size() + sum(self.field_length(field) for field in fields)
+        slot_offset = LEGACY_PAGE_SIZE - (slot + 1) * SLOT_TABLE_ENTRY_SIZE
+        if offset + length > slot_offset:
+            return -1
+        struct.pack_into(CommonPage.record_header_fmt(), page_data, offset, 0, slot, len(fields), -1, -1)
+        field_offset = offset + CommonPage.record_header_size()
+        for status, data, over_flow in fields:
+            struct.pack_into(LegacyContainer.field_header_fmt(), page_data, field_offset, status, len(data), len(data))
+            field_offset += LegacyContainer.field_header_length()
+            if over_flow is not None:
+                struct.pack_into('<ii', page_data, field_offset, *over_flow)
+                field_offset += CommonPage.over_flow_field_data_size()
+            page_data[field_offset:field_offset + len(data)] = data
+            field_offset += len(data)
+        struct.pack_into('<ii', page_data, slot_offset, offset, length)
+        self.write_offsets[page_num] = offset + length
+        self.slot_nums[page_num] = slot + 1
+        return slot
+
+    def write_over_flow(self, data: bytes):
+        """
+        从后往前写入溢出链, 每一段占用一个溢出页
+        :return: 第一段的 page_num, record_id
+        """
+        over_flow = None
+        chunks = [data[i:i + LEGACY_CHUNK_LENGTH] for i in range(0, len(data), LEGACY_CHUNK_LENGTH)]
+        for chunk in reversed(chunks):
+            page_num = self.new_page(OVER_FLOW_PAGE)
+            status = FIELD_NOT_OVER_FLOW if over_flow is None else FIELD_OVER_FLOW
+            over_flow = (page_num, self.add_record(page_num, [(status, chunk, over_flow)]))
+        return over_flow
+
+    def value_fields(self, values: List[Value]):
+        fields = []
+        for value in values:
+            if value.is_null:
+                fields.append((FIELD_NOT_OVER_FLOW_NULL, b'', None))
+                continue
+            data = bytes(value.get_bytes())
+            if len(data) <= LEGACY_INLINE_LENGTH:
+                fields.append((FIELD_NOT_OVER_FLOW, data, None))
+            else:
+                fields.append((FIELD_OVER_FLOW, data[:LEGACY_INLINE_LENGTH],
+                               self.write_over_flow(data[LEGACY_INLINE_LENGTH:])))
+        return fields
+
+    def write_level(self, node_type: int, items):
+        """
+        按顺序把记录写入同一层的节点
+        :param items: (fields, 子节点的 page_num)
+        :return: 每个节点的 page_num, 第一条记录, 子节点的 page_num
+        """
+        nodes = []
+        for fields, child in items:
+            if not nodes or self.add_record(nodes[-1][0], fields) == -1:
+                page_num = self.new_page(NORMAL_PAGE)
+                self.controls[page_num] = [node_type, -1, -1, -1]
+                self.add_record(page_num, self.value_fields([IntValue(0)] * 4))
+                if self.add_record(page_num, fields) == -1:
+                    raise Exception('记录超过了旧格式的页大小')
+                nodes.append((page_num, fields, []))
+            nodes[-1][2].append(child)
+        for i, (page_num, _, children) in enumerate(nodes):
+            self.controls[page_num][2] = nodes[i - 1][0] if i > 0 else -1
+            self.controls[page_num][3] = nodes[i + 1][0] if i + 1 < len(nodes) else -1
+            for child in children:
+                if child is not None:
+                    self.controls[child][1] = page_num
+        return nodes
+
+    def write_btree(self, info: BTreeInfo, rows: List[Row]):
+        """
+        :param info: 旧格式的 btree 信息只保存前 5 个字段
+        :param rows: 按照 key 排序的行
+        """
+        level = self.write_level(LEGACY_LEAF_NODE, [(self.value_fields(row.values), None) for row in rows])
+        if not level:
+            page_num = self.new_page(NORMAL_PAGE)
+            self.controls[page_num] = [LEGACY_LEAF_NODE, -1, -1, -1]
+            self.add_record(page_num, self.value_fields([IntValue(0)] * 4))
+            level = [(page_num, [], [])]
+        while len(level) > 1:
+            level = self.write_level(LEGACY_BRANCH_NODE, [(fields[:info.key_len] + self.value_fields([IntValue(page_num)]),
+                                                          page_num) for page_num, fields, _ in level])
+        info.root = level[0][0]
+        self.add_record(config.BTREE_INFO_PAGE_NUM, self.value_fields(info.to_value_list()[:5]))
+
+    def write(self, container_name: str):
+        for page_num, control in self.controls.items():
+            # control row 是 slot 0 的记录, 4 个 int 字段
+            field_offset = struct.calcsize(LegacyContainer.page_header_fmt()) + CommonPage.record_header_size()
+            for value in control:
+                struct.pack_into('<i', self.pages[page_num], field_offset + LegacyContainer.field_header_length(), value)
+                field_offset += LegacyContainer.field_header_length() + IntValue(0).space_use()
+        for page_num in range(1, len(self.pages)):
+            struct.pack_into(LegacyContainer.page_header_fmt(), self.pages[page_num], 0, self.pages[page_num][0],
+                             self.slot_nums[page_num], self.slot_nums[page_num], -1, 0)
+        management_header_size = struct.calcsize('<biiL')
+        capacity = (LEGACY_PAGE_SIZE - management_header_size) * 8
+        struct.pack_into('<biiL', self.pages[0], 0, MANAGEMENT_PAGE, capacity - (len(self.pages) - 1), -1, 0)
+        for page_num in range(1, len(self.pages)):
+            self.pages[0][management_header_size + (page_num - 1) // 8] |= 1 << ((page_num - 1) % 8)
+        config.add_container(container_name)
+        with open(Path(config.CONTAINER_PATH) / container_name, 'wb') as file:
+            for page_data in self.pages:
+                file.write(page_data)
+
+
+def create_legacy_btree(info: BTreeInfo, rows: List[Row]):
+    writer = LegacyWriter()
+    writer.write_btree(info, rows)
+    writer.write(info.name)
+
+
+def migrate_and_scan(name: str, page_size: int):
+    assert LegacyContainer.is_legacy(name)
+    opened = True
+    try:
+        BTree.open_btree(name)
+    except Exception as e:
+        print(e)
+        opened = False
+    assert not opened
+    BTree.migrate_btree(name, page_size)
+    assert not LegacyContainer.is_legacy(name)
+    t = BTree.open_btree(name)
+    assert t.container.page_size == page_size
+    rows = [[value.value for value in row.values] for row in t.scan()]
+    t.container.close()
+    return rows
+
+
+def test_legacy_migrate():
+    """
+    测试 旧格式的 btree 迁移, 包括溢出链、null 和多层的分支节点
+    :return:
+    """
+    rows = [[i, "x" * (i % 7 * 90 + 1), None if i % 3 == 0 else "s%d" % i] for i in range(120)]
+    rows.append([120, "", None])
+    info = BTreeInfo("legacy_tree1", -1, 1, False, [IntValue, StrValue, StrValue])
+    create_legacy_btree(info, [Row([IntValue(a), StrValue(b), StrValue(c)]) for a, b, c in rows])
+    assert migrate_and_scan("legacy_tree1", config.MIN_PAGE_SIZE * 4) == rows
+
+
+def test_legacy_migrate_duplicate_key():
+    """
+    测试 旧格式的 btree 迁移, key 重复
+    :return:
+    """
+    rows = sorted([[i % 20, i] for i in range(400)], key=lambda row: row[0])
+    info = BTreeInfo("legacy_tree2", -1, 1, True, [IntValue, IntValue])
+    create_legacy_btree(info, [generate_row(row) for row in rows])
+    migrated = migrate_and_scan("legacy_tree2", config.MIN_PAGE_SIZE)
+    assert [row[0] for row in migrated] == [row[0] for row in rows]
+    assert sorted(migrated) == sorted(rows)
+
+
+def test_legacy_migrate_empty():
+    """
+    测试 旧格式的空 btree 迁移
+    :return:
+    """
+    create_legacy_btree(BTreeInfo("legacy_tree3", -1, 1, False, [IntValue, StrValue]), [])
+    assert migrate_and_scan("legacy_tree3", config.MIN_PAGE_SIZE) == []